@@ -0,0 +1,159 @@
+# -*- encoding: utf-8 -*-
+"""end-to-end benchmark of the drivers against the local switch emulators
+
+run from the repository root:
+
+    python -m benchmarks.e2e [--latency MS] [--vlans 8,32,64] [--fleet 1,8,32]
+
+reports wall time, request count and bytes transferred(as seen by the
+emulators) for each driver operation at different VLAN counts, and for a
+backup + apply run over fleets of different sizes.
+"""
+import argparse
+import json
+import time
+from dataclasses import asdict, dataclass
+from functools import partial
+from typing import Callable, List, Tuple
+
+from prosafe.emulator import EMULATOR, EmulatedSwitch
+from prosafe.fleet import SwitchResult, SwitchStatus, run_fleet
+from prosafe.switches import SwitchModel
+from prosafe.switches.general import PvidConfig, VlanConfig, VlanPortMembership
+
+
+PASSWORD = 'password'
+
+
+@dataclass
+class Row:
+    scenario: str
+    model: str
+    vlans: int
+    fleet: int
+    wall_ms: float
+    requests: int
+    sent_kib: float
+    received_kib: float
+
+
+def make_state(port_count: int, vlan_count: int, shift: int = 0, replace: int = 0) -> Tuple[VlanConfig, PvidConfig]:
+    """port 1 is a trunk carrying every VLAN, other ports are spread over the VLANs as access ports
+
+    shift moves the access ports to other VLANs, replace swaps the last VLANs for new ones"""
+    vids = [1] + [100 + i for i in range(vlan_count - 1 - replace)] + [3000 + i for i in range(replace)]
+    vlans: VlanConfig = {vid: {pid: VlanPortMembership.IGNORED for pid in range(1, port_count + 1)} for vid in vids}
+    pvids: PvidConfig = dict()
+    for vid in vids:
+        vlans[vid][1] = VlanPortMembership.TAGGED
+    vlans[1][1] = VlanPortMembership.UNTAGGED
+    pvids[1] = 1
+    for pid in range(2, port_count + 1):
+        vid = vids[(pid + shift) % len(vids)]
+        vlans[vid][pid] = VlanPortMembership.UNTAGGED
+        pvids[pid] = vid
+    return vlans, pvids
+
+
+def measure(scenario: str, model: str, vlan_count: int, emulators: List[EmulatedSwitch], func: Callable) -> Row:
+    for emu in emulators:
+        emu.reset_stats()
+    start = time.perf_counter()
+    func()
+    wall = time.perf_counter() - start
+    return Row(scenario, model, vlan_count, len(emulators), wall * 1e3,
+               sum(e.request_count for e in emulators),
+               sum(e.bytes_received for e in emulators) / 1024,
+               sum(e.bytes_sent for e in emulators) / 1024)
+
+
+def bench_operations(model: str, vlan_count: int, latency: float) -> List[Row]:
+    emu_cls = EMULATOR[model]
+    vlan_count = min(vlan_count, emu_cls.max_vlans)
+    old_vlans, old_pvids = make_state(emu_cls.port_count, vlan_count)
+    # can't add before deleting when the VLAN table is full
+    replace = 2 if vlan_count + 2 <= emu_cls.max_vlans and vlan_count > 2 else 0
+    new_vlans, new_pvids = make_state(emu_cls.port_count, vlan_count, shift=1, replace=replace)
+
+    rows = []
+    with emu_cls(PASSWORD, latency, old_vlans, old_pvids) as emu:
+        sw = SwitchModel(model).driver(emu.address, PASSWORD)
+        m = partial(measure, model=model, vlan_count=vlan_count, emulators=[emu])
+        rows.append(m('login', func=sw.login))
+        rows.append(m('fetch_vlan_membership', func=sw.fetch_vlan_membership))
+        rows.append(m('fetch_pvids', func=sw.fetch_pvids))
+        rows.append(m('backup', func=sw.backup))
+        rows.append(m('apply(change)', func=lambda: sw.apply_vlan_config(new_vlans, new_pvids)))
+        rows.append(m('apply(no-op)', func=lambda: sw.apply_vlan_config(new_vlans, new_pvids)))
+        rows.append(m('logout', func=sw.logout))
+    return rows
+
+
+def _fleet_task(sw_name: str, cfg, new_state) -> SwitchResult:
+    address, model = cfg
+    result = SwitchResult(sw_name)
+    start = time.monotonic()
+    sw = SwitchModel(model).driver(address, PASSWORD)
+    with sw.logged_in():
+        sw.backup()
+        sw.apply_vlan_config(*new_state)
+    result.status = SwitchStatus.OK
+    result.wall_time = time.monotonic() - start
+    result.request_count = sw.request_count
+    return result
+
+
+def bench_fleet(model: str, fleet_size: int, vlan_count: int, jobs: int, latency: float) -> Row:
+    emu_cls = EMULATOR[model]
+    vlan_count = min(vlan_count, emu_cls.max_vlans)
+    old_state = make_state(emu_cls.port_count, vlan_count)
+    new_state = make_state(emu_cls.port_count, vlan_count, shift=1)
+    emulators = [emu_cls(PASSWORD, latency, *old_state).start() for _ in range(fleet_size)]
+    try:
+        cfgs = {f'sw{i}': (emu.address, model) for i, emu in enumerate(emulators)}
+        task = partial(_fleet_task, new_state=new_state)
+        return measure(f'fleet backup+apply -j{jobs}', model, vlan_count, emulators,
+                       lambda: run_fleet(cfgs, task, jobs=jobs, fail_fast=True))
+    finally:
+        for emu in emulators:
+            emu.stop()
+
+
+def _int_list(text: str) -> List[int]:
+    return [int(i) for i in text.split(',') if i]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=5., help='time an emulator takes per request, one request at a time, in ms')
+    parser.add_argument('--vlans', type=_int_list, default=[8, 32, 64], help='VLAN counts, comma separated')
+    parser.add_argument('--fleet', type=_int_list, default=[1, 8, 32], help='fleet sizes, comma separated')
+    parser.add_argument('--fleet-vlans', type=int, default=8, help='VLANs per switch in the fleet runs')
+    parser.add_argument('--jobs', type=int, default=8, help='parallel switches in the fleet runs')
+    parser.add_argument('--model', action='append', choices=list(EMULATOR), help='only these models')
+    parser.add_argument('--json', help='also dump the results to this file')
+    args = parser.parse_args()
+
+    latency = args.latency / 1e3
+    models = args.model or list(EMULATOR)
+    rows: List[Row] = []
+    for model in models:
+        for vlan_count in args.vlans:
+            rows += bench_operations(model, vlan_count, latency)
+        for fleet_size in args.fleet:
+            rows.append(bench_fleet(model, fleet_size, args.fleet_vlans, min(args.jobs, fleet_size), latency))
+
+    print("%-28s %-9s %5s %5s %10s %8s %9s %9s" % (
+        'scenario', 'model', 'vlans', 'fleet', 'wall(ms)', 'requests', 'sent(KiB)', 'recv(KiB)'))
+    for r in rows:
+        # sent/received from the client's point of view
+        print("%-28s %-9s %5d %5d %10.1f %8d %9.1f %9.1f" % (
+            r.scenario, r.model, r.vlans, r.fleet, r.wall_ms, r.requests, r.sent_kib, r.received_kib))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([asdict(r) for r in rows], f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# -*- encoding: utf-8 -*-
+"""parser micro-benchmark: BeautifulSoup vs prosafe.switches.extract
+
+run from the repository root:
+
+    python -m benchmarks.extract [--number N]
+"""
+import argparse
+import timeit
+from functools import partial
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+from prosafe.switches import extract
+from prosafe.switches.gs108ev3.switch import Switch as GS108Ev3
+
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+BeautifulSoup = partial(BeautifulSoup, features="html.parser")
+
+
+def _load(name: str) -> str:
+    return (FIXTURES / name).read_text()
+
+
+def _bs_options(text: str):
+    selection = BeautifulSoup(text).find('select', id='vlanIdOption')
+    return [op.get('value') for op in selection.find_all('option')]
+
+
+def _bs_pvids(text: str):
+    soup = BeautifulSoup(text)
+    pvids = dict()
+    for port in soup.find_all('tr', attrs={'class': 'portID'}):
+        pvid = int(port.find('td', attrs={'class': 'def', 'sel': 'input'}).text)
+        pid = int(port.find('input', attrs={'type': 'hidden'}).get('value'))
+        pvids[pid] = pvid
+    return pvids
+
+
+class _PvidPage:
+    """just enough of a session to feed a saved page to fetch_pvids"""
+    def __init__(self, text: str):
+        self.text = text
+
+    def get(self, url: str):
+        return self
+
+
+def _fast_pvids(text: str):
+    sw = GS108Ev3('127.0.0.1', '')
+    sw._s = _PvidPage(text)
+    return sw.fetch_pvids()
+
+
+# name, fixture, (old) BeautifulSoup extraction, (new) targeted extraction, times per no-op apply
+# per-VLAN pages are counted separately, see main()
+CASES = [
+    ('login rand', 'gs108ev3/login.htm',
+     lambda t: BeautifulSoup(t).find(id='rand').get('value'),
+     lambda t: extract.input_value(t, id='rand'), 1),
+    ('login err_msg(absent)', 'gs108ev3/login_ok.htm',
+     lambda t: BeautifulSoup(t).find(id='err_msg'),
+     lambda t: extract.input_value(t, id='err_msg'), 1),
+    ('session hash', 'gs108ev3/switch_info.htm',
+     lambda t: BeautifulSoup(t).find('input', id='hash').get('value'),
+     lambda t: extract.input_value(t, id='hash'), 1),
+    ('vlan list', 'gs108ev3/8021qMembe.htm',
+     _bs_options,
+     lambda t: extract.option_values(t, 'vlanIdOption'), 1),
+    ('vlan page', 'gs108ev3/8021qMembe.htm',
+     lambda t: (lambda s: (s.find('input', attrs={'name': 'VLAN_ID_HD'}).get('value'),
+                           s.find('input', id='hiddenMem').get('value')))(BeautifulSoup(t)),
+     lambda t: (extract.input_value(t, name='VLAN_ID_HD'), extract.input_value(t, id='hiddenMem')), 0),
+    ('vlan count', 'gs108ev3/8021qCf.htm',
+     lambda t: BeautifulSoup(t).find('input', attrs={'name': 'vlanNum'}).get('value'),
+     lambda t: extract.input_value(t, name='vlanNum'), 0),
+    ('form err_msg', 'gs108ev3/8021qCf.htm',
+     lambda t: BeautifulSoup(t).find(id='err_msg').get('value', ''),
+     lambda t: extract.input_value(t, id='err_msg'), 0),
+    ('pvids', 'gs108ev3/portPVID.htm',
+     _bs_pvids, _fast_pvids, 1),
+    ('gs116ev2 login redirect', 'gs116ev2/login_ok.htm',
+     lambda t: BeautifulSoup(t).find('script').text.strip(),
+     extract.first_script, 0),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', '-n', type=int, default=200, help='calls per measurement')
+    args = parser.parse_args()
+
+    print("%-24s %8s %12s %12s %8s" % ('field', 'bytes', 'bs4(us)', 'extract(us)', 'speedup'))
+    costs = dict()
+    for name, fixture, slow, fast, _ in CASES:
+        text = _load(fixture)
+        slow_result, fast_result = slow(text), fast(text)
+        assert str(slow_result) == str(fast_result), f"{name}: {slow_result!r} != {fast_result!r}"
+        t_slow = min(timeit.repeat(lambda: slow(text), number=args.number, repeat=3)) / args.number
+        t_fast = min(timeit.repeat(lambda: fast(text), number=args.number, repeat=3)) / args.number
+        costs[name] = (t_slow, t_fast)
+        print("%-24s %8d %12.1f %12.1f %7.1fx" % (name, len(text), t_slow * 1e6, t_fast * 1e6, t_slow / t_fast))
+
+    # a GS108Ev3 apply that changes nothing: login, VLAN list, one page per VLAN, pvids
+    vlan_count = len(extract.option_values(_load('gs108ev3/8021qMembe.htm'), 'vlanIdOption'))
+    for i, which in enumerate(('bs4', 'extract')):
+        total = sum(costs[name][i] * times for name, _, _, _, times in CASES)
+        total += costs['vlan page'][i] * vlan_count
+        print("no-op GS108Ev3 apply with %d VLANs, parsing with %s: %.2fms CPU" % (vlan_count, which, total * 1e3))
+
+
+if __name__ == '__main__':
+    main()
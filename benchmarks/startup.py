@@ -0,0 +1,94 @@
+# -*- encoding: utf-8 -*-
+"""CLI startup benchmark: wall time of short commands, in fresh interpreters
+
+run from the repository root:
+
+    python -m benchmarks.startup [--repeat N]
+
+reports the best and median wall time of each command over N runs, and
+which heavy modules it imported. Help and shell completion should import
+none of them, see the lazy imports in prosafe/__main__.py and
+prosafe/switches/__init__.py.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Tuple
+
+
+HEAVY_MODULES = ['requests', 'urllib3', 'bs4', 'pydantic', 'prosafe.switches.gs108ev3', 'prosafe.switches.gs116ev2']
+
+# runs cli() the way python -m prosafe does, then tells what was imported
+_RUNNER = f'''
+import sys
+from prosafe.__main__ import cli
+try:
+    cli(prog_name='prosafe')
+except SystemExit:
+    pass
+sys.stderr.write('\\nHEAVY ' + ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules) + '\\n')
+'''
+
+# name, arguments, extra environment
+COMMANDS = [
+    ('--help', ['--help'], {}),
+    ('apply --help', ['apply', '--help'], {}),
+    ('history --help', ['history', '--help'], {}),
+    ('complete command', [], {'_PROSAFE_COMPLETE': 'bash_complete', 'COMP_WORDS': 'prosafe ap', 'COMP_CWORD': '1'}),
+    ('complete option', [], {'_PROSAFE_COMPLETE': 'bash_complete', 'COMP_WORDS': 'prosafe apply --ve', 'COMP_CWORD': '2'}),
+]
+
+
+@dataclass
+class Row:
+    command: str
+    best_ms: float
+    median_ms: float
+    heavy_modules: List[str]
+
+
+def run_once(argv: List[str], env: Dict[str, str]) -> Tuple[float, List[str]]:
+    """wall time, and the heavy modules the runner reported"""
+    start = time.perf_counter()
+    res = subprocess.run(argv, env={**os.environ, **env}, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    heavy = res.stderr.rsplit('HEAVY ', 1)[-1].strip() if 'HEAVY ' in res.stderr else ''
+    return wall, [m for m in heavy.split(',') if m]
+
+
+def bench(name: str, argv: List[str], env: Dict[str, str], repeat: int) -> Row:
+    times = []
+    heavy: List[str] = []
+    for _ in range(repeat):
+        wall, heavy = run_once(argv, env)
+        times.append(wall)
+    return Row(name, min(times) * 1e3, statistics.median(times) * 1e3, heavy)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10, help='runs per command')
+    parser.add_argument('--json', help='also dump the results to this file')
+    args = parser.parse_args()
+
+    # the bare interpreter, for reference
+    rows = [bench('python -c pass', [sys.executable, '-c', 'pass'], {}, args.repeat)]
+    rows += [bench(name, [sys.executable, '-c', _RUNNER] + argv, env, args.repeat)
+             for name, argv, env in COMMANDS]
+
+    print("%-20s %10s %12s  %s" % ('command', 'best(ms)', 'median(ms)', 'heavy modules imported'))
+    for r in rows:
+        print("%-20s %10.1f %12.1f  %s" % (r.command, r.best_ms, r.median_ms, ', '.join(r.heavy_modules) or '-'))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([asdict(r) for r in rows], f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,14 @@
-import traceback
+import time
 from pathlib import Path
+from threading import Lock
+from typing import Dict
 
 import click
 
-from .vlan_config import load_config
-from .cli import RequiredIf
+from .cli import RequiredIf, scheduling_options, session_options
+
+# Everything else is imported by the commands, so --help and shell completion
+# don't load requests, pydantic and the drivers.
 
 
 @click.group()
@@ -16,43 +20,297 @@ def cli():
 @click.option('--config', '-c', required=True, 
             type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
             help='Path to your configuration file.')
+@click.option('--config-cache', is_flag=True, default=False,
+            help='Keep the validated config on disk, and only validate switches changed since the last run.')
 @click.option('--norestore', is_flag=True, flag_value=True, default=False, help="Skip restore on failure.")
 @click.option('--savepath', cls=RequiredIf, required_if="norestore",
             type=click.Path(exists=True, file_okay=False, dir_okay=True, writable=True),
             help='If specified, save switch config backups to that folder.')
-def apply(config: str, norestore: bool, savepath: str|None):
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=1, show_default=True,
+            help='Number of switches processed in parallel.')
+@click.option('--fail-fast/--keep-going', default=True, show_default=True,
+            help='Stop starting new switches after the first failure, or continue with the rest.')
+@click.option('--profile', is_flag=True, default=False,
+            help='Print time, requests and bytes spent in each phase(login, fetch, write, ...).')
+@click.option('--profile-json', type=click.Path(dir_okay=False, writable=True),
+            help='Dump per-switch, per-request profiling data to this JSON file. Implies --profile.')
+@click.option('--session-cache', is_flag=True, default=False,
+            help='Reuse logged in sessions from previous runs, and keep them open for the next one.')
+@click.option('--session-ttl', type=click.FloatRange(min=0), default=300., show_default=True,
+            help='Seconds a cached session is considered for reuse.')
+@click.option('--state-cache', is_flag=True, default=False,
+            help='Remember the VLAN state after applying, and skip reading it next time if the switch backup is unchanged.')
+@click.option('--state-ttl', type=click.FloatRange(min=0), default=3600., show_default=True,
+            help='Seconds a cached VLAN state is considered for reuse.')
+@click.option('--verify', is_flag=True, default=False,
+            help='Read back the VLANs and ports changed, and redo the changes that did not stick.')
+@click.option('--rollback', type=click.Choice(['restore', 'inverse']), default='restore', show_default=True,
+            help='On failure, restore the backup(which reboots GS108Ev3), or first try undoing the changes written by writing their inverse, restoring the backup only if that fails.')
+@click.option('--journal', 'use_journal', is_flag=True, default=False,
+            help='Save the progress of every switch before each write, so an interrupted run can be resumed.')
+@click.option('--resume', is_flag=True, default=False,
+            help='Continue an interrupted --journal run: switches it finished are skipped, half applied ones continue where they stopped. Implies --journal.')
+@click.option('--journal-ttl', type=click.FloatRange(min=0), default=3600., show_default=True,
+            help='Seconds a journal entry is trusted by --resume.')
+@session_options
+@scheduling_options
+def apply(config: str, config_cache: bool, norestore: bool, savepath: str|None, jobs: int, fail_fast: bool,
+          profile: bool, profile_json: str|None, session_cache: bool, session_ttl: float,
+          state_cache: bool, state_ttl: float, verify: bool, rollback: str,
+          use_journal: bool, resume: bool, journal_ttl: float,
+          connect_timeout: float|None, read_timeout: float|None, retries: int|None, keep_alive: bool|None,
+          max_requests: int|None, site_requests: int|None, slowest_first: bool):
+    from .config_cache import ConfigCache
+    from .fleet import SwitchStatus, apply_switch, print_summary, run_fleet
+    from .journal import ApplyJournal
+    from .profiling import SwitchProfile, dump_profile, print_profile
+    from .scheduler import FleetScheduler, TimingHistory
+    from .session_cache import SessionCache
+    from .state_cache import StateCache
+    from .vlan_config import SwitchVlanConfig, load_config, override_session_options
+
     click.echo("Loading config from %s ..." % config)
-    cfgs = load_config(config)
+    cfgs = load_config(config, ConfigCache() if config_cache else None)
+    override_session_options(cfgs, connect_timeout=connect_timeout, read_timeout=read_timeout,
+                             retries=retries, keep_alive=keep_alive)
     click.echo("Got %d switch(es)." % len(cfgs))
     
     if isinstance(savepath, str):
         savepath = savepath.rstrip('/')
         savepath = Path(savepath)
-    
-    for sw_name, sw_cfg in cfgs.items():
-        click.echo("Processing switch '%s' ..." % sw_name)
-        sw = sw_cfg.model.driver(sw_cfg.address, sw_cfg.password)
-        backup_data: bytes|None = None
-
-        with sw.logged_in():
-            backup_data = sw.backup()
-            if isinstance(savepath, Path):
-                backup_file = savepath / f'{sw_name}.cfg'
-                click.echo("Backup saved to %s" % backup_file)
-                with open(backup_file, 'wb') as f:
-                    f.write(backup_data)
-            try:
-                vlan_membership = sw_cfg.get_vlan_membership()
-                pvids = sw_cfg.get_pvids()
-                sw.apply_vlan_config(vlan_membership, pvids)
-            except Exception as e:
-                traceback.print_exception(e)
-                click.echo("Error occurred! Check the printed exception!")
-                if not norestore:
-                    click.echo("Restoring switch(%s) configuration ..." % sw_name)
-                    sw.restore(backup_data)
-                break
-        
+
+    profiles: Dict[str, SwitchProfile] = dict()
+    if profile or profile_json:
+        profiles = {sw_name: SwitchProfile(sw_name) for sw_name in cfgs}
+
+    sessions = SessionCache(ttl=session_ttl) if session_cache else None
+    states = StateCache(ttl=state_ttl) if state_cache else None
+    journal = ApplyJournal(ttl=journal_ttl) if use_journal or resume else None
+    scheduler = FleetScheduler(max_requests, site_requests,
+                               TimingHistory() if slowest_first else None)
+
+    def task(sw_name: str, sw_cfg: SwitchVlanConfig):
+        return apply_switch(sw_name, sw_cfg, norestore, savepath, profiles.get(sw_name), sessions, states, verify,
+                            scheduler, rollback == 'inverse', journal, resume)
+
+    start = time.monotonic()
+    results = run_fleet(cfgs, task, jobs=jobs, fail_fast=fail_fast, order=scheduler.order(cfgs))
+    scheduler.record(cfgs, {r.name: r.wall_time for r in results if r.status != SwitchStatus.SKIPPED})
+    print_summary(results, time.monotonic() - start)
+    if profiles:
+        print_profile(list(profiles.values()))
+    if profile_json:
+        dump_profile(list(profiles.values()), profile_json)
+        click.echo("Profile saved to %s" % profile_json)
+
+    if not all(r.ok for r in results):
+        raise click.exceptions.Exit(1)
     click.echo("All done!")
 
-cli()
\ No newline at end of file
+
+@cli.command()
+@click.option('--config', '-c', required=True,
+            type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
+            help='Configuration file listing the switches to export, their ports are ignored.')
+@click.option('--config-cache', is_flag=True, default=False,
+            help='Keep the validated config on disk, and only validate switches changed since the last run.')
+@click.option('--output', '-o', type=click.File('w', lazy=False), default='-', show_default=True,
+            help='Write all switches to this file, in the order they finish.')
+@click.option('--output-dir', '-d', type=click.Path(exists=True, file_okay=False, dir_okay=True, writable=True),
+            help='Write one <switch name>.toml per switch to this folder instead.')
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=8, show_default=True,
+            help='Number of switches read in parallel.')
+@click.option('--fail-fast/--keep-going', default=False, show_default=True,
+            help='Stop starting new switches after the first failure, or continue with the rest.')
+@click.option('--session-cache', is_flag=True, default=False,
+            help='Reuse logged in sessions from previous runs, and keep them open for the next one.')
+@session_options
+@scheduling_options
+def export(config: str, config_cache: bool, output, output_dir: str|None, jobs: int, fail_fast: bool,
+           session_cache: bool,
+           connect_timeout: float|None, read_timeout: float|None, retries: int|None, keep_alive: bool|None,
+           max_requests: int|None, site_requests: int|None, slowest_first: bool):
+    """Dump the live VLAN state of switches as a config apply accepts."""
+    from .config_cache import ConfigCache
+    from .fleet import SwitchStatus, export_switch, print_summary, run_fleet
+    from .scheduler import FleetScheduler, TimingHistory
+    from .session_cache import SessionCache
+    from .vlan_config import SwitchVlanConfig, load_config, override_session_options
+
+    # stdout may be the export itself, everything else goes to stderr
+    click.echo("Loading config from %s ..." % config, err=True)
+    cfgs = load_config(config, ConfigCache() if config_cache else None)
+    override_session_options(cfgs, connect_timeout=connect_timeout, read_timeout=read_timeout,
+                             retries=retries, keep_alive=keep_alive)
+    click.echo("Got %d switch(es)." % len(cfgs), err=True)
+
+    sessions = SessionCache() if session_cache else None
+    scheduler = FleetScheduler(max_requests, site_requests,
+                               TimingHistory() if slowest_first else None)
+    lock = Lock()
+
+    def write(sw_name: str, text: str):
+        if output_dir is not None:
+            with open(Path(output_dir) / f'{sw_name}.toml', 'w') as f:
+                f.write(text)
+            return
+        # sections are written as switches finish, never interleaved
+        with lock:
+            output.write(text)
+            output.flush()
+
+    if output_dir is None:
+        output.write(f"# Exported from {len(cfgs)} switch(es) listed in {config}\n\n")
+
+    def task(sw_name: str, sw_cfg: SwitchVlanConfig):
+        return export_switch(sw_name, sw_cfg, write, sessions, scheduler)
+
+    start = time.monotonic()
+    results = run_fleet(cfgs, task, jobs=jobs, fail_fast=fail_fast, order=scheduler.order(cfgs))
+    scheduler.record(cfgs, {r.name: r.wall_time for r in results if r.status != SwitchStatus.SKIPPED})
+    print_summary(results, time.monotonic() - start, err=True)
+
+    if not all(r.ok for r in results):
+        raise click.exceptions.Exit(1)
+
+
+@cli.command()
+@click.option('--config', '-c', required=True,
+            type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
+            help='Configuration file listing the switches to poll, their ports are ignored.')
+@click.option('--config-cache', is_flag=True, default=False,
+            help='Keep the validated config on disk, and only validate switches changed since the last run.')
+@click.option('--interval', '-i', type=click.FloatRange(min=0, min_open=True), default=10., show_default=True,
+            help='Seconds between samples.')
+@click.option('--count', '-n', type=click.IntRange(min=0), default=0, show_default=True,
+            help='Number of samples to print, 0 to poll until interrupted.')
+@click.option('--output', '-o', type=click.File('w', lazy=False), default='-', show_default=True,
+            help='Write samples to this file, as CSV.')
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=8, show_default=True,
+            help='Number of switches sampled in parallel.')
+@click.option('--session-cache', is_flag=True, default=False,
+            help='Reuse logged in sessions from previous runs, and keep them open for the next one.')
+@click.option('--history', type=click.Path(file_okay=False, dir_okay=True, writable=True),
+            help='Also keep the counters of every sample in this folder, one fixed size file per switch.')
+@click.option('--history-size', type=click.IntRange(min=2), default=60480, show_default=True,
+            help='Samples kept per switch in --history, the oldest are overwritten. The default is a week at 10s.')
+@session_options
+def poll(config: str, config_cache: bool, interval: float, count: int, output, jobs: int, session_cache: bool,
+         history: str|None, history_size: int,
+         connect_timeout: float|None, read_timeout: float|None, retries: int|None, keep_alive: bool|None):
+    """Sample port counters of switches, print the traffic between samples."""
+    from .config_cache import ConfigCache
+    from .history import HistoryStore
+    from .poller import FleetPoller
+    from .scheduler import FleetScheduler
+    from .session_cache import SessionCache
+    from .vlan_config import load_config, override_session_options
+
+    click.echo("Loading config from %s ..." % config, err=True)
+    cfgs = load_config(config, ConfigCache() if config_cache else None)
+    override_session_options(cfgs, connect_timeout=connect_timeout, read_timeout=read_timeout,
+                             retries=retries, keep_alive=keep_alive)
+    click.echo("Got %d switch(es)." % len(cfgs), err=True)
+
+    sessions = SessionCache() if session_cache else None
+    store = HistoryStore(history, history_size) if history is not None else None
+    output.write('time,switch,port,interval,rx_bytes,tx_bytes,crc_errors,rx_rate,tx_rate\n')
+    printed = 0
+    with FleetPoller(cfgs, jobs, FleetScheduler(), sessions, store) as poller:
+        # the first sample only sets the baseline
+        poller.sample()
+        next_time = time.monotonic() + interval
+        try:
+            while count == 0 or printed < count:
+                time.sleep(max(0., next_time - time.monotonic()))
+                # a sample slower than the interval delays the next one, rather than piling up
+                next_time = max(next_time + interval, time.monotonic())
+                for s in poller.sample():
+                    output.write(f'{s.time:.3f},{s.switch},{s.port},{s.interval:.3f},{s.rx_bytes},{s.tx_bytes},'
+                                 f'{s.crc_errors},{s.rx_rate:.1f},{s.tx_rate:.1f}\n')
+                output.flush()
+                printed += 1
+        except KeyboardInterrupt:
+            pass
+
+    if poller.errors:
+        raise click.exceptions.Exit(1)
+
+
+
+@cli.command(name='history')
+@click.option('--history', '-d', required=True, type=click.Path(exists=True, file_okay=False, dir_okay=True),
+            help='Folder poll --history wrote to.')
+@click.option('--switch', '-s', 'sw_name', required=True, help='Name of the switch in the config.')
+@click.option('--port', '-p', 'ports', type=click.IntRange(min=1), multiple=True,
+            help='Ports to show, may be repeated. [default: all]')
+@click.option('--since', type=click.FloatRange(min=0), default=3600., show_default=True,
+            help='Show the last this many seconds.')
+@click.option('--output', '-o', type=click.File('w', lazy=False), default='-', show_default=True,
+            help='Write the traffic to this file, as CSV.')
+def show_history(history: str, sw_name: str, ports, since: float, output):
+    """Print the traffic stored by poll --history, between consecutive samples."""
+    from .history import HistoryStore
+
+    store = HistoryStore(history)
+    try:
+        ring = store.ring(sw_name)
+        output.write('time,switch,port,interval,rx_bytes,tx_bytes,crc_errors,rx_rate,tx_rate\n')
+        start = time.time() - since
+        for pid in ports or range(1, ring.port_count + 1):
+            for r in ring.rates(pid, start):
+                output.write(f'{r.time:.3f},{sw_name},{pid},{r.interval:.3f},{r.rx_bytes},{r.tx_bytes},'
+                             f'{r.crc_errors},{r.rx_rate:.1f},{r.tx_rate:.1f}\n')
+    finally:
+        store.close()
+
+
+
+@cli.command(name='serve-metrics')
+@click.option('--config', '-c', required=True,
+            type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
+            help='Configuration file listing the switches to watch, their ports are ignored.')
+@click.option('--config-cache', is_flag=True, default=False,
+            help='Keep the validated config on disk, and only validate switches changed since the last run.')
+@click.option('--listen', '-l', default='127.0.0.1:9488', show_default=True,
+            help='Address and port to serve /metrics on.')
+@click.option('--interval', '-i', type=click.FloatRange(min=0, min_open=True), default=30., show_default=True,
+            help='Seconds between two reads of the counters of a switch.')
+@click.option('--ttl', type=click.FloatRange(min=0, min_open=True),
+            help='Seconds counters are served after they were read. [default: 3 intervals]')
+@click.option('--info-interval', type=click.FloatRange(min=0, min_open=True), default=3600., show_default=True,
+            help='Seconds between two reads of switch information(firmware, MAC, serial).')
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=8, show_default=True,
+            help='Number of switches read in parallel.')
+@click.option('--session-cache', is_flag=True, default=False,
+            help='Reuse logged in sessions from previous runs, and keep them open for the next one.')
+@session_options
+def serve_metrics_command(config: str, config_cache: bool, listen: str, interval: float, ttl: float|None,
+                          info_interval: float, jobs: int, session_cache: bool,
+                          connect_timeout: float|None, read_timeout: float|None, retries: int|None,
+                          keep_alive: bool|None):
+    """Serve port counters and switch information to Prometheus, from memory."""
+    from .config_cache import ConfigCache
+    from .metrics import MetricsCollector, serve_metrics
+    from .scheduler import FleetScheduler
+    from .session_cache import SessionCache
+    from .vlan_config import load_config, override_session_options
+
+    click.echo("Loading config from %s ..." % config, err=True)
+    cfgs = load_config(config, ConfigCache() if config_cache else None)
+    override_session_options(cfgs, connect_timeout=connect_timeout, read_timeout=read_timeout,
+                             retries=retries, keep_alive=keep_alive)
+    click.echo("Got %d switch(es)." % len(cfgs), err=True)
+
+    host, _, port = listen.rpartition(':')
+    sessions = SessionCache() if session_cache else None
+    with MetricsCollector(cfgs, interval, ttl, info_interval, jobs, FleetScheduler(), sessions) as collector:
+        click.echo("Serving metrics on http://%s/metrics ..." % listen, err=True)
+        try:
+            serve_metrics(collector, host or '0.0.0.0', int(port))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,51 @@
+# -*- encoding: utf-8 -*-
+"""where prosafe keeps things between runs
+
+Everything goes to $PROSAFE_CACHE_DIR, or $XDG_CACHE_HOME/prosafe, or
+~/.cache/prosafe. Cached data may contain session cookies and passwords,
+so directories are created 0700 and files written 0600."""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+
+def cache_dir(*parts: str) -> Path:
+    """the cache directory, or a sub directory of it, created if missing"""
+    base = os.environ.get('PROSAFE_CACHE_DIR')
+    if not base:
+        base = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'prosafe')
+    path = Path(base)
+    for part in ('',) + parts:
+        # parents=True would create the intermediate ones world readable
+        path = path / part
+        path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    return path
+
+
+def key_to_filename(key: str, suffix: str = '') -> str:
+    """keys contain addresses, ports and so on, make them safe file names"""
+    return hashlib.sha256(key.encode()).hexdigest()[:32] + suffix
+
+
+def write_private(path: Path, data: bytes):
+    """atomically replace path with data, readable by the owner only
+
+    The data and the rename are on disk when this returns, a crash leaves
+    either the old file or the new one."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    try:
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    dir_fd = os.open(path.parent, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
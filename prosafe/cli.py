@@ -22,3 +22,35 @@ class RequiredIf(click.Option):
 
         return super(RequiredIf, self).handle_parse_result(
             ctx, opts, args)
+
+
+def session_options(command):
+    """--connect-timeout and friends, overriding [switches.xxx.http] of every switch"""
+    options = [
+        click.option('--connect-timeout', type=click.FloatRange(min=0, min_open=True),
+                     help='Seconds to wait for a connection to a switch. [default: 5, or as configured]'),
+        click.option('--read-timeout', type=click.FloatRange(min=0, min_open=True),
+                     help='Seconds to wait for a switch to answer. [default: 30, or as configured]'),
+        click.option('--retries', type=click.IntRange(min=0),
+                     help='Retries of failed connections, GETs and logins, never of other POSTs. [default: 2, or as configured]'),
+        click.option('--keep-alive/--no-keep-alive', default=None,
+                     help='Reuse connections, or open one per request for switches dropping them. [default: as configured]'),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
+def scheduling_options(command):
+    """limits on requests in flight, and the start order of switches"""
+    options = [
+        click.option('--max-requests', type=click.IntRange(min=1),
+                     help='Requests in flight over all switches at once. [default: no limit]'),
+        click.option('--site-requests', type=click.IntRange(min=1),
+                     help="Requests in flight per site, a switch's `site` in the config or else its /24 network. [default: no limit]"),
+        click.option('--slowest-first', is_flag=True, default=False,
+                     help='Remember how long each switch takes, and start the slowest ones first next time.'),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
@@ -0,0 +1,53 @@
+# -*- encoding: utf-8 -*-
+import hashlib
+import json
+import marshal
+import os
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from .cache import cache_dir, key_to_filename, write_private
+
+
+# bump it whenever the compiled form(see vlan_config) or the validation rules change
+FORMAT_VERSION = 5
+
+
+def section_hash(sw_config: Dict) -> str:
+    """hash of one [switches.xxx] table, after profiles and defaults are resolved"""
+    text = json.dumps(sw_config, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ConfigCache:
+    """validated configs kept on disk, so big fleet files load quickly
+
+    One file per config file. If it and the files it includes are unchanged,
+    the switches are rebuilt from the cache without parsing TOML at all. Otherwise only
+    switches whose section changed are validated again. Configs contain
+    passwords, the cache is readable by the owner only."""
+
+    def __init__(self, path: str|Path|None = None) -> None:
+        self.path = Path(path) if path is not None else cache_dir('config')
+        self.path.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+    def _file(self, filename: str) -> Path:
+        return self.path / key_to_filename(os.path.abspath(filename), '.bin')
+
+    def load(self, filename: str) -> Dict|None:
+        """{'version', 'sources': {path: sha256}, 'patterns': [include glob],
+        'switches': {name: (section_hash, compiled)}}"""
+        try:
+            with open(self._file(filename), 'rb') as f:
+                # marshal.load() reads a file object in tiny pieces
+                entry = marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(entry, dict) or entry.get('version') != FORMAT_VERSION:
+            return None
+        return entry
+
+    def save(self, filename: str, sources: Dict[str, str], patterns: List[str],
+             switches: Dict[str, Tuple[str, Tuple]]):
+        entry = {'version': FORMAT_VERSION, 'sources': sources, 'patterns': patterns, 'switches': switches}
+        write_private(self._file(filename), marshal.dumps(entry))
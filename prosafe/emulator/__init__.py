@@ -0,0 +1,10 @@
+"""in-process emulators of the switches' web interfaces, for tests and benchmarks"""
+from .base import EmulatedSwitch
+from .gs108ev3 import GS108Ev3Emulator
+from .gs116ev2 import GS116Ev2Emulator
+
+
+EMULATOR = {
+    'gs108ev3': GS108Ev3Emulator,
+    'gs116ev2': GS116Ev2Emulator,
+}
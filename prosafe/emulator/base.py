@@ -0,0 +1,254 @@
+# -*- encoding: utf-8 -*-
+import json
+import secrets
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Dict, List, Set, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from ..switches.general import PvidConfig, VlanConfig, VlanId, VlanPortMembership
+
+
+class Request:
+    """what an emulator needs to know about one http request"""
+
+    def __init__(self, method: str, path: str, query: str, headers, body: bytes) -> None:
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+        cookie = SimpleCookie(headers.get('Cookie', ''))
+        self.cookies: Dict[str, str] = {k: v.value for k, v in cookie.items()}
+        self.form: List[Tuple[str, str]] = []
+        self.files: Dict[str, bytes] = dict()
+        content_type = headers.get('Content-Type', '')
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            self.form = parse_qsl(body.decode(), keep_blank_values=True)
+        elif content_type.startswith('multipart/form-data'):
+            message = BytesParser(policy=HTTP).parsebytes(
+                b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                if part.get_filename() is not None:
+                    self.files[name] = part.get_payload(decode=True)
+                else:
+                    self.form.append((name, part.get_content()))
+
+    def field(self, key: str, default: str|None = None) -> str|None:
+        """first value of a form field"""
+        for k, v in self.form:
+            if k == key:
+                return v
+        return default
+
+    def fields(self, key: str) -> List[str]:
+        return [v for k, v in self.form if k == key]
+
+
+class Response:
+    def __init__(self, body: str|bytes = b'', status: int = 200,
+                 content_type: str = 'text/html', cookies: Dict[str, str]|None = None) -> None:
+        self.body = body.encode() if isinstance(body, str) else body
+        self.status = status
+        self.content_type = content_type
+        self.cookies = cookies or dict()
+
+
+class EmulatedSwitch:
+    """state and web interface of one emulated switch
+
+    Subclasses implement handle(), mimicking the real web UI closely enough
+    for the drivers: the same urls, form fields, session checks and error
+    reporting. The emulator runs an http server in a background thread,
+    use it as a context manager:
+
+        with GS108Ev3Emulator('password') as emu:
+            sw = Switch(emu.address, 'password')
+
+    latency: seconds the switch takes to answer a request. Requests are
+    handled one at a time, like the real web servers do, so concurrent ones
+    queue up behind each other's latency.
+    boot_time: seconds the switch drops every connection after a reboot.
+    shutdown_delay: seconds it still answers(as the old instance) before
+    going down for a reboot.
+    """
+    port_count: int = 8
+    max_vlans: int = 64
+    backup_size: int = 4096
+    model: str = ''
+
+    def __init__(self, password: str = 'password', latency: float = 0.,
+                 vlans: VlanConfig|None = None, pvids: PvidConfig|None = None,
+                 boot_time: float = 1., shutdown_delay: float = .5) -> None:
+        self.password = password
+        self.latency = latency
+        self.boot_time = boot_time
+        self.shutdown_delay = shutdown_delay
+        self.going_down: float|None = None  # monotonic, when a pending reboot starts
+        self.booting_until = 0.  # monotonic
+        if vlans is None:
+            # factory default: all ports untagged in VLAN 1
+            vlans = {1: {i: VlanPortMembership.UNTAGGED for i in range(1, self.port_count + 1)}}
+        if pvids is None:
+            pvids = {i: 1 for i in range(1, self.port_count + 1)}
+        self.vlans: VlanConfig = {vid: dict(m) for vid, m in vlans.items()}
+        self.pvids: PvidConfig = dict(pvids)
+        self.sessions: Set[str] = set()
+        self.serial = secrets.token_hex(6).upper()
+        # rx bytes, tx bytes, CRC errors of every port, growing on every read
+        self.counters: Dict[int, List[int]] = {pid: [0, 0, 0] for pid in range(1, self.port_count + 1)}
+        self.mac = ':'.join(secrets.token_hex(1) for _ in range(6))
+
+        self.lock = Lock()  # one request at a time, like the real thing
+        self.request_count = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.requests: List[Tuple[str, str]] = []  # (method, path)
+        self._server: ThreadingHTTPServer|None = None
+        self._thread: Thread|None = None
+
+    # --- server lifecycle
+
+    @property
+    def address(self) -> str:
+        assert self._server is not None, "Emulator not started!"
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        emulator = self
+
+        class Handler(_Handler):
+            pass
+        Handler.emulator = emulator
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def reset_stats(self):
+        with self.lock:
+            self.request_count = 0
+            self.bytes_received = 0
+            self.bytes_sent = 0
+            self.requests.clear()
+
+    # --- helpers for subclasses
+
+    def new_session(self) -> str:
+        sid = secrets.token_hex(16)
+        self.sessions.add(sid)
+        return sid
+
+    def logged_in(self, request: Request, cookie_name: str) -> bool:
+        return request.cookies.get(cookie_name) in self.sessions
+
+    def reboot(self):
+        """after shutdown_delay, everyone is logged out and nothing answers for boot_time seconds"""
+        self.going_down = time.monotonic() + self.shutdown_delay
+        self.booting_until = self.going_down + self.boot_time
+
+    def booting(self) -> bool:
+        """whether the switch is down for a reboot right now"""
+        now = time.monotonic()
+        if self.going_down is not None and now >= self.going_down:
+            self.going_down = None
+            self.sessions.clear()
+        return self.going_down is None and now < self.booting_until
+
+    def tick_counters(self):
+        """some traffic since the last read, more on lower ports"""
+        for pid, counters in self.counters.items():
+            counters[0] += secrets.randbelow(1 << 20) // pid
+            counters[1] += secrets.randbelow(1 << 20) // pid
+            counters[2] += secrets.randbelow(100) == 0
+
+    def dump_config(self) -> bytes:
+        """backup file, a header, the state and some padding"""
+        data = json.dumps({
+            'model': self.model,
+            'vlans': {vid: {pid: int(m) for pid, m in mem.items()} for vid, mem in self.vlans.items()},
+            'pvids': self.pvids,
+        }).encode()
+        header = b'PROSAFE-EMU\n'
+        return header + data + b'\n' + b'\0' * max(0, self.backup_size - len(header) - len(data) - 1)
+
+    def load_config(self, config: bytes) -> bool:
+        header, _, data = config.partition(b'\n')
+        if header != b'PROSAFE-EMU':
+            return False
+        data = json.loads(data.rstrip(b'\0').strip())
+        if data.get('model') != self.model:
+            return False
+        self.vlans = {
+            VlanId(vid): {int(pid): VlanPortMembership(m) for pid, m in mem.items()}
+            for vid, mem in data['vlans'].items()
+        }
+        self.pvids = {int(pid): VlanId(vid) for pid, vid in data['pvids'].items()}
+        return True
+
+    def handle(self, request: Request) -> Response:
+        raise NotImplementedError()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the drivers expect
+    disable_nagle_algorithm = True  # headers and body are written separately
+    emulator: EmulatedSwitch
+
+    def log_message(self, format, *args):
+        pass
+
+    def _serve(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length > 0 else b''
+        url = urlsplit(self.path)
+        request = Request(self.command, url.path, url.query, self.headers, body)
+
+        emulator = self.emulator
+        with emulator.lock:
+            booting = emulator.booting()
+        if booting:
+            # like a switch still booting: the connection dies without an answer
+            self.close_connection = True
+            return
+        with emulator.lock:
+            if emulator.latency > 0:
+                time.sleep(emulator.latency)
+            response = emulator.handle(request)
+            emulator.request_count += 1
+            emulator.requests.append((self.command, url.path))
+            # request line and headers are approximated by their raw size
+            emulator.bytes_received += len(self.requestline) + len(str(self.headers)) + len(body)
+
+        self.send_response(response.status)
+        self.send_header('Content-Type', response.content_type)
+        self.send_header('Content-Length', str(len(response.body)))
+        for k, v in response.cookies.items():
+            self.send_header('Set-Cookie', f'{k}={v}; path=/')
+        self.end_headers()
+        self.wfile.write(response.body)
+        with emulator.lock:
+            emulator.bytes_sent += len(response.body) + 128  # and about this much of headers
+
+    do_GET = _serve
+    do_POST = _serve
@@ -0,0 +1,249 @@
+# -*- encoding: utf-8 -*-
+import secrets
+from html import escape
+from typing import Dict
+
+from ..switches.general import VlanId, VlanPortMembership
+from ..switches.gs108ev3.consts import *
+from ..switches.gs108ev3.utils import password_kdf
+from .base import EmulatedSwitch, Request, Response
+
+
+_HEAD = '''<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN" "http://www.w3.org/TR/html4/loose.dtd">
+<html>
+<head>
+<meta http-equiv="content-type" content="text/html;charset=utf-8">
+<meta http-equiv="pragma" content="no-cache">
+<title>NETGEAR GS108Ev3</title>
+<link rel="stylesheet" type="text/css" href="/css/style.css">
+<script type="text/javascript" src="/js/funcs.js"></script>
+<script type="text/javascript">
+var timeout = 300;
+function checkTimeout() { if (--timeout <= 0) { top.location.href = "login.htm"; } else { setTimeout(checkTimeout, 1000); } }
+function showError(msg) { if (msg != "") { alert(msg); } }
+function submitForm(act) { document.forms[0].ACTION.value = act; document.forms[0].submit(); }
+</script>
+</head>
+'''
+
+_COOKIE = 'GS108SID'
+
+
+def _page(body: str, form: str = '', hash: str|None = None, err_msg: str|None = None) -> str:
+    hidden = ''
+    if hash is not None:
+        hidden += f'\n<input type=hidden name=\'hash\' id=\'hash\' value="{hash}">'
+    if err_msg is not None:
+        hidden += f'\n<input type="hidden" id="err_msg" value="{escape(err_msg)}">'
+    return (_HEAD + '<body onload="checkTimeout();">\n<div id="content">\n'
+            + f'<form name="{form}" method="post" action="{form}.cgi">\n{body}{hidden}\n</form>\n'
+            + '</div>\n</body>\n</html>\n')
+
+
+def _redirect(target: str) -> str:
+    return f'<html><head><script type="text/javascript">top.location.href = "{target}";</script></head><body></body></html>\n'
+
+
+class GS108Ev3Emulator(EmulatedSwitch):
+    """GS108Ev3, firmware V2.06.24EN as seen by the driver
+
+    Enforces what the real web UI enforces: the session hash on every form,
+    vlanNum and the checkbox index on the VLAN form, a port must be a
+    member of its pvid VLAN, and a VLAN in use as pvid can't be deleted."""
+    port_count = 8
+    max_vlans = 64
+    backup_size = 4096
+    config_size_limit = 16384
+    model = 'gs108ev3'
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.rand: str = ''
+        self.hashes: Dict[str, str] = dict()  # session -> hash
+
+    # --- pages
+
+    def _info_page(self, hash: str) -> str:
+        rows = [
+            ('Product Name', 'GS108Ev3'),
+            ('Switch Name', '<input type="text" class="textInput" name="switch_name" id="switch_name" value="emulated" maxlength="20">'),
+            ('Serial Number', self.serial),
+            ('MAC Address', self.mac),
+            ('Bootloader Version', 'V1.00.03'),
+            ('Firmware Version', 'V2.06.24EN'),
+            ('DHCP Mode', '<input type="hidden" name="dhcp_mode" id="dhcp_mode" value="0">Disable'),
+            ('IP Address', '127.0.0.1'),
+        ]
+        body = '<table class="tableStyle">\n' + '\n'.join(
+            f'<tr><td class="paddingTableBody">{k}</td><td>{v}</td></tr>' for k, v in rows) + '\n</table>'
+        return _page(body, 'switch_info', hash, '')
+
+    def _membership_page(self, hash: str, vid: VlanId, err_msg: str = '') -> str:
+        options = '\n'.join(
+            f'<option value="{v}"{" selected" if v == vid else ""}>{v}</option>' for v in sorted(self.vlans))
+        membership = ''.join(str(int(self.vlans[vid][pid])) for pid in range(1, self.port_count + 1))
+        body = (f'<table class="tableStyle"><tr><td>VLAN ID</td><td>'
+                f'<select name="VLAN_ID" id="vlanIdOption" onchange="changeVlan();">\n{options}\n</select></td></tr></table>\n'
+                f'<input type="hidden" name="VLAN_ID_HD" value="{vid}">\n'
+                f'<input type="hidden" name="hiddenMem" id="hiddenMem" value="{membership}">')
+        return _page(body, '8021qMembe', hash, err_msg)
+
+    def _vlan_config_page(self, hash: str, err_msg: str = '') -> str:
+        checks = '\n'.join(
+            f'<tr><td><input type="checkbox" name="vlanck{i}" value="{v}"></td><td>{v}</td></tr>'
+            for i, v in enumerate(sorted(self.vlans)))
+        body = (f'<table class="tableStyle" id="vlanTable">\n{checks}\n</table>\n'
+                f'<input type="hidden" name="hiddVlan" value="">\n'
+                f'<input type="hidden" name="vlanNum" value="{len(self.vlans)}">\n'
+                f'<input type="hidden" name="ACTION" value="">')
+        return _page(body, '8021qCf', hash, err_msg)
+
+    def _pvid_page(self, hash: str, err_msg: str = '') -> str:
+        rows = '\n'.join(
+            f'<tr class="portID">\n<td class="firstCol"><input type="checkbox" name="port{pid}"><input type="hidden" value="{pid}"></td>\n'
+            f'<td class="def" sel="input">{self.pvids[pid]}</td>\n'
+            f'<td class="def" sel="text">{",".join(str(v) for v in sorted(self.vlans) if self.vlans[v][pid] != VlanPortMembership.IGNORED)}</td>\n</tr>'
+            for pid in range(1, self.port_count + 1))
+        body = f'<table class="tableStyle" id="pvidTable">\n<tr><th>Port</th><th>PVID</th><th>VLAN Members</th></tr>\n{rows}\n</table>'
+        return _page(body, 'portPVID', hash, err_msg)
+
+    def _statistics_page(self, hash: str) -> str:
+        self.tick_counters()
+        rows = '\n'.join(
+            f'<tr class="portID">\n<input type="hidden" name="rxPkt" value="{rx:x}">'
+            f'<input type="hidden" name="txpkt" value="{tx:x}"><input type="hidden" name="crcPkt" value="{crc:x}">\n'
+            f'<td class="firstCol" sel="text">{pid}</td>\n<td class="def" sel="text">{rx}</td>\n'
+            f'<td class="def" sel="text">{tx}</td>\n<td class="def" sel="text">{crc}</td>\n</tr>'
+            for pid, (rx, tx, crc) in self.counters.items())
+        body = (f'<table class="tableStyle" id="statsTable">\n<tr><th>Port</th><th>Bytes Received</th>'
+                f'<th>Bytes Sent</th><th>CRC Error Packets</th></tr>\n{rows}\n</table>')
+        return _page(body, 'portStatistics', hash, '')
+
+    # --- request handling
+
+    def handle(self, request: Request) -> Response:
+        path = request.path
+        if path in ('/', SW_INDEX):
+            return Response(_redirect('login.htm'))
+        if path == '/login.htm':
+            self.rand = str(secrets.randbelow(2 ** 31))
+            body = f'<input type="password" class="textInput" name="password" id="password" value="">\n<input type=hidden id="rand" name="rand" value=\'{self.rand}\' disabled>'
+            return Response(_page(body, 'login'))
+        if path == '/login.cgi':
+            if request.field('password') != password_kdf(self.password, self.rand):
+                return Response(_page('', 'login', err_msg='The password is invalid.'))
+            sid = self.new_session()
+            self.hashes[sid] = secrets.token_hex(16)
+            return Response(_redirect('index.htm'), cookies={_COOKIE: sid})
+        if path == SW_LOGOUT:
+            sid = request.cookies.get(_COOKIE)
+            self.sessions.discard(sid)
+            self.hashes.pop(sid, None)
+            return Response(_redirect('login.htm'))
+
+        if not self.logged_in(request, _COOKIE):
+            return Response(_redirect('login.htm'))
+        hash = self.hashes[request.cookies[_COOKIE]]
+        if request.method == 'POST' and request.field('hash') != hash:
+            return Response(_redirect('login.htm'))
+
+        if path == SW_INFO:
+            return Response(self._info_page(hash))
+        if path == SW_BACKUP:
+            return Response(self.dump_config(), content_type='application/octet-stream')
+        if path == '/restore_conf.htm':
+            return Response(_page(f'<input type="hidden" id="configSize" value="{self.config_size_limit}">', 'restore_conf', hash, ''))
+        if path == '/restore_conf.cgi':
+            return self._restore(request, hash)
+        if path == '/8021qMembe.htm':
+            return Response(self._membership_page(hash, min(self.vlans)))
+        if path == '/8021qMembe.cgi':
+            return self._post_membership(request, hash)
+        if path == '/8021qCf.htm':
+            return Response(self._vlan_config_page(hash))
+        if path == '/8021qCf.cgi':
+            return self._post_vlan_config(request, hash)
+        if path == '/portPVID.htm':
+            return Response(self._pvid_page(hash))
+        if path == '/portPVID.cgi':
+            return self._post_pvid(request, hash)
+        if path == '/portStatistics.htm':
+            return Response(self._statistics_page(hash))
+        return Response('Not Found', status=404)
+
+    def _restore(self, request: Request, hash: str) -> Response:
+        config = next(iter(request.files.values()), b'')
+        if len(config) > self.config_size_limit:
+            return Response(_page('', 'restore_conf', hash, 'The file is too large.'))
+        if not self.load_config(config):
+            return Response(_page('', 'restore_conf', hash, 'Invalid configuration file.'))
+        # the device reboots, everyone is logged out once it goes down
+        self.reboot()
+        self.hashes.clear()
+        return Response(_page(f'<p>{SW_RESTORE_NOTICE}</p>', 'restore_conf'))
+
+    def _post_membership(self, request: Request, hash: str) -> Response:
+        vid = VlanId(request.field('VLAN_ID', '0'))
+        if vid not in self.vlans:
+            return Response(self._membership_page(hash, min(self.vlans), f'VLAN {vid} does not exist.'))
+        membership = request.field('hiddenMem')
+        if membership is None:
+            # only selecting a VLAN to show
+            return Response(self._membership_page(hash, vid))
+
+        if len(membership) != self.port_count or not set(membership) <= set('123'):
+            return Response(self._membership_page(hash, vid, 'Invalid port membership.'))
+        new = {pid: VlanPortMembership(int(m)) for pid, m in enumerate(membership, 1)}
+        for pid, m in new.items():
+            if m == VlanPortMembership.IGNORED and self.pvids[pid] == vid:
+                return Response(self._membership_page(
+                    hash, vid, f'Port {pid} uses VLAN {vid} as PVID, it cannot be removed from the VLAN.'))
+        self.vlans[vid] = new
+        return Response(self._membership_page(hash, vid))
+
+    def _post_vlan_config(self, request: Request, hash: str) -> Response:
+        if request.field('vlanNum') != str(len(self.vlans)):
+            return Response(self._vlan_config_page(hash, 'VLAN list is out of date, please refresh.'))
+        action = request.field('ACTION')
+        if action == 'Add':
+            vid = VlanId(request.field('ADD_VLANID') or 0)
+            if not 1 <= vid <= 4093:
+                return Response(self._vlan_config_page(hash, 'VLAN ID must be between 1 and 4093.'))
+            if vid in self.vlans:
+                return Response(self._vlan_config_page(hash, f'VLAN {vid} already exists.'))
+            if len(self.vlans) >= self.max_vlans:
+                return Response(self._vlan_config_page(hash, 'Maximum number of VLANs reached.'))
+            self.vlans[vid] = {pid: VlanPortMembership.IGNORED for pid in range(1, self.port_count + 1)}
+            return Response(self._vlan_config_page(hash))
+        if action == 'Delete':
+            current = sorted(self.vlans)
+            to_delete = []
+            for key, value in request.form:
+                if not key.startswith('vlanck'):
+                    continue
+                index, vid = int(key[len('vlanck'):]), VlanId(value)
+                if index >= len(current) or current[index] != vid:
+                    return Response(self._vlan_config_page(hash, 'VLAN list is out of date, please refresh.'))
+                if vid == 1:
+                    return Response(self._vlan_config_page(hash, 'VLAN 1 cannot be deleted.'))
+                if vid in self.pvids.values():
+                    return Response(self._vlan_config_page(hash, f'VLAN {vid} is used as PVID, it cannot be deleted.'))
+                to_delete.append(vid)
+            for vid in to_delete:
+                del self.vlans[vid]
+            return Response(self._vlan_config_page(hash))
+        return Response(self._vlan_config_page(hash, f'Unknown action {action}.'))
+
+    def _post_pvid(self, request: Request, hash: str) -> Response:
+        vid = VlanId(request.field('pvid') or 0)
+        if vid not in self.vlans:
+            return Response(self._pvid_page(hash, f'VLAN {vid} does not exist.'))
+        ports = [int(k[len('port'):]) for k, v in request.form if k.startswith('port') and v == 'checked']
+        for pid in ports:
+            if not 1 <= pid <= self.port_count:
+                return Response(self._pvid_page(hash, f'Invalid port {pid}.'))
+            if self.vlans[vid][pid] == VlanPortMembership.IGNORED:
+                return Response(self._pvid_page(hash, f'Port {pid} is not a member of VLAN {vid}.'))
+        for pid in ports:
+            self.pvids[pid] = vid
+        return Response(self._pvid_page(hash))
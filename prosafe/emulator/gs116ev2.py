@@ -0,0 +1,143 @@
+# -*- encoding: utf-8 -*-
+import secrets
+from typing import Dict
+
+from ..switches.general import VlanId, VlanPortMembership
+from ..switches.gs116ev2.consts import *
+from ..switches.gs116ev2.utils import password_kdf
+from .base import EmulatedSwitch, Request, Response
+
+
+_COOKIE = 'SID'
+
+
+def _page(script: str, body: str = '') -> str:
+    return ('<!DOCTYPE html>\n<html>\n<head>\n<meta http-equiv="Content-Type" content="text/html; charset=utf-8">\n'
+            '<title>NETGEAR GS116Ev2</title>\n<link rel="stylesheet" type="text/css" href="/css/base.css">\n'
+            f'<script type="text/javascript">\n{script}\n</script>\n</head>\n<body>\n{body}\n</body>\n</html>\n')
+
+
+def _redirect(target: str) -> str:
+    return _page(f'    top.location.href = "{target}";')
+
+
+def _error(message: str) -> str:
+    return _page(f'    alert("{message}");\n    history.back();')
+
+
+class GS116Ev2Emulator(EmulatedSwitch):
+    """GS116Ev2, firmware V2.6.0.48 as seen by the driver
+
+    Every form but login and restore must carry the session's secureRand."""
+    port_count = 16
+    max_vlans = 256
+    backup_size = 12288
+    model = 'gs116ev2'
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.secure_rands: Dict[str, str] = dict()  # session -> secureRand
+
+    def _vlan_page(self) -> str:
+        groups = []
+        for vid in sorted(self.vlans):
+            ports = []
+            for pid in range(1, self.port_count + 1):
+                m = self.vlans[vid][pid]
+                ports.append('U' if m == VlanPortMembership.UNTAGGED else 'T' if m == VlanPortMembership.TAGGED else '')
+            groups.append('?'.join([str(vid)] + ports))
+        pvids = '?'.join(str(self.pvids[pid]) for pid in range(1, self.port_count + 1))
+        script = (f"var vlanMem = '{','.join(groups)}';\n"
+                  f"var pvid = '{pvids}';\n"
+                  "var maxVlan = %d;" % self.max_vlans)
+        return _page(script, '<form name="vlanCfg" method="post" action="dot1based_advanced_vlan_conf.htm"></form>')
+
+    def handle(self, request: Request) -> Response:
+        path = request.path
+        if path == '/' or (path == SW_URI_LOGIN and request.method == 'GET'):
+            return Response(_page('', '<form name="login" method="post" action="login.htm"><input type="password" name="password"></form>'))
+        if path == SW_URI_LOGIN:
+            if request.field('submitId') != 'pwdLogin' or request.field('password') != password_kdf(self.password):
+                return Response(_redirect(SW_URI_LOGIN + '?1'))
+            sid = self.new_session()
+            self.secure_rands[sid] = secrets.token_hex(8).upper()
+            return Response(_redirect(SW_URI_INDEX + '?0'), cookies={_COOKIE: sid})
+
+        if not self.logged_in(request, _COOKIE):
+            return Response(_redirect(SW_URI_LOGIN))
+        sid = request.cookies[_COOKIE]
+        secure_rand = self.secure_rands[sid]
+        if request.method == 'POST' and path != SW_URI_RESTORE and request.field('secureRand') != secure_rand:
+            return Response(_redirect(SW_URI_LOGIN))
+
+        if path == SW_URI_INDEX:
+            if request.method == 'POST' and request.field('submitId') == 'logoutBtn':
+                self.sessions.discard(sid)
+                self.secure_rands.pop(sid, None)
+                return Response(_redirect(SW_URI_LOGIN))
+            return Response(_page(f"var secureRand = '{secure_rand}';"))
+        if path == SW_URI_INFO:
+            info = '?'.join(['GS116Ev2', 'emulated', self.mac, 'V2.6.0.48', 'Disable',
+                             '127.0.0.1', '255.255.255.0', '127.0.0.1', self.serial])
+            return Response(_page(f"var sysGeneInfor = '{info}';"))
+        if path == SW_URI_BACKUP:
+            return Response(self.dump_config(), content_type='application/octet-stream')
+        if path == SW_URI_RESTORE:
+            config = next(iter(request.files.values()), b'')
+            ok = self.load_config(config)
+            return Response(_redirect(SW_URI_RESTORE.split('/')[-1] + ('?1' if ok else '?0')))
+        if path == SW_URI_8021Q_CONF:
+            if request.method == 'GET':
+                return Response(self._vlan_page())
+            return self._post_vlan_config(request)
+        if path == SW_URI_8021Q_MEMBERSHIP and request.method == 'POST':
+            return self._post_membership(request)
+        if path == SW_URI_PORT_STATISTICS:
+            self.tick_counters()
+            stats = ','.join('?'.join(map(str, c)) for c in self.counters.values())
+            return Response(_page(f"var StatisticsInfo = '{stats}';"))
+        if path == SW_URI_8021Q_PVID and request.method == 'POST':
+            return self._post_pvids(request)
+        return Response('Not Found', status=404)
+
+    def _post_vlan_config(self, request: Request) -> Response:
+        success = Response(_redirect(SW_URI_8021Q_CONF.split('/')[-1]))
+        if request.field('aDot1VLAN') is not None:
+            return success
+        if add_vid := request.field('addVid'):
+            vid = VlanId(add_vid)
+            if not 1 <= vid <= 4093 or vid in self.vlans:
+                return Response(_error(f'Invalid VLAN ID {vid}.'))
+            if len(self.vlans) >= self.max_vlans:
+                return Response(_error('Maximum number of VLANs reached.'))
+            self.vlans[vid] = {pid: VlanPortMembership.IGNORED for pid in range(1, self.port_count + 1)}
+            return success
+        del_vids = [VlanId(v) for v in request.fields('delVid')]
+        for vid in del_vids:
+            if vid == 1 or vid not in self.vlans:
+                return Response(_error(f'VLAN {vid} cannot be deleted.'))
+        for vid in del_vids:
+            del self.vlans[vid]
+        return success
+
+    def _post_membership(self, request: Request) -> Response:
+        vid = VlanId(request.field('vid') or 0)
+        member, tag = int(request.field('member') or 0), int(request.field('tag') or 0)
+        if vid not in self.vlans or tag & ~member:
+            return Response(_error('Invalid VLAN membership.'))
+        self.vlans[vid] = {
+            pid: (VlanPortMembership.TAGGED if tag & (1 << pid) else
+                  VlanPortMembership.UNTAGGED if member & (1 << pid) else
+                  VlanPortMembership.IGNORED)
+            for pid in range(1, self.port_count + 1)
+        }
+        return Response(_redirect(SW_URI_8021Q_MEMBERSHIP.split('/')[-1] + f'?{vid}'))
+
+    def _post_pvids(self, request: Request) -> Response:
+        changes = list(zip(map(int, request.fields('port')), map(VlanId, request.fields('pvid'))))
+        for pid, vid in changes:
+            if not 1 <= pid <= self.port_count or vid not in self.vlans:
+                return Response(_error(f'Invalid PVID {vid} for port {pid}.'))
+        for pid, vid in changes:
+            self.pvids[pid] = vid
+        return Response(_redirect(SW_URI_8021Q_PVID.split('/')[-1]))
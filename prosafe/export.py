@@ -0,0 +1,64 @@
+# -*- encoding: utf-8 -*-
+"""render live switch state as apply-compatible TOML
+
+Written by hand, TOML writers aren't in the dependencies and only a tiny
+subset of TOML is needed here."""
+import json
+import re
+from typing import Dict, Iterable, List
+
+from .switches.general import PvidConfig, VlanConfig, VlanPortMembership
+from .switches.membership import MembershipTable
+from .switches.ranges import VlanRanges
+from .vlan_config import SwitchVlanConfig
+
+
+_bare_key_pattern = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+def toml_str(value: str) -> str:
+    # JSON escapes are valid in TOML basic strings
+    return json.dumps(value, ensure_ascii=False)
+
+
+def toml_key(key: str) -> str:
+    return key if _bare_key_pattern.match(key) else toml_str(key)
+
+
+def port_notes(membership: MembershipTable, pid: int, pvid: int, extra: Iterable[int] = ()) -> List[str]:
+    """VLANs of one port in config notation, ranges where possible
+
+    the pvid VLAN and extra VLANs are listed as N if the port isn't in them"""
+    vlans = {vid: m for vid, masks in membership.items() if (m := masks.port(pid)) != VlanPortMembership.IGNORED}
+    for vid in (pvid, *extra):
+        # the config insists on the pvid VLAN being listed
+        vlans.setdefault(vid, VlanPortMembership.IGNORED)
+    return VlanRanges.from_items(vlans.items()).notes()
+
+
+def render_switch(sw_name: str, sw_cfg: SwitchVlanConfig, membership: VlanConfig|MembershipTable,
+                  pvids: PvidConfig, info: Dict[str, str]) -> str:
+    """one [switches.xxx] section, with its ports"""
+    port_count = sw_cfg.model.port_count
+    membership = MembershipTable.of(membership, port_count)
+    key = f'switches.{toml_key(sw_name)}'
+    lines = [f'[{key}]']
+    for k in ('Switch Name', 'Serial Number', 'Firmware Version'):
+        if info.get(k):
+            lines.append(f'# {k}: {info[k]}')
+    lines += [
+        f'address = {toml_str(sw_cfg.address)}',
+        f'password = {toml_str(sw_cfg.password)}',
+        f'model = {toml_str(sw_cfg.model.value)}',
+        '',
+        f'[{key}.ports]',
+    ]
+    # VLANs without any member would be lost, they go to the first port as N
+    empty = [vid for vid, masks in membership.items() if masks.member == 0]
+    for pid in range(1, port_count + 1):
+        if pid not in pvids:
+            continue
+        notes = ', '.join(toml_str(n) for n in port_notes(membership, pid, pvids[pid], empty))
+        lines.append(f'{pid} = {{ pvid = {pvids[pid]}, vlans = [{notes}] }}')
+        empty = []
+    return '\n'.join(lines) + '\n\n'
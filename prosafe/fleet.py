@@ -0,0 +1,265 @@
+# -*- encoding: utf-8 -*-
+import hashlib
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from enum import StrEnum
+from io import BytesIO
+from pathlib import Path
+from threading import Event
+from typing import Callable, Dict, List
+
+import click
+
+from .export import render_switch
+from .journal import ApplyJournal, target_digest
+from .profiling import SwitchProfile
+from .scheduler import FleetScheduler
+from .session_cache import SessionCache
+from .state_cache import StateCache
+from .vlan_config import SwitchVlanConfig
+
+
+class SwitchStatus(StrEnum):
+    OK = 'ok'
+    FAILED = 'failed'
+    RESTORED = 'restored'  # failed, but the backup is restored
+    ROLLED_BACK = 'rolled-back'  # failed, but the writes that went through are undone
+    SKIPPED = 'skipped'  # never started, because of fail-fast
+
+
+@dataclass
+class SwitchResult:
+    name: str
+    status: SwitchStatus = SwitchStatus.SKIPPED
+    wall_time: float = 0.
+    request_count: int = 0
+    error: str|None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == SwitchStatus.OK
+
+
+SwitchTask = Callable[[str, SwitchVlanConfig], SwitchResult]
+ExportWriter = Callable[[str, str], None]
+
+
+def echo(sw_name: str, message: str, err: bool = False):
+    """switches may run in parallel, so always tell which one is talking"""
+    click.echo(f"[{sw_name}] {message}", err=err)
+
+
+def _describe_error(e: BaseException) -> str:
+    return str(e) or type(e).__name__
+
+
+def apply_switch(sw_name: str, sw_cfg: SwitchVlanConfig, norestore: bool, savepath: Path|None,
+                 profile: SwitchProfile|None = None,
+                 session_cache: SessionCache|None = None,
+                 state_cache: StateCache|None = None,
+                 verify: bool = False,
+                 scheduler: FleetScheduler|None = None,
+                 rollback: bool = False,
+                 journal: ApplyJournal|None = None,
+                 resume: bool = False) -> SwitchResult:
+    """backup, apply and (on failure) restore one switch, never raises
+
+    rollback: on failure, first try undoing the writes(BaseSwitch.rollback()),
+        restoring the backup reboots GS108Ev3. The backup is the fallback.
+    journal: where the apply is logged before every write.
+    resume: continue the apply the journal has for this switch and
+        configuration, or skip the switch if the journal says it's done.
+        Without the backup file of the interrupted run, a failure is
+        rolled back to the state the journal started from."""
+    result = SwitchResult(sw_name)
+    start = time.monotonic()
+    echo(sw_name, "Processing switch ...")
+    sw = sw_cfg.connect()
+    vlan_membership = sw_cfg.get_membership_table()
+    pvids = sw_cfg.get_pvids()
+    interrupted = None
+    if journal is not None:
+        target = target_digest(vlan_membership, pvids)
+        if resume and journal.finished(sw.session_key, target):
+            echo(sw_name, "Already applied by an earlier run, skipping.")
+            result.status = SwitchStatus.OK
+            return result
+        if resume:
+            interrupted = journal.interrupted(sw.session_key, target)
+        else:
+            # entries belong to the run that wrote them, an older one must not be resumed later
+            journal.drop(sw.session_key)
+        sw.journal = journal.recorder(sw.session_key, target)
+    if scheduler is not None:
+        scheduler.attach(sw, sw_cfg)
+    if profile is not None:
+        sw.add_observer(profile)
+    try:
+        with sw.logged_in(session_cache=session_cache):
+            digest = hashlib.sha256()
+            # whether there is a backup of the state before this apply(or the interrupted one)
+            backed_up = True
+            with sw.phase('backup'):
+                if interrupted is not None and isinstance(savepath, Path) and (savepath / f'{sw_name}.cfg').exists():
+                    # taken before the interrupted run, keep it rather than back up a half applied state
+                    backup_file = savepath / f'{sw_name}.cfg'
+                    digest.update(backup_file.read_bytes())
+                    echo(sw_name, "Keeping backup %s of the interrupted run" % backup_file)
+                elif interrupted is not None:
+                    # a backup now would hold the half applied state, restoring it undoes nothing
+                    backed_up = False
+                    echo(sw_name, "No backup of the interrupted run, on failure the state the journal "
+                         "started from is written back instead.")
+                elif isinstance(savepath, Path):
+                    # straight to the file, read back only if a restore is needed
+                    backup_file = savepath / f'{sw_name}.cfg'
+                    with open(backup_file, 'wb') as f:
+                        size = sw.backup_to(f, digest)
+                    echo(sw_name, "Backup saved to %s (%d bytes, sha256 %s)" % (backup_file, size, digest.hexdigest()))
+                else:
+                    backup_buffer = BytesIO()
+                    sw.backup_to(backup_buffer, digest)
+            try:
+                current = None
+                if interrupted is not None:
+                    current = sw.resume(interrupted)
+                    echo(sw_name, "Resuming the interrupted apply, %d change(s) were written already." % (
+                        len(interrupted.written)))
+                elif state_cache is not None:
+                    with sw.phase('fetch'):
+                        current = state_cache.current_state(sw, digest.hexdigest())
+                    if current is not None:
+                        echo(sw_name, "Switch unchanged since the last run, using the cached state.")
+                state = sw.apply_vlan_config(vlan_membership, pvids, current=current, verify=verify)
+                if (stats := sw.write_stats).operations > 0:
+                    echo(sw_name, "%d change(s) written in %d form post(s), %d saved by batching." % (
+                        stats.operations, stats.posts, stats.saved))
+                result.status = SwitchStatus.OK
+            except Exception as e:
+                result.status = SwitchStatus.FAILED
+                if state_cache is not None:
+                    # half applied, or restored below, anyway unknown
+                    state_cache.drop(sw.session_key)
+                result.error = _describe_error(e)
+                echo(sw_name, "Error occurred! Check the printed exception!\n"
+                     + ''.join(traceback.format_exception(e)))
+                if not norestore and journal is not None:
+                    # rolled back or restored below, or else half way there, anyway not resumable
+                    journal.drop(sw.session_key)
+                    sw.journal = None
+                if not norestore and (rollback or not backed_up):
+                    echo(sw_name, "Rolling back the changes written ...")
+                    if not backed_up:
+                        # also those of the interrupted run, the resume may have failed before taking its log
+                        sw.write_log = interrupted
+                    try:
+                        sw.rollback()
+                        result.status = SwitchStatus.ROLLED_BACK
+                    except Exception as rollback_error:
+                        echo(sw_name, ("Rollback failed, falling back to the backup!\n" if backed_up else
+                                       "Rollback failed, and there is no backup to restore!\n")
+                             + ''.join(traceback.format_exception(rollback_error)))
+                if not norestore and backed_up and result.status != SwitchStatus.ROLLED_BACK:
+                    echo(sw_name, "Restoring switch configuration ...")
+                    with sw.phase('restore'):
+                        if isinstance(savepath, Path):
+                            backup_data = backup_file.read_bytes()
+                            assert hashlib.sha256(backup_data).digest() == digest.digest(), \
+                                f"Backup file {backup_file} changed since it was saved, refusing to restore it!"
+                        else:
+                            backup_data = backup_buffer.getvalue()
+                        sw.restore(backup_data)
+                    result.status = SwitchStatus.RESTORED
+            # bookkeeping only, failing here must not undo an apply that worked
+            if result.ok and journal is not None:
+                try:
+                    journal.finish(sw.session_key, target)
+                except Exception as e:
+                    echo(sw_name, "Warning: the journal was not updated, --resume applies the switch again: %s" % (
+                        _describe_error(e)))
+            if result.ok and state_cache is not None:
+                try:
+                    with sw.phase('backup'):
+                        state_cache.remember(sw, state, (vlan_membership, pvids))
+                except Exception as e:
+                    echo(sw_name, "Warning: the state was not cached, the next run reads it again: %s" % (
+                        _describe_error(e)))
+    except Exception as e:
+        # login, backup or restore failed
+        result.status = SwitchStatus.FAILED
+        result.error = result.error or _describe_error(e)
+        echo(sw_name, "Error occurred! Check the printed exception!\n"
+             + ''.join(traceback.format_exception(e)))
+    result.wall_time = time.monotonic() - start
+    result.request_count = sw.request_count
+    return result
+
+
+def export_switch(sw_name: str, sw_cfg: SwitchVlanConfig, write: ExportWriter,
+                  session_cache: SessionCache|None = None,
+                  scheduler: FleetScheduler|None = None) -> SwitchResult:
+    """read the live VLAN state of one switch and hand it to write() as TOML, never raises
+
+    logs go to stderr, the TOML may be going to stdout"""
+    result = SwitchResult(sw_name)
+    start = time.monotonic()
+    echo(sw_name, "Exporting switch ...", err=True)
+    sw = sw_cfg.connect()
+    if scheduler is not None:
+        scheduler.attach(sw, sw_cfg)
+    try:
+        with sw.logged_in(session_cache=session_cache):
+            with sw.phase('fetch'):
+                info = sw.fetch_information()
+                membership, pvids = sw.fetch_state()
+        write(sw_name, render_switch(sw_name, sw_cfg, membership, pvids, info))
+        result.status = SwitchStatus.OK
+    except Exception as e:
+        result.status = SwitchStatus.FAILED
+        result.error = _describe_error(e)
+        echo(sw_name, "Error occurred! Check the printed exception!\n"
+             + ''.join(traceback.format_exception(e)), err=True)
+    result.wall_time = time.monotonic() - start
+    result.request_count = sw.request_count
+    return result
+
+
+def run_fleet(cfgs: Dict[str, SwitchVlanConfig], task: SwitchTask,
+              jobs: int = 1, fail_fast: bool = True,
+              order: List[str]|None = None) -> List[SwitchResult]:
+    """run task on every switch, at most `jobs` switches at a time
+
+    with fail_fast, switches not started yet are skipped after the first failure.
+    order: switch names in the order to start them, see FleetScheduler.order().
+    results are in the same order as cfgs."""
+    results = {sw_name: SwitchResult(sw_name) for sw_name in cfgs}
+    abort = Event()
+
+    def run(sw_name: str, sw_cfg: SwitchVlanConfig) -> SwitchResult:
+        if abort.is_set():
+            return results[sw_name]
+        result = task(sw_name, sw_cfg)
+        if not result.ok and fail_fast:
+            abort.set()
+        return result
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        # the pool starts tasks in the order they are submitted
+        futures = {pool.submit(run, n, cfgs[n]): n for n in (order if order is not None else cfgs)}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+
+    return list(results.values())
+
+
+def print_summary(results: List[SwitchResult], wall_time: float, err: bool = False):
+    name_width = max([len(r.name) for r in results] + [len('Switch')])
+    click.echo("%-*s  %-8s  %9s  %8s  %s" % (name_width, 'Switch', 'Status', 'Time(s)', 'Requests', 'Error'), err=err)
+    for r in results:
+        click.echo("%-*s  %-8s  %9.2f  %8d  %s" % (
+            name_width, r.name, r.status, r.wall_time, r.request_count, r.error or ''), err=err)
+    succeeded = sum(1 for r in results if r.ok)
+    click.echo("%d/%d switch(es) succeeded, %d request(s) sent, took %.2fs." % (
+        succeeded, len(results), sum(r.request_count for r in results), wall_time), err=err)
@@ -0,0 +1,215 @@
+# -*- encoding: utf-8 -*-
+"""port counter history, in fixed size memory-mapped files
+
+One file per switch, holding the last `capacity` samples. Samples are
+appended, the oldest one is overwritten once the file is full, so the
+file never grows. Storage is columnar, all uint64:
+
+    header | timestamps(ms) x capacity | counters x capacity
+
+where the counters of a sample are rx bytes, tx bytes and CRC errors of
+port 1, then of port 2, and so on. Queries slice the mapped file directly,
+one strided copy per column, without reading the whole file."""
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from itertools import compress, repeat
+from operator import lt, sub, truediv
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from .cache import key_to_filename
+from .switches.general import PortCounters, PortId, PortStatistics
+
+
+_MAGIC = b'PSRING01'
+# magic, port count, capacity, counter bits, next slot, samples stored
+_HEADER = struct.Struct('<8sQQQQQ')
+_HEADER_SIZE = 64
+_COUNTERS = len(PortCounters._fields)
+
+
+def counter_delta(old: int, new: int, bits: int = 64) -> int:
+    """how much a counter grew, it may have wrapped around in between
+
+    A counter going back by more than half its range was cleared or the
+    switch rebooted, rather than wrapped, it grew by its new value then."""
+    if new >= old:
+        return new - old
+    wrapped = new + (1 << bits) - old
+    if wrapped <= 1 << (bits - 1):
+        return wrapped
+    return new
+
+
+def counter_deltas(column: Sequence[int], bits: int = 64) -> List[int]:
+    """counter_delta() between consecutive values of a column, column-wise
+
+    The differences are taken in one pass, only the few negative ones(wrapped
+    or cleared counters) are corrected one by one."""
+    deltas = list(map(sub, column[1:], column[:-1]))
+    for i in compress(range(len(deltas)), map(lt, deltas, repeat(0))):
+        deltas[i] = counter_delta(column[i], column[i + 1], bits)
+    return deltas
+
+
+@dataclass
+class PortRate:
+    """traffic of one port between two stored samples"""
+    time: float  # unix time of the later sample
+    interval: float  # seconds
+    rx_bytes: int
+    tx_bytes: int
+    crc_errors: int
+
+    @property
+    def rx_rate(self) -> float:
+        """bytes per second"""
+        return self.rx_bytes / self.interval if self.interval > 0 else 0.
+
+    @property
+    def tx_rate(self) -> float:
+        return self.tx_bytes / self.interval if self.interval > 0 else 0.
+
+
+class CounterRing:
+    """the counter history of one switch, see the module doc
+
+    A new file is created with port_count, capacity and counter_bits, an
+    existing file keeps its own. Appends come from one thread at a time."""
+
+    def __init__(self, path: str|Path, port_count: int, capacity: int = 100_000, counter_bits: int = 64) -> None:
+        self.path = Path(path)
+        if not self.path.exists():
+            self._create(port_count, capacity, counter_bits)
+        self._file = open(self.path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, self.port_count, self.capacity, self.counter_bits, self._next, self._count = \
+            _HEADER.unpack_from(self._map, 0)
+        assert magic == _MAGIC, f"{self.path} is not a counter history file!"
+        self._width = self.port_count * _COUNTERS
+        assert len(self._map) == _HEADER_SIZE + 8 * self.capacity * (1 + self._width), \
+            f"{self.path} is truncated!"
+        view = memoryview(self._map)
+        self._times = view[_HEADER_SIZE:_HEADER_SIZE + 8 * self.capacity].cast('Q')
+        self._counters = view[_HEADER_SIZE + 8 * self.capacity:].cast('Q')
+
+    def _create(self, port_count: int, capacity: int, counter_bits: int):
+        size = _HEADER_SIZE + 8 * capacity * (1 + port_count * _COUNTERS)
+        tmp = self.path.with_name('.tmp-' + self.path.name)
+        with open(tmp, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, port_count, capacity, counter_bits, 0, 0))
+            # sparse where the file system allows
+            f.truncate(size)
+        os.replace(tmp, self.path)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def close(self):
+        self._times.release()
+        self._counters.release()
+        self._map.close()
+        self._file.close()
+
+    def _segments(self) -> List[Tuple[int, int]]:
+        """slots holding samples, oldest first, as [start, end) ranges"""
+        if self._count < self.capacity:
+            return [(0, self._count)]
+        return [(self._next, self.capacity), (0, self._next)]
+
+    def last_time(self) -> float|None:
+        if self._count == 0:
+            return None
+        return self._times[(self._next - 1) % self.capacity] / 1000
+
+    def append(self, timestamp: float, stats: PortStatistics) -> bool:
+        """store one sample, False if it's not newer than the last one(the clock went back)"""
+        last = self.last_time()
+        if last is not None and timestamp <= last:
+            return False
+        slot = self._next
+        base = slot * self._width
+        for pid in range(1, self.port_count + 1):
+            counters = stats.get(pid, PortCounters(0, 0, 0))
+            offset = base + (pid - 1) * _COUNTERS
+            self._counters[offset:offset + _COUNTERS] = array('Q', counters)
+        self._times[slot] = int(timestamp * 1000)
+        # the header goes last, a crash in between loses only this sample
+        self._next = (slot + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+        _HEADER.pack_into(self._map, 0, _MAGIC, self.port_count, self.capacity, self.counter_bits,
+                          self._next, self._count)
+        return True
+
+    def _slots(self, start: float, end: float) -> Iterator[Tuple[int, int]]:
+        """[first, last) slot ranges of the samples within [start, end], oldest first"""
+        lo, hi = int(start * 1000), int(end * 1000)
+        for seg_start, seg_end in self._segments():
+            first = bisect_left(self._times, lo, seg_start, seg_end)
+            last = bisect_right(self._times, hi, first, seg_end)
+            if first < last:
+                yield first, last
+
+    def times(self, start: float = 0., end: float = float('inf')) -> array:
+        """timestamps(ms) of the samples within [start, end]"""
+        end = min(end, 2 ** 63 / 1000)
+        result = array('Q')
+        for first, last in self._slots(start, end):
+            result.extend(self._times[first:last])
+        return result
+
+    def column(self, pid: PortId, counter: int, start: float = 0., end: float = float('inf')) -> array:
+        """one counter(index into PortCounters) of one port, for the samples within [start, end]"""
+        assert 1 <= pid <= self.port_count, f"Port {pid} out of range 1-{self.port_count}"
+        end = min(end, 2 ** 63 / 1000)
+        offset = (pid - 1) * _COUNTERS + counter
+        result = array('Q')
+        for first, last in self._slots(start, end):
+            result.extend(self._counters[first * self._width + offset:last * self._width:self._width])
+        return result
+
+    def rates(self, pid: PortId, start: float = 0., end: float = float('inf')) -> List[PortRate]:
+        """traffic of a port between consecutive samples within [start, end]"""
+        times = self.times(start, end)
+        deltas = [counter_deltas(self.column(pid, c, start, end), self.counter_bits) for c in range(_COUNTERS)]
+        seconds = map(truediv, times[1:], repeat(1000))
+        intervals = map(truediv, map(sub, times[1:], times[:-1]), repeat(1000))
+        return list(map(PortRate, seconds, intervals, *deltas))
+
+
+class HistoryStore:
+    """one CounterRing per switch, in a directory"""
+
+    def __init__(self, path: str|Path, capacity: int = 100_000) -> None:
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.capacity = capacity
+        self._rings: Dict[str, CounterRing] = dict()
+        self._lock = Lock()
+
+    def _file(self, sw_name: str) -> Path:
+        return self.path / key_to_filename(sw_name, '.ring')
+
+    def ring(self, sw_name: str, port_count: int = 0, counter_bits: int = 64) -> CounterRing:
+        """the ring of a switch, created with port_count ports if it has none yet"""
+        with self._lock:
+            ring = self._rings.get(sw_name)
+            if ring is None:
+                assert port_count > 0 or self._file(sw_name).exists(), f"No history of switch {sw_name}!"
+                ring = self._rings[sw_name] = CounterRing(self._file(sw_name), port_count, self.capacity, counter_bits)
+            return ring
+
+    def append(self, sw_name: str, port_count: int, timestamp: float, stats: PortStatistics,
+               counter_bits: int = 64) -> bool:
+        return self.ring(sw_name, port_count, counter_bits).append(timestamp, stats)
+
+    def close(self):
+        with self._lock:
+            for ring in self._rings.values():
+                ring.close()
+            self._rings.clear()
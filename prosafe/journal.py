@@ -0,0 +1,124 @@
+# -*- encoding: utf-8 -*-
+"""write-ahead journal of applies, so an interrupted run can be resumed
+
+Before each form post, the operations planned and those already confirmed
+are saved, along with the state the apply started from. If the run dies,
+the next `apply --resume` continues every switch from its journal instead
+of reading its whole state again, and skips the switches it finished.
+Journaling is opt-in(`apply --journal`), and entries are only trusted for
+a while, as the switches may have been changed since."""
+import hashlib
+import json
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from .cache import cache_dir, key_to_filename, write_private
+from .state_cache import decode_state, encode_state
+from .switches.general import PvidConfig, WriteLog
+from .switches.membership import MembershipTable, PortMasks
+from .switches.planner import AddVlan, DeleteVlan, Operation, SetMembership, SetPvid
+
+
+def _encode_op(op: Operation) -> Dict:
+    if isinstance(op, AddVlan):
+        return {'op': 'add', 'vid': op.vid}
+    if isinstance(op, SetMembership):
+        return {'op': 'membership', 'vid': op.vid, 'membership': list(op.membership), 'previous': list(op.previous)}
+    if isinstance(op, SetPvid):
+        return {'op': 'pvid', 'pid': op.pid, 'vid': op.vid, 'previous': op.previous}
+    return {'op': 'delete', 'vid': op.vid}
+
+
+def _decode_op(data: Dict) -> Operation:
+    kind = data['op']
+    if kind == 'add':
+        return AddVlan(data['vid'])
+    if kind == 'membership':
+        return SetMembership(data['vid'], PortMasks(*data['membership']), PortMasks(*data['previous']))
+    if kind == 'pvid':
+        return SetPvid(data['pid'], data['vid'], data['previous'])
+    assert kind == 'delete', f"Unknown operation {kind} in the journal!"
+    return DeleteVlan(data['vid'])
+
+
+def _encode_ops(ops: List[Operation]) -> List[Dict]:
+    return [_encode_op(op) for op in ops]
+
+
+def _decode_ops(data: List[Dict]) -> List[Operation]:
+    return [_decode_op(op) for op in data]
+
+
+def target_digest(membership: MembershipTable, pvids: PvidConfig) -> str:
+    """identifies the configuration an apply is after"""
+    data = json.dumps(encode_state((membership, pvids)), sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class ApplyJournal:
+    """one file per switch, keyed like the other caches
+
+    An entry is 'running' while an apply writes, and 'done' once it
+    succeeded. Rolled back or restored switches have no entry, and an apply
+    that doesn't resume drops the entry of its switch first. Entries are
+    only used for the same target configuration(see target_digest()), and
+    for ttl seconds after they were last written."""
+
+    def __init__(self, path: str|Path|None = None, ttl: float = 3600.) -> None:
+        self.path = Path(path) if path is not None else cache_dir('journal')
+        self.path.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self.ttl = ttl
+
+    def _file(self, key: str) -> Path:
+        return self.path / key_to_filename(key, '.json')
+
+    def _load(self, key: str, target: str) -> Dict|None:
+        try:
+            with open(self._file(key), 'rb') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('key') != key or entry.get('target') != target:
+            return None
+        if time.time() - entry.get('saved', 0) > self.ttl:
+            return None
+        return entry
+
+    def finished(self, key: str, target: str) -> bool:
+        """the switch was brought to target by an earlier run"""
+        entry = self._load(key, target)
+        return entry is not None and entry['status'] == 'done'
+
+    def interrupted(self, key: str, target: str) -> WriteLog|None:
+        """the log of an apply to target that never finished, see BaseSwitch.resume()"""
+        entry = self._load(key, target)
+        if entry is None or entry['status'] != 'running':
+            return None
+        return WriteLog(decode_state(entry['before']), entry['plan_options'],
+                        _decode_ops(entry['planned']), _decode_ops(entry['written']),
+                        _decode_ops(entry['in_flight']))
+
+    def recorder(self, key: str, target: str) -> Callable[[WriteLog], None]:
+        """saves the log on every change, set it as BaseSwitch.journal"""
+        def record(log: WriteLog):
+            entry = {
+                'key': key,
+                'target': target,
+                'status': 'running',
+                'saved': time.time(),
+                'before': encode_state(log.before),
+                'plan_options': log.plan_options,
+                'planned': _encode_ops(log.planned),
+                'written': _encode_ops(log.written),
+                'in_flight': _encode_ops(log.in_flight),
+            }
+            write_private(self._file(key), json.dumps(entry).encode())
+        return record
+
+    def finish(self, key: str, target: str):
+        entry = {'key': key, 'target': target, 'status': 'done', 'saved': time.time()}
+        write_private(self._file(key), json.dumps(entry).encode())
+
+    def drop(self, key: str):
+        self._file(key).unlink(missing_ok=True)
@@ -0,0 +1,210 @@
+# -*- encoding: utf-8 -*-
+"""port counters and switch information in the Prometheus text format
+
+Scrapes are answered from memory. The switches are read in the background,
+each on its own schedule, so however often the endpoint is scraped, a
+switch gets one statistics request per interval."""
+import heapq
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Condition, Lock, Thread
+from typing import Dict, List, Tuple
+
+import click
+
+from .poller import FleetPoller
+from .scheduler import FleetScheduler
+from .session_cache import SessionCache
+from .switches.general import PortStatistics
+from .vlan_config import SwitchVlanConfig
+
+
+# metric name, PortCounters field, help
+_PORT_METRICS = [
+    ('prosafe_port_receive_bytes_total', 'rx_bytes', 'Bytes received on the port.'),
+    ('prosafe_port_transmit_bytes_total', 'tx_bytes', 'Bytes sent from the port.'),
+    ('prosafe_port_crc_errors_total', 'crc_errors', 'Packets received with CRC errors on the port.'),
+]
+# label, fetch_information() key
+_INFO_LABELS = [
+    ('name', 'Switch Name'),
+    ('firmware', 'Firmware Version'),
+    ('mac', 'MAC Address'),
+    ('serial', 'Serial Number'),
+]
+
+
+def _label_value(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels: str) -> str:
+    return '{' + ','.join(f'{k}="{_label_value(v)}"' for k, v in labels.items()) + '}'
+
+
+@dataclass
+class _Entry:
+    """what is known about one switch"""
+    info: Dict[str, str] = field(default_factory=dict)
+    info_time: float = 0.  # monotonic, when info was read
+    stats: PortStatistics|None = None
+    stats_time: float = 0.  # monotonic, when stats were read
+    duration: float = 0.  # seconds the last refresh took
+    error: str|None = None  # of the last refresh
+
+
+class MetricsCollector:
+    """keeps the counters of a fleet in memory, refreshed in the background
+
+    Every switch is refreshed each interval seconds, starting staggered over
+    the first interval, at most jobs at a time. Its information(firmware,
+    MAC, serial) is only read again each info_interval. Counters older than
+    ttl aren't served, the switch shows as down instead. Switches stay
+    logged in between refreshes, see FleetPoller."""
+
+    def __init__(self, cfgs: Dict[str, SwitchVlanConfig], interval: float = 30., ttl: float|None = None,
+                 info_interval: float = 3600., jobs: int = 8,
+                 scheduler: FleetScheduler|None = None,
+                 session_cache: SessionCache|None = None) -> None:
+        self.cfgs = cfgs
+        self.interval = interval
+        self.ttl = ttl if ttl is not None else 3 * interval
+        self.info_interval = info_interval
+        self._poller = FleetPoller(cfgs, 1, scheduler, session_cache)
+        self._pool = ThreadPoolExecutor(max_workers=jobs)
+        self._entries: Dict[str, _Entry] = {sw_name: _Entry() for sw_name in cfgs}
+        self._lock = Lock()
+        self._rendered: Tuple[float, bytes]|None = None  # rendered at(monotonic), text
+        self._due: List[Tuple[float, str]] = list()
+        self._wakeup = Condition()
+        self._stopped = False
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def start(self):
+        now = time.monotonic()
+        step = self.interval / max(len(self.cfgs), 1)
+        self._due = [(now + i * step, sw_name) for i, sw_name in enumerate(self.cfgs)]
+        heapq.heapify(self._due)
+        self._thread.start()
+        return self
+
+    def close(self):
+        with self._wakeup:
+            self._stopped = True
+            self._wakeup.notify()
+        self._thread.join()
+        self._pool.shutdown()
+        self._poller.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _run(self):
+        with self._wakeup:
+            while not self._stopped:
+                due, sw_name = self._due[0] if self._due else (float('inf'), '')
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._wakeup.wait(None if wait == float('inf') else wait)
+                    continue
+                heapq.heappop(self._due)
+                self._pool.submit(self._refresh, sw_name, due)
+
+    def _schedule(self, sw_name: str, due: float):
+        with self._wakeup:
+            # a refresh slower than the interval delays the next one, rather than piling up
+            heapq.heappush(self._due, (max(due, time.monotonic()), sw_name))
+            self._wakeup.notify()
+
+    def _refresh(self, sw_name: str, due: float):
+        start = time.monotonic()
+        entry = self._entries[sw_name]
+        info, info_time, error = entry.info, entry.info_time, None
+        stats, stats_time = entry.stats, entry.stats_time
+        try:
+            _, stats = self._poller.read(sw_name)
+            stats_time = time.monotonic()
+            if not info or stats_time - info_time >= self.info_interval:
+                info, info_time = self._poller.switch(sw_name).fetch_information(), stats_time
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            click.echo(f"[{sw_name}] Refresh failed!\n" + ''.join(traceback.format_exception(e)), err=True)
+        with self._lock:
+            self._entries[sw_name] = _Entry(info, info_time, stats, stats_time, time.monotonic() - start, error)
+            self._rendered = None
+        self._schedule(sw_name, due + self.interval)
+
+    def render(self) -> bytes:
+        """the exposition text, rendered again only after a refresh or once a second"""
+        now = time.monotonic()
+        with self._lock:
+            if self._rendered is not None and now - self._rendered[0] < 1.:
+                return self._rendered[1]
+            entries = dict(self._entries)
+        lines = []
+        fresh = {n: e for n, e in entries.items() if e.stats is not None and now - e.stats_time <= self.ttl}
+
+        lines += ['# HELP prosafe_up Whether the switch answered within the TTL.', '# TYPE prosafe_up gauge']
+        lines += [f'prosafe_up{_labels(switch=n)} {int(n in fresh)}' for n in entries]
+        lines += ['# HELP prosafe_switch_info Switch information, the value is always 1.',
+                  '# TYPE prosafe_switch_info gauge']
+        for n, e in entries.items():
+            if e.info:
+                labels = {'switch': n, 'model': self.cfgs[n].model.value}
+                labels.update({label: e.info.get(key, '') for label, key in _INFO_LABELS})
+                lines.append(f'prosafe_switch_info{_labels(**labels)} 1')
+        lines += ['# HELP prosafe_refresh_duration_seconds Time the last refresh of the switch took.',
+                  '# TYPE prosafe_refresh_duration_seconds gauge']
+        lines += [f'prosafe_refresh_duration_seconds{_labels(switch=n)} {e.duration:.3f}'
+                  for n, e in entries.items() if e.duration > 0]
+        lines += ['# HELP prosafe_counters_age_seconds Age of the port counters served.',
+                  '# TYPE prosafe_counters_age_seconds gauge']
+        lines += [f'prosafe_counters_age_seconds{_labels(switch=n)} {now - e.stats_time:.3f}'
+                  for n, e in fresh.items()]
+        for name, attr, help in _PORT_METRICS:
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} counter']
+            for n, e in fresh.items():
+                lines += [f'{name}{_labels(switch=n, port=str(pid))} {getattr(c, attr)}'
+                          for pid, c in sorted(e.stats.items())]
+        text = ('\n'.join(lines) + '\n').encode()
+        with self._lock:
+            self._rendered = (now, text)
+        return text
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    collector: MetricsCollector
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.collector.render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_metrics(collector: MetricsCollector, host: str, port: int):
+    """answer GET /metrics on host:port until interrupted"""
+    class Handler(_MetricsHandler):
+        pass
+    Handler.collector = collector
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
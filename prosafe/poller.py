@@ -0,0 +1,149 @@
+# -*- encoding: utf-8 -*-
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, List, Set, Tuple
+
+import click
+
+from .history import HistoryStore, counter_delta
+from .scheduler import FleetScheduler
+from .session_cache import SessionCache
+from .switches.general import BaseSwitch, PortId, PortStatistics
+from .vlan_config import SwitchVlanConfig
+
+
+@dataclass
+class PortSample:
+    """traffic of one port between two samples"""
+    switch: str
+    port: PortId
+    time: float  # unix time of the sample
+    interval: float  # seconds since the previous sample
+    rx_bytes: int
+    tx_bytes: int
+    crc_errors: int
+
+    @property
+    def rx_rate(self) -> float:
+        """bytes per second"""
+        return self.rx_bytes / self.interval if self.interval > 0 else 0.
+
+    @property
+    def tx_rate(self) -> float:
+        return self.tx_bytes / self.interval if self.interval > 0 else 0.
+
+
+def _deltas(sw_name: str, old: Tuple[float, PortStatistics], new: Tuple[float, PortStatistics],
+            bits: int) -> List[PortSample]:
+    (old_time, old_stats), (new_time, new_stats) = old, new
+    samples = list()
+    for pid, counters in new_stats.items():
+        previous = old_stats.get(pid)
+        if previous is None:
+            continue
+        samples.append(PortSample(sw_name, pid, new_time, new_time - old_time,
+                                  *(counter_delta(o, n, bits) for o, n in zip(previous, counters))))
+    return samples
+
+
+class FleetPoller:
+    """samples the port counters of a fleet, at most `jobs` switches at a time
+
+    Every switch logs in on its first sample and stays logged in until
+    close(), a dropped session is logged in again once per sample. The
+    first sample of a switch gives no traffic yet, only the counters to
+    compare the next one with. With a store, every sample's counters are
+    kept there as well. Use it as a context manager:
+
+        with FleetPoller(cfgs) as poller:
+            while True:
+                samples = poller.sample()
+    """
+
+    def __init__(self, cfgs: Dict[str, SwitchVlanConfig], jobs: int = 8,
+                 scheduler: FleetScheduler|None = None,
+                 session_cache: SessionCache|None = None,
+                 store: HistoryStore|None = None) -> None:
+        self.cfgs = cfgs
+        self.scheduler = scheduler
+        self.session_cache = session_cache
+        self.store = store
+        self._pool = ThreadPoolExecutor(max_workers=jobs)
+        self._stack = ExitStack()
+        self._stack_lock = Lock()
+        self._switches: Dict[str, BaseSwitch] = dict()
+        self._last: Dict[str, Tuple[float, PortStatistics]] = dict()
+        self.errors: Dict[str, str] = dict()  # switches failing the last sample, and why
+        self._warned: Set[str] = set()  # models warned about
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def switch(self, sw_name: str) -> BaseSwitch:
+        """the driver of a switch, logged in on first use"""
+        sw = self._switches.get(sw_name)
+        if sw is None:
+            sw_cfg = self.cfgs[sw_name]
+            sw = sw_cfg.connect()
+            if not sw.statistics_verified and sw_cfg.model not in self._warned:
+                self._warned.add(sw_cfg.model)
+                click.echo(f"Warning: the {sw_cfg.model} statistics page parser is only tested against "
+                           f"the emulator, compare the first numbers with the web UI.", err=True)
+            if self.scheduler is not None:
+                self.scheduler.attach(sw, sw_cfg)
+            # logged out(or saved to the session cache) on close()
+            session = sw.logged_in(session_cache=self.session_cache)
+            session.__enter__()
+            with self._stack_lock:
+                self._stack.push(session)
+            self._switches[sw_name] = sw
+        return sw
+
+    def read(self, sw_name: str) -> Tuple[float, PortStatistics]:
+        """the current counters of a switch, and when they were read"""
+        sw = self.switch(sw_name)
+        try:
+            stats = sw.fetch_statistics()
+        except AssertionError:
+            # the switch may have dropped the session meanwhile
+            sw.login()
+            stats = sw.fetch_statistics()
+        return time.time(), stats
+
+    def _poll(self, sw_name: str) -> List[PortSample]:
+        """never raises, failures end up in errors"""
+        try:
+            current = self.read(sw_name)
+        except Exception as e:
+            self.errors[sw_name] = str(e) or type(e).__name__
+            click.echo(f"[{sw_name}] Sampling failed!\n" + ''.join(traceback.format_exception(e)), err=True)
+            return []
+        self.errors.pop(sw_name, None)
+        bits = self._switches[sw_name].counter_bits
+        if self.store is not None:
+            self.store.append(sw_name, self.cfgs[sw_name].model.port_count, *current, counter_bits=bits)
+        previous, self._last[sw_name] = self._last.get(sw_name), current
+        if previous is None:
+            return []
+        return _deltas(sw_name, previous, current, bits)
+
+    def sample(self) -> List[PortSample]:
+        """sample every switch once, the traffic since the previous sample"""
+        samples = list()
+        for result in self._pool.map(self._poll, self.cfgs):
+            samples += result
+        return samples
+
+    def close(self):
+        self._pool.shutdown()
+        self._stack.close()
+        self._switches.clear()
+        if self.store is not None:
+            self.store.close()
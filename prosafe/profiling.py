@@ -0,0 +1,100 @@
+# -*- encoding: utf-8 -*-
+import json
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from threading import Lock
+from typing import Dict, List
+
+import click
+
+from .switches.session import RequestObserver, RequestRecord
+
+
+# the usual order of an apply, anything else is listed after these
+PHASES = ['login', 'backup', 'fetch', 'plan', 'write', 'delete', 'verify', 'rollback', 'restore', 'logout']
+
+
+@dataclass
+class PhaseSummary:
+    wall_time: float = 0.  # seconds the phase took
+    requests: int = 0
+    latency: float = 0.  # sum over the requests
+    parse_time: float = 0.
+    request_bytes: int = 0
+    response_bytes: int = 0
+    errors: int = 0
+
+    def add(self, other: 'PhaseSummary'):
+        for k, v in asdict(other).items():
+            setattr(self, k, getattr(self, k) + v)
+
+
+class SwitchProfile(RequestObserver):
+    """collects the requests and phases of one switch, add it with BaseSwitch.add_observer()"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.records: List[RequestRecord] = []
+        self.phase_times: Dict[str, float] = defaultdict(float)
+        self._lock = Lock()
+
+    def on_request(self, record: RequestRecord):
+        with self._lock:
+            self.records.append(record)
+
+    def on_phase(self, phase: str, seconds: float):
+        with self._lock:
+            self.phase_times[phase] += seconds
+
+    def summary(self) -> Dict[str, PhaseSummary]:
+        phases: Dict[str, PhaseSummary] = defaultdict(PhaseSummary)
+        for phase, seconds in self.phase_times.items():
+            phases[phase].wall_time += seconds
+        for r in self.records:
+            p = phases[r.phase or 'other']
+            p.requests += 1
+            p.latency += r.latency
+            p.parse_time += r.parse_time
+            p.request_bytes += r.request_bytes
+            p.response_bytes += r.response_bytes
+            p.errors += r.error is not None
+        return _ordered(phases)
+
+
+def _ordered(phases: Dict[str, PhaseSummary]) -> Dict[str, PhaseSummary]:
+    order = PHASES + sorted(set(phases) - set(PHASES))
+    return {p: phases[p] for p in order if p in phases}
+
+
+def fleet_summary(profiles: List[SwitchProfile]) -> Dict[str, PhaseSummary]:
+    total: Dict[str, PhaseSummary] = defaultdict(PhaseSummary)
+    for profile in profiles:
+        for phase, summary in profile.summary().items():
+            total[phase].add(summary)
+    return _ordered(total)
+
+
+def print_profile(profiles: List[SwitchProfile]):
+    """per-phase totals over all switches"""
+    click.echo("%-8s %10s %8s %11s %10s %10s %10s" % (
+        'Phase', 'Time(s)', 'Requests', 'Latency(s)', 'Parse(s)', 'Sent(KiB)', 'Recv(KiB)'))
+    for phase, p in fleet_summary(profiles).items():
+        click.echo("%-8s %10.3f %8d %11.3f %10.3f %10.1f %10.1f" % (
+            phase, p.wall_time, p.requests, p.latency, p.parse_time,
+            p.request_bytes / 1024, p.response_bytes / 1024))
+    click.echo("Time is summed over switches, latency and parse time over requests.")
+
+
+def dump_profile(profiles: List[SwitchProfile], path: str):
+    data = {
+        'total': {k: asdict(v) for k, v in fleet_summary(profiles).items()},
+        'switches': {
+            p.name: {
+                'phases': {k: asdict(v) for k, v in p.summary().items()},
+                'requests': [asdict(r) for r in p.records],
+            }
+            for p in profiles
+        },
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
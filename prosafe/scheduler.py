@@ -0,0 +1,133 @@
+# -*- encoding: utf-8 -*-
+import ipaddress
+import json
+from pathlib import Path
+from threading import BoundedSemaphore, Lock
+from typing import Dict, List
+
+from .cache import cache_dir, write_private
+from .switches.general import BaseSwitch
+from .vlan_config import SwitchVlanConfig
+
+
+def switch_key(sw_cfg: SwitchVlanConfig) -> str:
+    """identifies a switch before there's a driver for it"""
+    address = sw_cfg.address.split('://', 1)[-1].rstrip('/')
+    return f'{sw_cfg.model.value}@{address}'
+
+
+def default_site(sw_cfg: SwitchVlanConfig, prefix: int = 24) -> str:
+    """the IPv4 /prefix network of the switch, or its host name"""
+    host = sw_cfg.address.split('://', 1)[-1].split('/', 1)[0].rsplit(':', 1)[0]
+    try:
+        return str(ipaddress.ip_network(f'{host}/{prefix}', strict=False))
+    except ValueError:
+        return host
+
+
+def vlan_count(sw_cfg: SwitchVlanConfig) -> int:
+    """number of VLANs configured on any port, counted from the VLAN ranges"""
+    runs = sorted((first, last) for port in sw_cfg.ports.values() for first, last, _ in port.vlans.runs())
+    count = 0
+    end = 0  # last VID counted
+    for first, last in runs:
+        if last > end:
+            count += last - max(first, end + 1) + 1
+            end = last
+    return count
+
+
+class TimingHistory:
+    """how long each switch took last time, so the slowest can start first
+
+    One JSON file for all switches, times are smoothed over runs."""
+
+    def __init__(self, path: str|Path|None = None, weight: float = 0.5) -> None:
+        self.file = Path(path) if path is not None else cache_dir('timings') / 'timings.json'
+        self.weight = weight  # of the latest run
+        try:
+            with open(self.file, 'rb') as f:
+                self.times: Dict[str, float] = json.load(f)
+        except (OSError, ValueError):
+            self.times = dict()
+
+    def get(self, key: str) -> float|None:
+        return self.times.get(key)
+
+    def record(self, key: str, seconds: float):
+        old = self.times.get(key)
+        self.times[key] = seconds if old is None else old + self.weight * (seconds - old)
+
+    def save(self):
+        write_private(self.file, json.dumps(self.times).encode())
+
+
+class FleetScheduler:
+    """when switches start, and how many requests they may have in flight
+
+    Every request of a switch holds three slots: the one of its switch(the
+    web UIs mishandle concurrent form posts, so requests to a switch always go
+    one at a time), one of its site(site_requests) and one of the whole fleet
+    (max_requests). None means no limit. Sites are the `site` of the switch config, or its /24 network.
+    Slots are taken narrowest first, so a request waiting for its busy switch
+    doesn't hold a fleet slot meanwhile.
+
+    With a history, switches start slowest first, unknown ones before all
+    others as they may be the slowest of all. Configured VLAN count breaks
+    ties. Without one, switches start in config order."""
+
+    def __init__(self, max_requests: int|None = None, site_requests: int|None = None,
+                 history: TimingHistory|None = None) -> None:
+        self.site_requests = site_requests
+        self.history = history
+        self._fleet = BoundedSemaphore(max_requests) if max_requests is not None else None
+        self._sites: Dict[str, BoundedSemaphore] = dict()
+        self._switches: Dict[str, BoundedSemaphore] = dict()
+        self._lock = Lock()
+
+    def site_of(self, sw_cfg: SwitchVlanConfig) -> str:
+        return sw_cfg.site or default_site(sw_cfg)
+
+    def limits(self, sw_cfg: SwitchVlanConfig) -> List[BoundedSemaphore]:
+        """the slots a request of the switch takes, in order"""
+        limits = list()
+        with self._lock:
+            # switches listed twice share their slot
+            key = switch_key(sw_cfg)
+            if key not in self._switches:
+                self._switches[key] = BoundedSemaphore(1)
+            limits.append(self._switches[key])
+            if self.site_requests is not None:
+                site = self.site_of(sw_cfg)
+                if site not in self._sites:
+                    self._sites[site] = BoundedSemaphore(self.site_requests)
+                limits.append(self._sites[site])
+        if self._fleet is not None:
+            limits.append(self._fleet)
+        return limits
+
+    def attach(self, sw: BaseSwitch, sw_cfg: SwitchVlanConfig):
+        """make the requests of sw obey the limits"""
+        sw.set_request_limits(self.limits(sw_cfg))
+
+    def order(self, cfgs: Dict[str, SwitchVlanConfig]) -> List[str]:
+        """switch names, in the order they should start
+
+        The config order without a history, upstream switches are usually
+        listed first and must not lose their management access last."""
+        if self.history is None:
+            return list(cfgs)
+
+        def estimate(sw_name: str):
+            sw_cfg = cfgs[sw_name]
+            seconds = self.history.get(switch_key(sw_cfg))
+            return (seconds is not None, -(seconds or 0.), -vlan_count(sw_cfg))
+        return sorted(cfgs, key=estimate)
+
+    def record(self, cfgs: Dict[str, SwitchVlanConfig], wall_times: Dict[str, float]):
+        """remember how long the switches took, switches not run are left out"""
+        if self.history is None:
+            return
+        for sw_name, seconds in wall_times.items():
+            self.history.record(switch_key(cfgs[sw_name]), seconds)
+        self.history.save()
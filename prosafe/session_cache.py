@@ -0,0 +1,44 @@
+# -*- encoding: utf-8 -*-
+import json
+import time
+from pathlib import Path
+from typing import Dict
+
+from .cache import cache_dir, key_to_filename, write_private
+
+
+class SessionCache:
+    """logged in sessions kept on disk, so the next run can skip the login
+
+    One file per switch, so switches processed in parallel don't contend.
+    Entries older than ttl seconds are ignored. A fresh entry may still be
+    dead on the switch side, so drivers validate it before use, see
+    BaseSwitch.import_session()."""
+
+    def __init__(self, path: str|Path|None = None, ttl: float = 300.) -> None:
+        self.path = Path(path) if path is not None else cache_dir('sessions')
+        self.path.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self.ttl = ttl
+
+    def _file(self, key: str) -> Path:
+        return self.path / key_to_filename(key, '.json')
+
+    def load(self, key: str) -> Dict|None:
+        try:
+            with open(self._file(key), 'rb') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('key') != key or time.time() - entry.get('saved', 0) > self.ttl:
+            return None
+        return entry.get('state')
+
+    def save(self, key: str, state: Dict|None):
+        if state is None:
+            self.drop(key)
+            return
+        entry = {'key': key, 'saved': time.time(), 'state': state}
+        write_private(self._file(key), json.dumps(entry).encode())
+
+    def drop(self, key: str):
+        self._file(key).unlink(missing_ok=True)
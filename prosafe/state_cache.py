@@ -0,0 +1,94 @@
+# -*- encoding: utf-8 -*-
+import hashlib
+import json
+import time
+from pathlib import Path
+from typing import Dict
+
+from .cache import cache_dir, key_to_filename, write_private
+from .switches.general import BaseSwitch, PvidConfig, VlanState
+from .switches.membership import MembershipTable, PortMasks
+
+
+def encode_state(state: VlanState) -> Dict:
+    membership, pvids = state
+    if not isinstance(membership, MembershipTable):
+        membership = MembershipTable.from_config(membership)
+    return {
+        # json keys are strings anyway, membership as a digit per port, like the GS108Ev3 forms
+        'vlans': {str(vid): masks.to_string(membership.port_count) for vid, masks in membership.items()},
+        'pvids': {str(pid): vid for pid, vid in pvids.items()},
+    }
+
+
+def decode_state(data: Dict) -> VlanState:
+    vlans: Dict[str, str] = data['vlans']
+    membership = MembershipTable(max(map(len, vlans.values()), default=0))
+    for vid, ports in vlans.items():
+        membership[int(vid)] = PortMasks.from_string(ports)
+    pvids: PvidConfig = {int(pid): int(vid) for pid, vid in data['pvids'].items()}
+    return membership, pvids
+
+
+class StateCache:
+    """last known VLAN state of each switch, so applying to an unchanged
+    switch can skip reading its whole state
+
+    One file per switch, keyed by address, remembering the serial number and
+    the sha256 of a config backup taken right after the apply. An entry is
+    only used if the serial number matches and the backup taken before the
+    next apply is the same, byte for byte: the backup holds the whole
+    configuration, tagging included. Entries also expire after ttl seconds.
+    Models reading their state about as fast as a backup are never cached
+    (BaseSwitch.state_cacheable)."""
+
+    def __init__(self, path: str|Path|None = None, ttl: float = 3600.) -> None:
+        self.path = Path(path) if path is not None else cache_dir('state')
+        self.path.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self.ttl = ttl
+
+    def _file(self, key: str) -> Path:
+        return self.path / key_to_filename(key, '.json')
+
+    def load(self, key: str) -> Dict|None:
+        try:
+            with open(self._file(key), 'rb') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('key') != key or time.time() - entry.get('saved', 0) > self.ttl:
+            return None
+        return entry
+
+    def drop(self, key: str):
+        self._file(key).unlink(missing_ok=True)
+
+    def current_state(self, sw: BaseSwitch, backup_digest: str) -> VlanState|None:
+        """the cached state of sw if it can be trusted
+
+        backup_digest: sha256 hex digest of a backup of sw, taken just now."""
+        if not sw.state_cacheable:
+            return None
+        entry = self.load(sw.session_key)
+        if entry is None or entry.get('backup') != backup_digest:
+            return None
+        if sw.fetch_serial_number() != entry['serial']:
+            return None
+        return decode_state(entry['state'])
+
+    def remember(self, sw: BaseSwitch, state: VlanState, applied: VlanState):
+        """state: what sw is in now, applied: the configuration last applied to it
+
+        downloads a backup of sw, to tell next time whether it changed since"""
+        if not sw.state_cacheable:
+            self.drop(sw.session_key)
+            return
+        entry = {
+            'key': sw.session_key,
+            'saved': time.time(),
+            'serial': sw.fetch_serial_number(),
+            'backup': hashlib.sha256(sw.backup()).hexdigest(),
+            'state': encode_state(state),
+            'applied': encode_state(applied),
+        }
+        write_private(self._file(sw.session_key), json.dumps(entry).encode())
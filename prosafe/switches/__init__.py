@@ -1,8 +1,13 @@
+"""the supported models, their drivers are imported on first use
+
+A driver pulls in requests, BeautifulSoup and the like, commands that
+never talk to a switch(help, shell completion, history) don't need them."""
 from enum import StrEnum
-from typing import Type
-from .general import BaseSwitch
-from .gs108ev3 import Switch as DRI_GS108EV3
-from .gs116ev2 import Switch as DRI_GS116EV2
+from importlib import import_module
+from typing import TYPE_CHECKING, Type
+
+if TYPE_CHECKING:
+    from .general import BaseSwitch
 
 
 SWITCH_PORT_COUNT = {
@@ -10,11 +15,24 @@ SWITCH_PORT_COUNT = {
     'gs116ev2': 16,
 }
 
-SWITCH_DRIVER = {
-    'gs108ev3': DRI_GS108EV3,
-    'gs116ev2': DRI_GS116EV2,
+# the package of each model's driver, holding its Switch
+SWITCH_DRIVER_MODULE = {
+    'gs108ev3': '.gs108ev3',
+    'gs116ev2': '.gs116ev2',
 }
 
+
+def _driver_module(model: str):
+    return import_module(SWITCH_DRIVER_MODULE[model], __name__)
+
+
+def __getattr__(name: str):
+    # the model -> driver table, importing every driver
+    if name == 'SWITCH_DRIVER':
+        return {model: _driver_module(model).Switch for model in SWITCH_DRIVER_MODULE}
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 class SwitchModel(StrEnum):
     GS108EV3 = 'gs108ev3'
     GS116EV2 = 'gs116ev2'
@@ -22,7 +40,11 @@ class SwitchModel(StrEnum):
     @property
     def port_count(self):
         return SWITCH_PORT_COUNT.get(self.value, 0)
-    
+
     @property
-    def driver(self) -> Type[BaseSwitch]:
-        return SWITCH_DRIVER.get(self.value, BaseSwitch)
+    def driver(self) -> 'Type[BaseSwitch]':
+        if self.value not in SWITCH_DRIVER_MODULE:
+            from .general import BaseSwitch
+            return BaseSwitch
+        return _driver_module(self.value).Switch
+
@@ -0,0 +1,134 @@
+# -*- encoding: utf-8 -*-
+"""merge planner operations into as few form posts as a model takes
+
+The planner emits one operation per VLAN or port. Two passes turn them into
+form posts: coalesce_plan() drops membership writes a later one makes
+redundant, batch_plan() packs consecutive operations of one kind into a
+post, as far as the model's forms allow(FormLimits)."""
+from dataclasses import dataclass
+from itertools import groupby
+from typing import Dict, List
+
+from .general import PvidConfig, VlanId
+from .planner import AddVlan, DeleteVlan, Operation, SetMembership, SetPvid
+
+
+@dataclass(frozen=True)
+class FormLimits:
+    """what one form post of a model carries, None for no limit
+
+    A membership post always sets one VLAN."""
+    vlans_added: int|None = 1
+    vlans_deleted: int|None = None
+    pvid_values: int|None = None  # distinct pvids set by one post
+    # a VLAN with member ports can be deleted, clearing it first is a wasted post
+    deletes_members: bool = False
+
+
+@dataclass
+class WriteStats:
+    """operations planned and form posts they took, summed over applies"""
+    operations: int = 0
+    posts: int = 0
+
+    @property
+    def saved(self) -> int:
+        """posts saved, compared with one post per operation"""
+        return self.operations - self.posts
+
+    def add(self, operations: int, posts: int):
+        self.operations += operations
+        self.posts += posts
+
+
+def coalesce_plan(plan: List[Operation], pvids: PvidConfig, port_count: int,
+                  deletes_members: bool = False) -> List[Operation]:
+    """plan with the membership writes that can go together merged
+
+    A later membership write of a VLAN replaces the earlier one, in the
+    earlier one's place, if no port it removes from the VLAN(or tags) has
+    that VLAN as pvid in between(the two step dance is only needed for those).
+    With deletes_members(see FormLimits), a membership write followed by
+    deleting its VLAN is dropped, else the VLAN is still cleared first.
+    pvids: of the switch before the plan, ports left out count as unsafe."""
+    out: List[Operation|None] = []
+    pvids = dict(pvids)
+    # VLAN -> index in out of its last membership write, the ports that
+    # had the VLAN as pvid at some point since, and if one was set to it
+    pending: Dict[VlanId, int] = dict()
+    unsafe: Dict[VlanId, int] = dict()
+    pvid_set: Dict[VlanId, bool] = dict()
+
+    def ports_on(vid: VlanId) -> int:
+        mask = 0
+        for pid in range(1, port_count + 1):
+            if pvids.get(pid, vid) == vid:
+                mask |= 1 << pid
+        return mask
+
+    for op in plan:
+        if isinstance(op, SetMembership):
+            idx = pending.get(op.vid)
+            if idx is not None:
+                earlier = out[idx]
+                # leaving the VLAN, or untagged turning tagged
+                removed = (earlier.membership.member & ~op.membership.member) \
+                    | (earlier.membership.untagged & op.membership.tagged)
+                if not removed & unsafe[op.vid]:
+                    out[idx] = SetMembership(op.vid, op.membership, earlier.previous)
+                    continue
+            pending[op.vid] = len(out)
+            unsafe[op.vid] = ports_on(op.vid)
+            pvid_set[op.vid] = False
+        elif isinstance(op, SetPvid):
+            pvids[op.pid] = op.vid
+            if op.vid in pending:
+                unsafe[op.vid] |= 1 << op.pid
+                pvid_set[op.vid] = True
+        elif isinstance(op, DeleteVlan):
+            idx = pending.pop(op.vid, None)
+            if idx is not None and deletes_members and not pvid_set[op.vid]:
+                out[idx] = None
+        elif isinstance(op, AddVlan):
+            pending.pop(op.vid, None)
+        out.append(op)
+    return [op for op in out if op is not None]
+
+
+def _chunks(ops: List[Operation], size: int|None) -> List[List[Operation]]:
+    if size is None:
+        return [ops]
+    return [ops[i:i + size] for i in range(0, len(ops), size)]
+
+
+def _pvid_posts(ops: List[SetPvid], pvid_values: int|None) -> List[List[Operation]]:
+    # a port set twice must see its writes in order, it starts a new segment
+    segments: List[List[SetPvid]] = [[]]
+    for op in ops:
+        if any(o.pid == op.pid for o in segments[-1]):
+            segments.append([])
+        segments[-1].append(op)
+    posts: List[List[Operation]] = []
+    for segment in segments:
+        by_vid: Dict[VlanId, List[Operation]] = dict()
+        for op in segment:
+            by_vid.setdefault(op.vid, []).append(op)
+        for vids in _chunks(list(by_vid), pvid_values):
+            posts.append([op for vid in vids for op in by_vid[vid]])
+    return posts
+
+
+def batch_plan(plan: List[Operation], limits: FormLimits) -> List[List[Operation]]:
+    """consecutive operations of one kind, packed into form posts, in order"""
+    posts: List[List[Operation]] = []
+    for op_type, ops in groupby(plan, key=type):
+        ops = list(ops)
+        if op_type is AddVlan:
+            posts += _chunks(ops, limits.vlans_added)
+        elif op_type is DeleteVlan:
+            posts += _chunks(ops, limits.vlans_deleted)
+        elif op_type is SetPvid:
+            posts += _pvid_posts(ops, limits.pvid_values)
+        else:
+            posts += [[op] for op in ops]
+    return posts
@@ -0,0 +1,79 @@
+# -*- encoding: utf-8 -*-
+"""cheap field extraction from the switches' web pages
+
+Drivers only need a handful of values from each page, like the session
+hash or an error message. Building a full BeautifulSoup tree for that is
+by far the most expensive part of handling a response, so the fields are
+pulled out with precompiled regexes. Only when a page doesn't look like
+we expect, BeautifulSoup is used as a fallback."""
+import re
+from functools import lru_cache, partial
+from html import unescape
+from typing import List
+
+from bs4 import BeautifulSoup
+
+
+BeautifulSoup = partial(BeautifulSoup, features="html.parser")
+
+_value_pattern = re.compile(r'''\svalue\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))''', re.I)
+_option_pattern = re.compile(r'<option\b[^>]*>', re.I)
+_script_pattern = re.compile(r'<script\b[^>]*>(.*?)</script\s*>', re.I | re.S)
+
+
+@lru_cache(maxsize=None)
+def _tag_pattern(tag: str, attr: str, key: str) -> re.Pattern:
+    # a tag that has attr=key, in any quoting style, anywhere among its attributes
+    return re.compile(
+        r'''<%s\b(?=[^>]*\s%s\s*=\s*(?:"%s"|'%s'|%s(?=[\s/>])))[^>]*>''' % (
+            tag, attr, re.escape(key), re.escape(key), re.escape(key)),
+        re.I)
+
+
+@lru_cache(maxsize=None)
+def _select_pattern(select_id: str) -> re.Pattern:
+    return re.compile(r'(%s.*?)</select\s*>' % _tag_pattern('select', 'id', select_id).pattern, re.I | re.S)
+
+
+def _attr_value(tag: str) -> str|None:
+    matched = _value_pattern.search(tag)
+    if matched is None:
+        return None
+    return unescape(next(g for g in matched.groups() if g is not None))
+
+
+def input_value(text: str, **attr: str) -> str|None:
+    """value of the first <input> having the given attribute, e.g. id='hash'
+
+    returns '' when the input has no value, None when there's no such input."""
+    (name, key), = attr.items()
+    matched = _tag_pattern('input', name, key).search(text)
+    if matched is not None:
+        return _attr_value(matched.group(0)) or ''
+    if key not in text:
+        # can't be there at all, skip the expensive fallback
+        return None
+    element = BeautifulSoup(text).find(attrs={name: key})
+    if element is None:
+        return None
+    return element.get('value', '')
+
+
+def option_values(text: str, select_id: str) -> List[str]:
+    """values of all <option>s in <select id=select_id>"""
+    matched = _select_pattern(select_id).search(text)
+    if matched is not None:
+        values = [_attr_value(op) for op in _option_pattern.findall(matched.group(1))]
+        return [v for v in values if v is not None]
+    selection = BeautifulSoup(text).find('select', id=select_id)
+    assert selection is not None, f"No selection '{select_id}' found in the page!"
+    return [op.get('value') for op in selection.find_all('option') if op.get('value') is not None]
+
+
+def first_script(text: str) -> str:
+    """text inside the first <script>, stripped"""
+    matched = _script_pattern.search(text)
+    if matched is not None:
+        return matched.group(1).strip()
+    script = BeautifulSoup(text).find('script')
+    return script.text.strip() if script is not None else ''
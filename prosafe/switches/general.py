@@ -1,6 +1,12 @@
 from enum import IntEnum
-from typing import Dict
+from io import BytesIO
+from time import perf_counter
+from typing import BinaryIO, Dict, Iterable, List, NamedTuple, Tuple
 from contextlib import contextmanager
+from dataclasses import dataclass, field
+import time
+
+from .options import SessionOptions
 
 
 VlanId = int
@@ -18,28 +24,147 @@ class VlanPortMembership(IntEnum):
 SingleVlanConfig = Dict[PortId, VlanPortMembership]
 VlanConfig = Dict[VlanId, SingleVlanConfig]
 PvidConfig = Dict[PortId, VlanId]
+# membership and pvids of a switch, the membership may be a membership.MembershipTable as well
+VlanState = Tuple[VlanConfig, PvidConfig]
+
+
+class PortCounters(NamedTuple):
+    """counters of one port, since the switch booted or they were cleared"""
+    rx_bytes: int
+    tx_bytes: int
+    crc_errors: int
+
+
+PortStatistics = Dict[PortId, PortCounters]
+
+
+@dataclass
+class WriteLog:
+    """what an apply_vlan_config() wrote so far, see BaseSwitch.rollback()"""
+    before: VlanState  # the state the apply started from
+    plan_options: Dict  # two_step and keep_vids, as the driver plans with
+    planned: List = field(default_factory=list)  # operations handed to _execute_plan()
+    written: List = field(default_factory=list)  # operations the switch confirmed
+    in_flight: List = field(default_factory=list)  # operations of the post being sent
+    resumed: bool = False  # continued by the next apply_vlan_config(), see BaseSwitch.resume()
 
 
 class BaseSwitch:
-    def __init__(self, address: str, password: str) -> None:
+    _model: str = ''  # set by drivers, same as the model name in the config
+    _port_count: int = 0  # set by drivers
+    _address: str = ''
+    _login_page: str = ''  # any page answered without a session, set by drivers
+    # rounds of re-reading and rewriting what failed, when an apply is verified
+    verify_retries: int = 2
+    counter_bits: int = 64  # port counters wrap around at 2 ** counter_bits
+    # the statistics page parser was checked against the real web UI, not only the emulator
+    statistics_verified: bool = False
+    _s = None  # the http session, set by drivers
+    form_limits = None  # batching.FormLimits of the model's forms, set by drivers
+    write_stats = None  # batching.WriteStats, set by drivers
+    write_log: WriteLog|None = None  # of the last apply_vlan_config(), set by drivers
+    state_cacheable: bool = False  # if prosafe.state_cache saves requests, set by drivers
+    journal = None  # called with write_log whenever it changes, see prosafe.journal
+
+    def __init__(self, address: str, password: str, options: SessionOptions|None = None) -> None:
         pass
 
+    @property
+    def request_count(self) -> int:
+        """number of requests sent to the switch so far"""
+        if self._s is None:
+            return 0
+        return self._s.request_count
+
+    def add_observer(self, observer):
+        """get per-request and per-phase measurements, see session.RequestObserver"""
+        self._s.observers.append(observer)
+
+    @contextmanager
+    def phase(self, name: str):
+        """label the requests sent inside, and time the whole block
+
+        phases are not meant to be nested"""
+        s = self._s
+        if s is None or not s.observers:
+            yield
+            return
+        s.response_handled()
+        previous, s.phase = s.phase, name
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            s.response_handled()
+            s.phase = previous
+            s.phase_finished(name, perf_counter() - start)
+
+    def set_request_limits(self, limits: List):
+        """context managers(semaphores, mostly) every request is sent within, in order"""
+        self._s.limits = list(limits)
+
     def login(self):
         raise NotImplementedError()
 
     def logout(self):
         raise NotImplementedError()
 
+    @property
+    def session_key(self) -> str:
+        """identifies the switch in caches"""
+        return f'{self._model}@{self._address}'
+
+    def export_session(self) -> Dict|None:
+        """everything needed to continue the current session elsewhere, None if not logged in"""
+        raise NotImplementedError()
+
+    def import_session(self, state: Dict) -> bool:
+        """continue an exported session, if the switch still accepts it
+
+        costs one request, returns False(and stays logged out) if the session is dead"""
+        raise NotImplementedError()
+
     @contextmanager
-    def logged_in(self, *args, **kwargs):
-        self.login()
+    def logged_in(self, *args, session_cache=None, **kwargs):
+        """with a session_cache(see prosafe.session_cache), a cached session is
+        reused if still alive, and the session is kept open for the next run"""
+        with self.phase('login'):
+            state = session_cache.load(self.session_key) if session_cache is not None else None
+            if state is None or not self.import_session(state):
+                self._login_with_retries()
         try:
             yield
         finally:
-            self.logout()
+            with self.phase('logout'):
+                if session_cache is not None:
+                    session_cache.save(self.session_key, self.export_session())
+                else:
+                    self.logout()
+
+    def _login_with_retries(self):
+        """a login starts over from the login page, so unlike a single POST it's safe to redo"""
+        import requests
+        options = self._s.options if self._s is not None else SessionOptions()
+        for attempt in range(options.retries + 1):
+            try:
+                return self.login()
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == options.retries:
+                    raise
+                time.sleep(options.retry_delay(attempt))
 
     def backup(self) -> bytes:
         """Switch configs are small, modern computer can handle them at no effort"""
+        buffer = BytesIO()
+        self.backup_to(buffer)
+        return buffer.getvalue()
+
+    def backup_to(self, fp: BinaryIO, hasher=None) -> int:
+        """stream the config backup into a writable binary file/buffer
+
+        Backups the switch won't accept for restore are refused.
+        hasher: a hashlib object, updated on the fly.
+        returns the size of the backup."""
         raise NotImplementedError()
 
     def restore(self, config: bytes):
@@ -49,6 +174,10 @@ class BaseSwitch:
         """fetch basic information like switch's name, firmware version, etc."""
         raise NotImplementedError()
 
+    def fetch_serial_number(self) -> str:
+        """tells switches apart, drivers may answer it from pages already loaded"""
+        return self.fetch_information()['Serial Number']
+
     def fetch_vlan_membership(self) -> VlanConfig:
         """fetch and return current switch's VLAN configuration"""
         raise NotImplementedError()
@@ -57,12 +186,185 @@ class BaseSwitch:
         """fetch pvids"""
         raise NotImplementedError()
 
-    def apply_vlan_config(self, membership: VlanConfig, pvids: PvidConfig):
+    def fetch_state(self) -> VlanState:
+        """fetch membership and pvids, drivers may read them together"""
+        return self.fetch_vlan_membership(), self.fetch_pvids()
+
+    def fetch_partial_state(self, vids: Iterable[VlanId], pids: Iterable[PortId]) -> VlanState:
+        """membership of VLANs vids(those not on the switch are left out) and pvids of ports pids
+
+        reads the whole state, drivers override it where pages allow reading less."""
+        from .membership import MembershipTable
+        membership, pvids = self.fetch_state()
+        membership = MembershipTable.of(membership, self._port_count)
+        table = MembershipTable(self._port_count)
+        for vid in vids:
+            if vid in membership:
+                table[vid] = membership[vid]
+        return table, {pid: pvids[pid] for pid in pids if pid in pvids}
+
+    def apply_vlan_config(self, membership: VlanConfig, pvids: PvidConfig,
+                          current: VlanState|None = None, verify: bool = False) -> VlanState:
         """apply the given VLAN configuration
         
-        the configuration must be a full configuration"""
+        the configuration must be a full configuration, membership may also
+        be a membership.MembershipTable.
+        current: the known state of the switch(see prosafe.state_cache), saves reading it.
+        verify: read back the VLANs and ports written, and redo the writes that
+            didn't stick, at most verify_retries times.
+        returns the state the switch is in afterwards."""
+        raise NotImplementedError()
+
+    def _execute_plan(self, plan: List, pvids: PvidConfig|None = None, phase: str|None = None):
+        """run planner operations, in order, one form post at a time
+
+        pvids: of the switch before the plan, lets membership writes merge,
+            see batching.coalesce_plan().
+        phase: of every post, by default 'write', or 'delete' for deletes.
+        Posts are logged in write_log, if an apply is logging."""
+        from .planner import DeleteVlan
+        log = self.write_log
+        if log is not None:
+            log.planned += plan
+            self._log_changed()
+        for ops in self._write_batches(plan, pvids):
+            with self.phase(phase or ('delete' if isinstance(ops[0], DeleteVlan) else 'write')):
+                if log is not None:
+                    log.in_flight = ops
+                    self._log_changed()
+                self._post_batch(ops)
+                if log is not None:
+                    log.written += ops
+                    log.in_flight = []
+                    self._log_changed()
+
+    def _start_write_log(self, before: VlanState, plan_options: Dict):
+        """drivers call it before writing, a resumed log is continued instead"""
+        log = self.write_log
+        if log is not None and log.resumed:
+            log.resumed = False
+        else:
+            self.write_log = WriteLog(before, plan_options)
+        self._log_changed()
+
+    def _log_changed(self):
+        if self.journal is not None and self.write_log is not None:
+            self.journal(self.write_log)
+
+    def _settle_in_flight(self, log: WriteLog):
+        """read back what the post in flight touched, it may or may not have gone
+        through, and log what it did as written"""
+        from .membership import MembershipTable
+        from .planner import plan_vlan_changes, simulate_plan, touched_by
+        if not log.in_flight:
+            return
+        vids, pids = touched_by(log.in_flight)
+        actual_vlans, actual_pvids = self.fetch_partial_state(vids, pids)
+        # the same part of the state, as the log has it
+        vlans, pvids = simulate_plan(log.before[0], log.before[1], log.written, self._port_count)
+        logged = MembershipTable(self._port_count)
+        for vid in sorted(vids):
+            if vid in vlans:
+                logged._append(vid, vlans[vid])
+        log.written += plan_vlan_changes(logged, {pid: pvids[pid] for pid in pids if pid in pvids},
+                                         actual_vlans, actual_pvids, self._port_count)
+        log.in_flight = []
+
+    def _post_batch(self, ops: List):
+        """send one form post, ops are all of one type, see batching.batch_plan()"""
         raise NotImplementedError()
 
-    def fetch_statistics(self) -> Dict:
-        """fetch latest ports statistic"""
+    def _write_batches(self, plan: List, pvids: PvidConfig|None = None) -> List[List]:
+        """plan merged and packed into form posts, counted in write_stats"""
+        from .batching import batch_plan, coalesce_plan
+        merged = coalesce_plan(plan, pvids or {}, self._port_count, self.form_limits.deletes_members)
+        posts = batch_plan(merged, self.form_limits)
+        self.write_stats.add(len(plan), len(posts))
+        return posts
+
+    def _verify_plan(self, expected: VlanState, plan: List, **plan_options):
+        """re-read only what plan touched, compare it to expected and retry what differs
+
+        plan_options: two_step and keep_vids, as the driver planned with."""
+        from .planner import plan_retry, touched_by
+        vids, pids = touched_by(plan)
+        for attempt in range(self.verify_retries + 1):
+            if not vids and not pids:
+                return
+            with self.phase('verify'):
+                actual = self.fetch_partial_state(vids, pids)
+                retry = plan_retry(expected, actual, vids, pids, self._port_count, **plan_options)
+            if not retry:
+                return
+            assert attempt < self.verify_retries, \
+                f"Switch state differs from the config after {attempt} retries, still to do: {retry}"
+            self._execute_plan(retry, actual[1])
+            # only what was redone can be wrong now
+            vids, pids = touched_by(retry)
+
+    def rollback(self):
+        """undo what the last apply_vlan_config() wrote, without restoring a backup
+
+        Replays the inverse of the confirmed writes, computed from the state
+        the apply started from. What the failed post(if any) touched is read
+        back first, as it may or may not have gone through. Nothing to do
+        if nothing was written."""
+        from .planner import plan_vlan_changes, simulate_plan
+        log = self.write_log
+        if log is None or not log.written and not log.in_flight:
+            self.write_log = None
+            return
+        with self.phase('rollback'):
+            self._settle_in_flight(log)
+        self.write_log = None
+        before_vlans, before_pvids = log.before
+        vlans, pvids = simulate_plan(before_vlans, before_pvids, log.written, self._port_count)
+        inverse = plan_vlan_changes(vlans, pvids, before_vlans, before_pvids, self._port_count, **log.plan_options)
+        self._execute_plan(inverse, pvids, phase='rollback')
+
+    def resume(self, log: WriteLog) -> VlanState:
+        """continue an interrupted apply, from its log(see prosafe.journal)
+
+        Returns the state the switch is in, to pass as current to the next
+        apply_vlan_config(), which then writes only what's left and keeps
+        logging into log. Reads nothing but what the post in flight touched."""
+        from .planner import simulate_plan
+        with self.phase('fetch'):
+            self._settle_in_flight(log)
+        log.resumed = True
+        self.write_log = log
+        self._log_changed()
+        return simulate_plan(log.before[0], log.before[1], log.written, self._port_count)
+
+    def _answers(self) -> bool:
+        """whether the web server answers at all, no login needed"""
+        return self._s.answers(self._login_page)
+
+    def wait_ready(self, timeout: float = 300., down_timeout: float = 60.):
+        """wait for the switch to reboot(e.g. after a restore), then log in again
+
+        A switch keeps answering for a moment before it goes down, a login
+        then would reach the old instance. So first poll until it stops
+        answering, for at most down_timeout seconds(then it didn't reboot
+        after all, or came back between two polls), 0 skips this for models
+        that don't reboot. Then poll a login, often at first, backing off up
+        to every 10 seconds. Only connection errors and timeouts mean not
+        ready yet, a refused login(e.g. a wrong password) fails right away."""
+        import requests
+        deadline = time.monotonic() + timeout
+        down_deadline = time.monotonic() + min(down_timeout, timeout)
+        while time.monotonic() < down_deadline and self._answers():
+            time.sleep(.5)
+        delay = 1.
+        while True:
+            try:
+                return self.login()
+            except (requests.ConnectionError, requests.Timeout):
+                if time.monotonic() + delay > deadline:
+                    raise
+            time.sleep(delay)
+            delay = min(delay * 1.5, 10.)
+
+    def fetch_statistics(self) -> PortStatistics:
+        """fetch the current counters of every port"""
         raise NotImplementedError()
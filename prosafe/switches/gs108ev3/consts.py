@@ -25,6 +25,8 @@ SW_8021Q_CFG = '/8021qCf..'
 SW_8021Q_MEMBERSHIP = '/8021qMembe..'
 SW_8021Q_PVIDS = '/portPVID..'
 
+SW_PORT_STATISTICS = '/portStatistics..'
+
 SW_BACKUP = '/config_data.bin'
 SW_RESTORE = '/restore_conf..'
 SW_RESTORE_NOTICE = 'The device is restarting. Wait until the process is complete.'
\ No newline at end of file
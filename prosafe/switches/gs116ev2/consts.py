@@ -8,5 +8,9 @@ SW_URI_8021Q_CONF = '/config/dot1based_advanced_vlan_conf.htm'
 SW_URI_8021Q_MEMBERSHIP = '/config/dot1based_advanced_vlan_membership.htm'
 SW_URI_8021Q_PVID = '/config/dot1based_advanced_pvid.htm'
 
+SW_URI_PORT_STATISTICS = '/config/monitoring_port_statistics.htm'
+
 SW_URI_BACKUP = '/GS116Ev2.cfg'
 SW_URI_RESTORE = '/config/maintenance_restore_configuration.htm'
+# the web UI takes up to this many bytes, I've never seen a config over it
+SW_CONFIG_SIZE_LIMIT = 20480
@@ -1,53 +1,46 @@
-from collections import defaultdict
 from io import BytesIO
-from typing import Dict, List, Set
+from typing import BinaryIO, Dict, List, Tuple
 import re
-from functools import partial
 
-from requests import Session
-from bs4 import BeautifulSoup
+import requests
 
 from .utils import password_kdf
 from .consts import *
-from ..general import BaseSwitch, SingleVlanConfig, VlanPortMembership, VlanId, PortId, PvidConfig, VlanConfig
-
-
-BeautifulSoup = partial(BeautifulSoup, features="html.parser")
-
-
-class SwitchSession(Session):
-    def __init__(self, address: str) -> None:
-        self.__address = address
-        super().__init__()
-
-    def get(self, url: str, *args, **kwargs):
-        url = self.__address + url
-        return super().get(url, *args, **kwargs)
-
-    def post(self, url: str, *args, **kwargs):
-        url = self.__address + url
-        return super().post(url, *args, **kwargs)
+from ..extract import first_script
+from ..general import BaseSwitch, PortCounters, PortStatistics, VlanId, PvidConfig, VlanConfig, VlanState
+from ..membership import MembershipTable, PortMasks
+from ..batching import FormLimits, WriteStats
+from ..planner import AddVlan, DeleteVlan, Operation, SetMembership, SetPvid, plan_vlan_changes, simulate_plan
+from ..session import BaseSwitchSession as SwitchSession, SessionOptions, copy_response
 
 
 class Switch(BaseSwitch):
+    _model = 'gs116ev2'
     _port_count: int = 16
+    _login_page = SW_URI_LOGIN
     _address: str
     _password: str
     _s: SwitchSession
-    _secure_rand: str
+    _secure_rand: str|None
     _general_info_pattern = re.compile("(?<=var sysGeneInfor = ')([A-Za-z0-9.?:-]+)(?=';)")
     _secure_rand_pattern = re.compile("(?<=var secureRand = ')([A-Z0-9]+)(?=';)")
     _vlanmem_pattern = re.compile("(?<=var vlanMem = ')([TU0-9,?]+)(?=';)")
     _pvid_pattern = re.compile("(?<=var pvid = ')[0-9?]+(?=';)")
+    _statistics_pattern = re.compile("(?<=var StatisticsInfo = ')([0-9?,]+)(?=';)")
+    # the add form takes one VID, delVid and the pvid form take any number, and
+    # VLANs are deleted members and all(the original driver never cleared them)
+    form_limits = FormLimits(vlans_added=1, vlans_deleted=None, pvid_values=None, deletes_members=True)
 
-    def __init__(self, address: str, password: str) -> None:
+    def __init__(self, address: str, password: str, options: SessionOptions|None = None) -> None:
         if address.startswith('http'):
             self._address = address
         else:
             self._address = 'http://' + address
 
         self._password = password
-        self._s = SwitchSession(self._address)
+        self._s = SwitchSession(self._address, options=options)
+        self._secure_rand = None
+        self.write_stats = WriteStats()
 
     def login(self):
         self._s.get(SW_URI_LOGIN)
@@ -57,7 +50,7 @@ class Switch(BaseSwitch):
             'submitEnd': '',
         }
         res = self._s.post(SW_URI_LOGIN, data=login_form)
-        redirect = BeautifulSoup(res.text).find('script').text.strip()
+        redirect = first_script(res.text)
         assert SW_URI_INDEX + '?0' in redirect, \
             "Login failed, check your password!"
 
@@ -67,6 +60,25 @@ class Switch(BaseSwitch):
         assert matched != None, "Secure rand can't be found in the response text! Aborting!"
         self._secure_rand = matched.group(0)
 
+    def export_session(self) -> Dict|None:
+        if self._secure_rand is None:
+            return None
+        return {
+            'cookies': requests.utils.dict_from_cookiejar(self._s.cookies),
+            'secureRand': self._secure_rand,
+        }
+
+    def import_session(self, state: Dict) -> bool:
+        self._s.cookies.update(state.get('cookies', {}))
+        # a dead session gets redirected to the login page, no secure rand there
+        res = self._s.get(SW_URI_INDEX)
+        matched = self._secure_rand_pattern.search(res.text)
+        if matched is None:
+            self._s.cookies.clear()
+            return False
+        self._secure_rand = matched.group(0)
+        return True
+
     def logout(self):
         logout_form = {
             'submitId': 'logoutBtn',
@@ -112,28 +124,55 @@ class Switch(BaseSwitch):
 
     def fetch_vlan_membership(self) -> VlanConfig:
         res = self._s.get(SW_URI_8021Q_CONF)
-        matched = self._vlanmem_pattern.search(res.text)
-        assert matched != None, f"No VLAN information found! Server response: {res.text}"
-        vlan_membership: VlanConfig = defaultdict(lambda: {i: VlanPortMembership.IGNORED for i in range(1, self._port_count + 1)})
+        return self._parse_vlan_membership(res.text).to_config()
+
+    def fetch_pvids(self) -> PvidConfig:
+        res = self._s.get(SW_URI_8021Q_CONF)
+        return self._parse_pvids(res.text)
+
+    def fetch_state(self) -> Tuple[MembershipTable, PvidConfig]:
+        """membership and pvids are on the same page, read them with one request"""
+        res = self._s.get(SW_URI_8021Q_CONF)
+        return self._parse_vlan_membership(res.text), self._parse_pvids(res.text)
+
+    def fetch_statistics(self) -> PortStatistics:
+        res = self._s.get(SW_URI_PORT_STATISTICS)
+        matched = self._statistics_pattern.search(res.text)
+        assert matched != None, "No port statistics found! Maybe you need a re-login?"
+        # UNVERIFIED: the layout(one group per port, in order: bytes received?bytes
+        # sent?CRC errors) is the emulator's, not checked against a real switch
+        ports = matched.group(0).split(',')
+        assert len(ports) == self._port_count, f"Expected statistics of {self._port_count} ports, found {len(ports)}!"
+        stats: PortStatistics = dict()
+        for pid, port in enumerate(ports, 1):
+            counters = port.split('?')
+            assert len(counters) == 3 and all(counters), f"Unexpected statistics of port {pid}: {port}"
+            stats[pid] = PortCounters(*map(int, counters))
+        return stats
+
+    def _parse_vlan_membership(self, text: str) -> MembershipTable:
+        matched = self._vlanmem_pattern.search(text)
+        assert matched != None, f"No VLAN information found! Server response: {text}"
+        vlan_membership = MembershipTable(self._port_count)
         vlan_groups = matched.group(0).split(',')
         for vlan in vlan_groups:
             vlan_info = vlan.split('?')
             vid = VlanId(vlan_info[0])
-            # touch each vid, so it's created even if it's empty
-            vlan_membership[vid]
+            member = tagged = 0
             for pid, v in enumerate(vlan_info[1:], 1):
                 if v == 'T':
-                    vlan_membership[vid][pid] = VlanPortMembership.TAGGED
+                    member |= 1 << pid
+                    tagged |= 1 << pid
                 elif v == 'U':
-                    vlan_membership[vid][pid] = VlanPortMembership.UNTAGGED
-                # else: # v==''
-                #     vlan_membership[vid][pid] = VlanPortMembership.IGNORED
-        return dict(vlan_membership)
-
-    def fetch_pvids(self) -> PvidConfig:
-        res = self._s.get(SW_URI_8021Q_CONF)
-        matched = self._pvid_pattern.search(res.text)
-        assert matched != None, f"No PVID information found! Server response: {res.text}"
+                    member |= 1 << pid
+                # else: # v=='', IGNORED
+            # empty VLANs are kept as well
+            vlan_membership[vid] = PortMasks(member, tagged)
+        return vlan_membership
+
+    def _parse_pvids(self, text: str) -> PvidConfig:
+        matched = self._pvid_pattern.search(text)
+        assert matched != None, f"No PVID information found! Server response: {text}"
         pvids = matched.group(0).split('?')
         pvid_config: PvidConfig = {
             i: VlanId(v)
@@ -164,23 +203,13 @@ class Switch(BaseSwitch):
         assert SW_URI_8021Q_CONF.split('/')[-1] in res.text, \
             f"Cannot delete VLAN(s)! Server response: {res.text}"
 
-    def _set_vlan_membership(self, vid: VlanId, membership: SingleVlanConfig):
-        mask_member = 0
-        mask_tagged = 0
-
-        for pid, mb in membership.items():
-            if mb == VlanPortMembership.UNTAGGED:
-                mask_member |= 1 << pid
-            elif mb == VlanPortMembership.TAGGED:
-                mask_member |= 1 << pid
-                mask_tagged |= 1 << pid
-
+    def _set_vlan_membership(self, vid: VlanId, membership: PortMasks):
         form_data = {
             'submitId': 'vlanDot1TagCfg',
             'secureRand': self._secure_rand,
             'vid': vid,
-            'member': mask_member,
-            'tag': mask_tagged,
+            'member': membership.member,
+            'tag': membership.tagged,
             'submitEnd': '',
         }
         # Posting to SW_URI_8021Q_CONF seems ok as well.
@@ -205,16 +234,13 @@ class Switch(BaseSwitch):
         assert SW_URI_8021Q_PVID.split('/')[-1] in res.text, \
             f"Cannot update PVIDs! Server response: {res.text}"
 
-    def backup(self) -> bytes:
-        r = self._s.get(SW_URI_BACKUP)
-        r.raise_for_status()
-        data = bytes()
-        for i in r.iter_content():
-            data += i
-        return data
+    def backup_to(self, fp: BinaryIO, hasher=None) -> int:
+        with self._s.get(SW_URI_BACKUP, stream=True) as r:
+            r.raise_for_status()
+            return copy_response(r, fp, SW_CONFIG_SIZE_LIMIT, hasher)
 
     def restore(self, config: bytes):
-        assert len(config) <= 20480, \
+        assert len(config) <= SW_CONFIG_SIZE_LIMIT, \
             "Seriously? Config data over 20KBytes? I refuse to restore it! Please restore it manually."
         files = {'config.cfg': BytesIO(config)}
         res = self._s.post(SW_URI_RESTORE, files=files)
@@ -224,34 +250,47 @@ class Switch(BaseSwitch):
         # 1: success, also inform the ui to logout, but it's not necessary for gs116ev2
         assert SW_URI_RESTORE.split('/')[-1] + '?1' in res.text, \
             f"Cannot restore config! Server response: {res.text}"
-        # anyway, logout
+        # anyway, logout, and login again. It's not known to reboot, so don't
+        # wait for it to go down
         self.logout()
+        self.wait_ready(down_timeout=0.)
 
-    def apply_vlan_config(self, membership: VlanConfig, pvids: PvidConfig):
+    def apply_vlan_config(self, membership: VlanConfig|MembershipTable, pvids: PvidConfig,
+                          current: VlanState|None = None, verify: bool = False) -> VlanState:
         # This is much simpler compared with GS108Ev3, since fewer restrictions present
         # assume input configuration is valid(as is validated by config loader)
         # however, we have to apply measures to prevent losing access to the device
         # I haven't tried to disable all ports, but I think I should prevent it.
 
-        old_vlans = self.fetch_vlan_membership()
-        new_vlans = membership
-
-        vids_old: Set[VlanId] = set(old_vlans.keys())
-        vids_new: Set[VlanId] = set(new_vlans.keys())
-        vids_to_add = vids_new - vids_old
-        # ensure VLAN 1 won't be removed
-        vids_to_remove = vids_old - vids_new - set([1])
         # ensure there's at least one port enabled
-        for pid, pm in new_vlans.get(1, dict()).items():
-            if pm != VlanPortMembership.IGNORED:
-                break
-        else:
-            assert False, \
-                "You must have one port enabled, or you'll lose access to your switch!"
+        membership = MembershipTable.of(membership, self._port_count)
+        assert membership.get(1, PortMasks()).member != 0, \
+            "You must have one port enabled, or you'll lose access to your switch!"
 
-        for vid in vids_to_add:
-            self._add_vlan(vid)
-        for vid, vm in new_vlans.items():
-            self._set_vlan_membership(vid, vm)
-        self._set_pvids(pvids)
-        self._delete_vlans(list(vids_to_remove))
+        if current is None:
+            with self.phase('fetch'):
+                old_vlans, old_pvids = self.fetch_state()
+        else:
+            old_vlans, old_pvids = current
+        with self.phase('plan'):
+            # ensure VLAN 1 won't be removed
+            plan = plan_vlan_changes(old_vlans, old_pvids, membership, pvids, self._port_count,
+                                     keep_vids=[1])
+        self._start_write_log((old_vlans, old_pvids), dict(keep_vids=[1]))
+        self._execute_plan(plan, old_pvids)
+        state = simulate_plan(old_vlans, old_pvids, plan, self._port_count)
+        if verify:
+            # one page holds everything, the re-read is one request
+            self._verify_plan(state, plan, keep_vids=[1])
+        return state
+
+    def _post_batch(self, ops: List[Operation]):
+        op_type = type(ops[0])
+        if op_type is AddVlan:
+            self._add_vlan(ops[0].vid)
+        elif op_type is SetMembership:
+            self._set_vlan_membership(ops[0].vid, ops[0].membership)
+        elif op_type is SetPvid:
+            self._set_pvids({op.pid: op.vid for op in ops})
+        elif op_type is DeleteVlan:
+            self._delete_vlans([op.vid for op in ops])
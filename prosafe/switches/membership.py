@@ -0,0 +1,195 @@
+# -*- encoding: utf-8 -*-
+"""VLAN membership as bitmasks
+
+Bit `1 << pid` of `member` is set if the port is in the VLAN, tagged or not,
+the same bit of `tagged` if it's tagged. These are the masks GS116Ev2's form
+takes. Bit 0 is never used, port ids start from 1."""
+from array import array
+from bisect import bisect_left
+from typing import Iterator, List, NamedTuple, Tuple
+
+from .general import PortId, SingleVlanConfig, VlanConfig, VlanId, VlanPortMembership
+
+
+def all_ports(port_count: int) -> int:
+    """the mask with every port set"""
+    return ((1 << port_count) - 1) << 1
+
+
+class PortMasks(NamedTuple):
+    """membership of one VLAN"""
+    member: int = 0
+    tagged: int = 0
+
+    @property
+    def untagged(self) -> int:
+        return self.member & ~self.tagged
+
+    @classmethod
+    def from_dict(cls, membership: SingleVlanConfig) -> 'PortMasks':
+        member = tagged = 0
+        for pid, mb in membership.items():
+            if mb == VlanPortMembership.UNTAGGED:
+                member |= 1 << pid
+            elif mb == VlanPortMembership.TAGGED:
+                member |= 1 << pid
+                tagged |= 1 << pid
+        return cls(member, tagged)
+
+    @classmethod
+    def from_string(cls, membership: str) -> 'PortMasks':
+        """from GS108Ev3's form string, one digit per port like "1223" """
+        member = tagged = 0
+        for pid, state in enumerate(membership, start=1):
+            if state == '1':
+                member |= 1 << pid
+            elif state == '2':
+                member |= 1 << pid
+                tagged |= 1 << pid
+            else:
+                assert state == '3', f"Unknown membership {state} of port {pid}!"
+        return cls(member, tagged)
+
+    def to_dict(self, port_count: int) -> SingleVlanConfig:
+        return {pid: self.port(pid) for pid in range(1, port_count + 1)}
+
+    def to_string(self, port_count: int) -> str:
+        """GS108Ev3's form string, see from_string()"""
+        return ''.join(
+            '3' if not self.member >> pid & 1 else '2' if self.tagged >> pid & 1 else '1'
+            for pid in range(1, port_count + 1))
+
+    def port(self, pid: PortId) -> VlanPortMembership:
+        if not self.member >> pid & 1:
+            return VlanPortMembership.IGNORED
+        if self.tagged >> pid & 1:
+            return VlanPortMembership.TAGGED
+        return VlanPortMembership.UNTAGGED
+
+    def merge(self, other: 'PortMasks') -> 'PortMasks':
+        """ports in either, untagged wins over tagged, same as min() over the enum"""
+        member = self.member | other.member
+        return PortMasks(member, member & ~(self.untagged | other.untagged))
+
+    def changed_ports(self, other: 'PortMasks') -> int:
+        """mask of the ports different in other"""
+        return (self.member ^ other.member) | (self.tagged ^ other.tagged)
+
+    def with_ports(self, ports: int, source: 'PortMasks') -> 'PortMasks':
+        """ports in the mask take their membership from source"""
+        return PortMasks((self.member & ~ports) | (source.member & ports),
+                         (self.tagged & ~ports) | (source.tagged & ports))
+
+
+class MembershipTable:
+    """VLAN membership of a whole switch, two masks per VLAN, ordered by VID
+
+    A VlanConfig is a dict of dicts of enums, this is three arrays."""
+    __slots__ = ('port_count', '_vids', '_member', '_tagged')
+
+    def __init__(self, port_count: int) -> None:
+        assert port_count < 64, "Masks are 64 bits, port 0 unused"
+        self.port_count = port_count
+        self._vids = array('H')
+        self._member = array('Q')
+        self._tagged = array('Q')
+
+    @classmethod
+    def from_config(cls, config: VlanConfig, port_count: int|None = None) -> 'MembershipTable':
+        """port_count defaults to the largest port id seen"""
+        if port_count is None:
+            port_count = max((max(m, default=0) for m in config.values()), default=0)
+        table = cls(port_count)
+        for vid in sorted(config):
+            table._append(vid, PortMasks.from_dict(config[vid]))
+        return table
+
+    @classmethod
+    def of(cls, config: 'VlanConfig|MembershipTable', port_count: int) -> 'MembershipTable':
+        """config as a table, converted only if needed"""
+        if isinstance(config, MembershipTable):
+            return config
+        return cls.from_config(config, port_count)
+
+    def to_config(self) -> VlanConfig:
+        return {vid: masks.to_dict(self.port_count) for vid, masks in self.items()}
+
+    def copy(self) -> 'MembershipTable':
+        table = MembershipTable(self.port_count)
+        table._vids = array('H', self._vids)
+        table._member = array('Q', self._member)
+        table._tagged = array('Q', self._tagged)
+        return table
+
+    def _find(self, vid: VlanId) -> int:
+        idx = bisect_left(self._vids, vid)
+        if idx < len(self._vids) and self._vids[idx] == vid:
+            return idx
+        return -1
+
+    def _append(self, vid: VlanId, masks: PortMasks):
+        """vid must be larger than every vid in the table"""
+        self._vids.append(vid)
+        self._member.append(masks.member)
+        self._tagged.append(masks.tagged)
+
+    def __len__(self) -> int:
+        return len(self._vids)
+
+    def __iter__(self) -> Iterator[VlanId]:
+        return iter(self._vids)
+
+    def __contains__(self, vid: VlanId) -> bool:
+        return self._find(vid) >= 0
+
+    def __getitem__(self, vid: VlanId) -> PortMasks:
+        idx = self._find(vid)
+        if idx < 0:
+            raise KeyError(vid)
+        return PortMasks(self._member[idx], self._tagged[idx])
+
+    def get(self, vid: VlanId, default: PortMasks|None = None) -> PortMasks|None:
+        idx = self._find(vid)
+        if idx < 0:
+            return default
+        return PortMasks(self._member[idx], self._tagged[idx])
+
+    def __setitem__(self, vid: VlanId, masks: PortMasks):
+        idx = bisect_left(self._vids, vid)
+        if idx < len(self._vids) and self._vids[idx] == vid:
+            self._member[idx] = masks.member
+            self._tagged[idx] = masks.tagged
+        else:
+            self._vids.insert(idx, vid)
+            self._member.insert(idx, masks.member)
+            self._tagged.insert(idx, masks.tagged)
+
+    def __delitem__(self, vid: VlanId):
+        idx = self._find(vid)
+        if idx < 0:
+            raise KeyError(vid)
+        del self._vids[idx]
+        del self._member[idx]
+        del self._tagged[idx]
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, MembershipTable):
+            return NotImplemented
+        return (self.port_count == other.port_count and self._vids == other._vids
+                and self._member == other._member and self._tagged == other._tagged)
+
+    def items(self) -> Iterator[Tuple[VlanId, PortMasks]]:
+        for idx, vid in enumerate(self._vids):
+            yield vid, PortMasks(self._member[idx], self._tagged[idx])
+
+    def active_ports(self) -> int:
+        """mask of the ports in at least one VLAN"""
+        mask = 0
+        for member in self._member:
+            mask |= member
+        return mask
+
+    def port_vids(self, pid: PortId) -> List[VlanId]:
+        """the VLANs a port is in, ordered"""
+        bit = 1 << pid
+        return [vid for vid, member in zip(self._vids, self._member) if member & bit]
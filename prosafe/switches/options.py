@@ -0,0 +1,26 @@
+# -*- encoding: utf-8 -*-
+"""session settings, apart from the session itself, which needs requests"""
+from dataclasses import dataclass
+
+
+@dataclass
+class SessionOptions:
+    """how a session talks to its switch, [switches.xxx.http] in the config"""
+    connect_timeout: float = 5.  # seconds
+    read_timeout: float = 30.  # seconds without a byte of the response
+    # Connection failures are retried for every request, nothing reached the
+    # switch. Later failures are retried for GETs only, a POST that may have
+    # been handled is never sent again.
+    retries: int = 2
+    backoff: float = 0.5  # seconds between retries, doubled each time
+    # the web servers handle few connections and drop idle ones, False opens
+    # a new connection for every request instead
+    keep_alive: bool = True
+
+    @property
+    def timeout(self):
+        return self.connect_timeout, self.read_timeout
+
+    def retry_delay(self, attempt: int) -> float:
+        """seconds to wait before retry number attempt, counting from 0"""
+        return self.backoff * 2 ** attempt
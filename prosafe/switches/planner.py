@@ -0,0 +1,160 @@
+# -*- encoding: utf-8 -*-
+"""compute the operations needed to move a switch from one VLAN setup to another
+
+The planner knows nothing about web forms. It only diffs the fetched state
+against the desired state, and emits the operations for the VLANs and ports
+that actually change. Drivers then execute the operations in order.
+Membership is handled as bitmasks, see membership.py."""
+from dataclasses import dataclass
+from typing import Iterable, List, Set, Tuple, Union
+
+from .general import PortId, PvidConfig, VlanConfig, VlanId, VlanState
+from .membership import MembershipTable, PortMasks, all_ports
+
+
+@dataclass(frozen=True)
+class AddVlan:
+    vid: VlanId
+
+
+@dataclass(frozen=True)
+class SetMembership:
+    vid: VlanId
+    membership: PortMasks
+    previous: PortMasks
+
+
+@dataclass(frozen=True)
+class SetPvid:
+    pid: PortId
+    vid: VlanId
+    previous: VlanId|None
+
+
+@dataclass(frozen=True)
+class DeleteVlan:
+    vid: VlanId
+
+
+Operation = Union[AddVlan, SetMembership, SetPvid, DeleteVlan]
+
+
+def plan_vlan_changes(old_vlans: VlanConfig|MembershipTable, old_pvids: PvidConfig,
+                      new_vlans: VlanConfig|MembershipTable, new_pvids: PvidConfig,
+                      port_count: int,
+                      two_step: bool = False,
+                      preserve_omitted_ports: bool = False,
+                      keep_vids: Iterable[VlanId] = ()) -> List[Operation]:
+    """diff old and new state, return the operations to execute, in order
+
+    two_step: membership changes go in two rounds around the pvid changes,
+        first add the new T/U, then remove the stale ones. So a port never
+        loses its pvid VLAN.
+    preserve_omitted_ports: ports that are IGNORED everywhere in new_vlans
+        keep their pvid and their membership in that VLAN.
+    keep_vids: VLANs that must never be deleted.
+
+    The order is: add VLANs, (step1) membership, pvids, step2 membership,
+    delete VLANs. Unchanged VLANs and ports produce no operation at all."""
+    old = MembershipTable.of(old_vlans, port_count)
+    new = MembershipTable.of(new_vlans, port_count)
+    vids_old: Set[VlanId] = set(old)
+    vids_new: Set[VlanId] = set(new)
+    vids_to_add = vids_new - vids_old
+    vids_to_remove = vids_old - vids_new - set(keep_vids)
+
+    # the membership every VLAN ends up with
+    target = new.copy()
+    for vid in vids_to_remove:
+        target[vid] = PortMasks()
+
+    if preserve_omitted_ports:
+        # These are the ports ommitted/always IGNORED in the VlanConfig
+        ports_preserved = all_ports(port_count) & ~new.active_ports()
+        # preserved ports, only because they need a pvid but not assigned by user
+        # - remove their pvids from vids_to_remove,
+        # - copy its original membership on vlan[pvid] to new config
+        for port_id in range(1, port_count + 1):
+            if not ports_preserved >> port_id & 1:
+                continue
+            pvid = old_pvids[port_id]
+            # old pvid must be one of the old vids
+            target[pvid] = target.get(pvid, PortMasks()).with_ports(1 << port_id, old[pvid])
+            vids_to_remove.discard(pvid)
+
+    adds: List[Operation] = [AddVlan(vid) for vid in sorted(vids_to_add)]
+    step1: List[Operation] = []
+    step2: List[Operation] = []
+    for vid, desired in target.items():
+        if vid in vids_to_add:
+            current = PortMasks()
+        else:
+            current = old[vid]
+        if vid in vids_to_remove and not two_step:
+            # deleting is enough
+            continue
+        if two_step:
+            merged = current.merge(desired)
+            if merged != current:
+                step1.append(SetMembership(vid, merged, current))
+                current = merged
+            if desired != current:
+                step2.append(SetMembership(vid, desired, current))
+        elif desired != current:
+            step1.append(SetMembership(vid, desired, current))
+
+    pvid_changes: List[Operation] = [
+        SetPvid(pid, vid, old_pvids.get(pid))
+        for pid, vid in sorted(new_pvids.items())
+        if old_pvids.get(pid) != vid
+    ]
+    deletes: List[Operation] = [DeleteVlan(vid) for vid in sorted(vids_to_remove)]
+
+    return adds + step1 + pvid_changes + step2 + deletes
+
+
+def simulate_plan(old_vlans: VlanConfig|MembershipTable, old_pvids: PvidConfig, plan: List[Operation],
+                  port_count: int) -> VlanState:
+    """the state a switch ends up in, once every operation of plan succeeded"""
+    vlans = MembershipTable.of(old_vlans, port_count).copy()
+    pvids: PvidConfig = dict(old_pvids)
+    for op in plan:
+        if isinstance(op, AddVlan):
+            vlans[op.vid] = PortMasks()
+        elif isinstance(op, SetMembership):
+            vlans[op.vid] = op.membership
+        elif isinstance(op, SetPvid):
+            pvids[op.pid] = op.vid
+        elif isinstance(op, DeleteVlan) and op.vid in vlans:
+            del vlans[op.vid]
+    return vlans, pvids
+
+
+def touched_by(plan: List[Operation]) -> Tuple[Set[VlanId], Set[PortId]]:
+    """the VLANs and the ports(by pvid) the operations of plan write to"""
+    vids: Set[VlanId] = set()
+    pids: Set[PortId] = set()
+    for op in plan:
+        if isinstance(op, SetPvid):
+            pids.add(op.pid)
+        else:
+            vids.add(op.vid)
+    return vids, pids
+
+
+def plan_retry(expected: VlanState, actual: VlanState, vids: Iterable[VlanId], pids: Iterable[PortId],
+               port_count: int, two_step: bool = False, keep_vids: Iterable[VlanId] = ()) -> List[Operation]:
+    """the operations redoing what didn't make it to the switch, empty if nothing
+
+    Only VLANs vids and ports pids are compared. actual holds just those,
+    VLANs missing on the switch left out, see BaseSwitch.fetch_partial_state().
+    expected is the full state the switch should be in."""
+    expected_vlans = MembershipTable.of(expected[0], port_count)
+    wanted = MembershipTable(port_count)
+    for vid in sorted(vids):
+        if vid in expected_vlans:
+            wanted._append(vid, expected_vlans[vid])
+    wanted_pvids = {pid: expected[1][pid] for pid in pids if pid in expected[1]}
+    # omitted ports are already settled in expected
+    return plan_vlan_changes(actual[0], actual[1], wanted, wanted_pvids, port_count,
+                             two_step=two_step, keep_vids=keep_vids)
@@ -0,0 +1,103 @@
+# -*- encoding: utf-8 -*-
+from array import array
+from bisect import bisect_right
+from typing import Iterable, Iterator, List, Tuple
+
+from .general import VlanId, VlanPortMembership
+
+
+VID_MIN = 1
+VID_MAX = 4094
+
+_NOTE_STATUS = {
+    VlanPortMembership.UNTAGGED: 'U',
+    VlanPortMembership.TAGGED: 'T',
+    VlanPortMembership.IGNORED: 'N',
+}
+_MEMBERSHIPS = {int(m): m for m in VlanPortMembership}
+
+Run = Tuple[VlanId, VlanId, VlanPortMembership]  # first and last VID, both included
+
+
+class VlanRanges:
+    """VLAN id -> membership of one port, stored as runs of VIDs
+
+    Reads like a Dict[VlanId, VlanPortMembership], but 4000 VLANs in one
+    range take one run. Runs are sorted, never overlap, and adjacent runs
+    of the same membership are joined."""
+    __slots__ = ('_firsts', '_lasts', '_states')
+
+    def __init__(self, runs: Iterable[Run] = ()) -> None:
+        firsts: List[int] = []
+        lasts: List[int] = []
+        states: List[int] = []
+        for first, last, membership in sorted(runs):
+            assert first <= last, f"Invalid VLAN range {first}-{last}!"
+            if lasts and first <= lasts[-1]:
+                assert False, f"Duplicate VLAN ID: {first}"
+            membership = int(membership)
+            if lasts and lasts[-1] + 1 == first and states[-1] == membership:
+                lasts[-1] = last
+            else:
+                firsts.append(first)
+                lasts.append(last)
+                states.append(membership)
+        self._firsts = array('H', firsts)
+        self._lasts = array('H', lasts)
+        self._states = array('B', states)
+
+    @classmethod
+    def from_items(cls, items: Iterable[Tuple[VlanId, VlanPortMembership]]) -> 'VlanRanges':
+        """from single VIDs, like a dict's items()"""
+        return cls((vid, vid, m) for vid, m in items)
+
+    def runs(self) -> Iterator[Run]:
+        for first, last, state in zip(self._firsts, self._lasts, self._states):
+            yield first, last, _MEMBERSHIPS[state]
+
+    def get(self, vid: VlanId, default: VlanPortMembership|None = None) -> VlanPortMembership|None:
+        idx = bisect_right(self._firsts, vid) - 1
+        if idx < 0 or vid > self._lasts[idx]:
+            return default
+        return _MEMBERSHIPS[self._states[idx]]
+
+    def __contains__(self, vid: VlanId) -> bool:
+        return self.get(vid) is not None
+
+    def __getitem__(self, vid: VlanId) -> VlanPortMembership:
+        membership = self.get(vid)
+        if membership is None:
+            raise KeyError(vid)
+        return membership
+
+    def __len__(self) -> int:
+        """number of VIDs, not runs"""
+        return sum(self._lasts) - sum(self._firsts) + len(self._firsts)
+
+    def __iter__(self) -> Iterator[VlanId]:
+        for first, last in zip(self._firsts, self._lasts):
+            yield from range(first, last + 1)
+
+    def items(self) -> Iterator[Tuple[VlanId, VlanPortMembership]]:
+        """every single VID, this is where ranges get expanded"""
+        for first, last, membership in self.runs():
+            for vid in range(first, last + 1):
+                yield vid, membership
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, VlanRanges):
+            return (self._firsts == other._firsts and self._lasts == other._lasts
+                    and self._states == other._states)
+        if isinstance(other, dict):
+            return len(self) == len(other) and all(other.get(vid) == m for vid, m in self.items())
+        return NotImplemented
+
+    def notes(self) -> List[str]:
+        """in config notation, like ['1U', '100-399T']"""
+        return [
+            (f'{first}{_NOTE_STATUS[m]}' if first == last else f'{first}-{last}{_NOTE_STATUS[m]}')
+            for first, last, m in self.runs()
+        ]
+
+    def __repr__(self) -> str:
+        return f'VlanRanges({self.notes()})'
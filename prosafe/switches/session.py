@@ -0,0 +1,183 @@
+# -*- encoding: utf-8 -*-
+import threading
+from contextlib import ExitStack
+from dataclasses import dataclass
+from threading import Lock
+from time import perf_counter
+from typing import BinaryIO, ContextManager, List
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .options import SessionOptions
+
+
+@dataclass
+class RequestRecord:
+    """what happened during one request"""
+    method: str
+    endpoint: str  # path on the switch
+    phase: str  # what the driver was doing, see BaseSwitch.phase()
+    status: int|None = None  # None if no response at all
+    latency: float = 0.  # seconds, until the response is downloaded
+    request_bytes: int = 0
+    response_bytes: int = 0
+    # seconds spent on the response after it arrived(parsing, mostly), until
+    # the same thread sends its next request or the phase ends
+    parse_time: float = 0.
+    error: str|None = None
+
+
+class RequestObserver:
+    """receives instrumentation data from a session, see BaseSwitch.add_observer()
+
+    on_request may be called from several threads at once. The record it gets
+    is updated once more later on, when its parse_time is known."""
+
+    def on_request(self, record: RequestRecord):
+        pass
+
+    def on_phase(self, phase: str, seconds: float):
+        pass
+
+
+def _request_size(prepared: requests.PreparedRequest) -> int:
+    size = len(prepared.method) + len(prepared.path_url) + len(' HTTP/1.1\r\n')
+    size += sum(len(k) + len(v) + 4 for k, v in prepared.headers.items()) + 2
+    body = prepared.body
+    if isinstance(body, (str, bytes)):
+        size += len(body)
+    return size
+
+
+def copy_response(res: requests.Response, fp: BinaryIO, limit: int|None = None,
+                  hasher=None, chunk_size: int = 64 * 1024) -> int:
+    """stream the body of a stream=True response into fp, in large chunks
+
+    limit: refuse bodies larger than this many bytes.
+    hasher: a hashlib object, updated with the data on the fly.
+    returns the number of bytes written."""
+    if limit is not None and (expected := res.headers.get('Content-Length')) is not None:
+        assert int(expected) <= limit, f"Response too large({expected} > {limit} bytes)!"
+    size = 0
+    for chunk in res.iter_content(chunk_size):
+        size += len(chunk)
+        assert limit is None or size <= limit, f"Response too large(over {limit} bytes)!"
+        if hasher is not None:
+            hasher.update(chunk)
+        fp.write(chunk)
+    return size
+
+
+class BaseSwitchSession(requests.Session):
+    """a requests session bound to one switch
+
+    every url is relative to the switch address, and requests are counted.
+    With observers added, every request is also timed and measured.
+    Timeouts and retries are set by options, see SessionOptions."""
+
+    def __init__(self, address: str, options: SessionOptions|None = None) -> None:
+        self._address = address
+        self.options = options if options is not None else SessionOptions()
+        self._count_lock = Lock()
+        self.request_count = 0
+        self.observers: List[RequestObserver] = []
+        # held by every request, e.g. the semaphores of a scheduler.FleetScheduler
+        self.limits: List[ContextManager] = []
+        self.phase = ''
+        self._pending = threading.local()  # the last record of each thread, parse_time still unknown
+        super().__init__()
+        retry = Retry(total=self.options.retries, allowed_methods=frozenset({'GET', 'HEAD'}),
+                      status=0, backoff_factor=self.options.backoff,
+                      raise_on_status=False, respect_retry_after_header=False)
+        # only one host per session, and one connection: requests to a switch go one at a time
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, pool_block=True, max_retries=retry)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+        # for answers(), retries would wait out a reboot it's meant to notice
+        self._probe_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+        self._probing = threading.local()
+        if not self.options.keep_alive:
+            self.headers['Connection'] = 'close'
+
+    def resolve_url(self, method: str, url: str) -> str:
+        """model specific url rewriting happens here"""
+        return self._address + url
+
+    def get(self, url: str, *args, **kwargs):
+        return self._send('GET', url, *args, **kwargs)
+
+    def post(self, url: str, *args, **kwargs):
+        return self._send('POST', url, *args, **kwargs)
+
+    def get_adapter(self, url: str):
+        if getattr(self._probing, 'active', False):
+            return self._probe_adapter
+        return super().get_adapter(url)
+
+    def answers(self, url: str) -> bool:
+        """whether the switch answers a GET at all, tried once"""
+        self._probing.active = True
+        try:
+            self.get(url)
+            return True
+        except (requests.ConnectionError, requests.Timeout):
+            return False
+        finally:
+            self._probing.active = False
+            self._probe_adapter.close()
+
+    def response_handled(self):
+        """the current thread is done with its last response, stop its parse timer"""
+        record = getattr(self._pending, 'record', None)
+        if record is not None:
+            record.parse_time = perf_counter() - self._pending.since
+            self._pending.record = None
+
+    def phase_finished(self, phase: str, seconds: float):
+        for observer in self.observers:
+            observer.on_phase(phase, seconds)
+
+    def _send(self, method: str, url: str, *args, **kwargs):
+        url = self.resolve_url(method, url)
+        kwargs.setdefault('timeout', self.options.timeout)
+        if not self.limits:
+            return self._send_now(method, url, *args, **kwargs)
+        with ExitStack() as stack:
+            for limit in self.limits:
+                stack.enter_context(limit)
+            return self._send_now(method, url, *args, **kwargs)
+
+    def _send_now(self, method: str, url: str, *args, **kwargs):
+        with self._count_lock:
+            self.request_count += 1
+        if not self.observers:
+            return self.request(method, url, *args, **kwargs)
+
+        self.response_handled()
+        record = RequestRecord(method, url[len(self._address):], self.phase)
+        start = perf_counter()
+        try:
+            res = self.request(method, url, *args, **kwargs)
+        except Exception as e:
+            record.latency = perf_counter() - start
+            record.error = str(e) or type(e).__name__
+            self._notify(record)
+            raise
+        record.latency = perf_counter() - start
+        record.status = res.status_code
+        record.request_bytes = _request_size(res.request)
+        if kwargs.get('stream', False):
+            # the body is not downloaded yet, don't touch it
+            record.response_bytes = int(res.headers.get('Content-Length', 0))
+        else:
+            record.response_bytes = len(res.content)
+        self._notify(record)
+        self._pending.record = record
+        self._pending.since = perf_counter()
+        return res
+
+    def _notify(self, record: RequestRecord):
+        for observer in self.observers:
+            observer.on_request(record)
@@ -1,20 +1,31 @@
 # -*- encoding: utf-8 -*-
 
+from array import array
 from collections import defaultdict
+import dataclasses
+import glob
+import hashlib
+import os
+from pathlib import Path
 import tomllib
-from typing import List, Dict
+from typing import List, Dict, Tuple
 from typing_extensions import Annotated
 
-from pydantic import BaseModel, validate_call
-from pydantic.functional_validators import BeforeValidator, model_validator
+from pydantic import BaseModel, Field, validate_call
+from pydantic.functional_validators import PlainValidator, model_validator
 
+from .config_cache import ConfigCache, section_hash
 from .switches.general import PvidConfig, VlanConfig, VlanPortMembership, VlanId, PortId
 from .switches import SwitchModel
+from .switches.membership import MembershipTable, PortMasks
+from .switches.ranges import VID_MAX, VID_MIN, VlanRanges
+from .switches.options import SessionOptions
 
 
 @validate_call
-def _validate_vlan_note_list(notes: List[str]):
-    data = dict()
+def _validate_vlan_note_list(notes: List[str]) -> VlanRanges:
+    """notes are VID + status, or first-last VID + status, like '23T' or '100-399T'"""
+    runs = list()
     for note in notes:
         status = note[-1:]
         if status == 'U':
@@ -25,15 +36,31 @@ def _validate_vlan_note_list(notes: List[str]):
             status = VlanPortMembership.IGNORED
         else:
             assert False, f"Unsupported status {status}, should be one of U, T, N"
-        vid = VlanId(note[:-1])
-        # TODO: move this validation to upper level, so more readable
-        assert vid not in data, f"Duplicate VLAN ID: {vid}"
-        data[vid] = status
+        vids = note[:-1]
+        if '-' in vids:
+            first, last = map(VlanId, vids.split('-', 1))
+            assert VID_MIN <= first <= last <= VID_MAX, \
+                f"Invalid VLAN range {note}, should be within {VID_MIN}-{VID_MAX} and in order"
+        else:
+            first = last = VlanId(vids)
+            assert VID_MIN <= first <= VID_MAX, f"Invalid VLAN {note}, should be within {VID_MIN}-{VID_MAX}"
+        if runs and runs[-1][1] + 1 == first and runs[-1][2] is status:
+            # trunks listing VLANs one by one, keep them as one run
+            runs[-1] = (runs[-1][0], last, status)
+        else:
+            runs.append((first, last, status))
+
+    return VlanRanges(runs)
 
-    return data
 
+def _validate_vlan_notes(notes) -> VlanRanges:
+    if isinstance(notes, VlanRanges):
+        return notes
+    return _validate_vlan_note_list(notes)
 
-_VlanNoteDict = Annotated[Dict[VlanId, VlanPortMembership], BeforeValidator(_validate_vlan_note_list)]
+
+# kept as ranges until get_vlan_membership()/get_membership_table()
+_VlanNoteDict = Annotated[VlanRanges, PlainValidator(_validate_vlan_notes)]
 
 
 class _PortVlanConfig(BaseModel):
@@ -46,6 +73,10 @@ class SwitchVlanConfig(BaseModel):
     password: str
     model: SwitchModel
     ports: Dict[PortId, _PortVlanConfig]
+    # timeouts, retries and connections, e.g. http = { read_timeout = 60 }
+    http: SessionOptions = Field(default_factory=SessionOptions)
+    # switches of a site share the per-site request limit, defaults to the /24 network
+    site: str|None = None
 
     @model_validator(mode='after')
     def check_pvid_and_pid(self):
@@ -53,7 +84,12 @@ class SwitchVlanConfig(BaseModel):
             assert c.pvid in c.vlans, f"Port {p} assigned pvid {c.pvid} but it's NOT in VLAN{c.pvid}!"
             assert 1 <= p <= (pcount := self.model.port_count), \
                 f"Port {p} exceeds acceptable port ID range[1,{pcount}(port_count)], please check your config!"
+        return self
     
+    def connect(self):
+        """a driver for the switch, not logged in yet"""
+        return self.model.driver(self.address, self.password, self.http)
+
     def get_config_by_vlan(self, vid: VlanId):
         data = dict()
         for pid, port_config in self.ports.items():
@@ -68,6 +104,20 @@ class SwitchVlanConfig(BaseModel):
                 data[vid][pid] = membership
         return dict(data)
     
+    def get_membership_table(self) -> MembershipTable:
+        """same as get_vlan_membership(), as bitmasks"""
+        member: Dict[VlanId, int] = defaultdict(int)
+        tagged: Dict[VlanId, int] = defaultdict(int)
+        for pid, port_config in self.ports.items():
+            for vid, membership in port_config.vlans.items():
+                # touch it, so VLANs with only IGNORED ports exist as well
+                member[vid] |= 0 if membership == VlanPortMembership.IGNORED else 1 << pid
+                tagged[vid] |= 1 << pid if membership == VlanPortMembership.TAGGED else 0
+        table = MembershipTable(self.model.port_count)
+        for vid in sorted(member):
+            table[vid] = PortMasks(member[vid], tagged[vid])
+        return table
+
     def get_pvids(self) -> PvidConfig:
         data: PvidConfig = dict()
         for pid, port_config in self.ports.items():
@@ -75,16 +125,210 @@ class SwitchVlanConfig(BaseModel):
         return data
 
 
-def load_config(filename: str) -> Dict[str, SwitchVlanConfig]:
-    with open(filename, 'rb') as f:
-        config_data = tomllib.load(f)
+def _compile_switch(cfg: SwitchVlanConfig) -> Tuple:
+    """a validated config in a compact form, for the config cache
+
+    ports are packed into one array of uint16: pid, pvid, number of runs,
+    then first VID, last VID and membership of every run, for every port."""
+    ports = array('H')
+    for pid, port in cfg.ports.items():
+        runs = list(port.vlans.runs())
+        ports.extend((pid, port.pvid, len(runs)))
+        for run in runs:
+            ports.extend(run)
+    return cfg.address, cfg.password, cfg.model.value, ports.tobytes(), dataclasses.asdict(cfg.http), cfg.site
+
+
+_MEMBERSHIPS = {int(m): m for m in VlanPortMembership}
+
+
+def _construct_switch(data: Tuple, memo: Dict[bytes, _PortVlanConfig]) -> SwitchVlanConfig:
+    """reverse of _compile_switch(), without validating it again
+
+    ports with the same settings share one _PortVlanConfig through memo"""
+    address, password, model, packed, http, site = data
+    values = array('H')
+    values.frombytes(packed)
+    ports: Dict[PortId, _PortVlanConfig] = dict()
+    i = 0
+    while i < len(values):
+        end = i + 3 + 3 * values[i + 2]
+        key = packed[2 * i + 2:2 * end]  # all but pid
+        port = memo.get(key)
+        if port is None:
+            vlans = VlanRanges((values[j], values[j + 1], _MEMBERSHIPS[values[j + 2]]) for j in range(i + 3, end, 3))
+            port = memo[key] = _PortVlanConfig.model_construct(pvid=values[i + 1], vlans=vlans)
+        ports[values[i]] = port
+        i = end
+    return SwitchVlanConfig.model_construct(address=address, password=password, model=SwitchModel(model), ports=ports,
+                                            http=SessionOptions(**http), site=site)
+
+
+def _expand_include(pattern: str) -> List[Path]:
+    """pattern is absolute, matches are sorted so the load order is stable"""
+    return sorted(Path(p).resolve() for p in glob.glob(pattern, recursive=True))
+
+
+def _read_inventory(filename: str) -> Tuple[List[Tuple[str, Dict]], Dict[str, str], List[str]]:
+    """parse filename and every file it includes, recursively
+
+    include is a top level list of globs, relative to the including file.
+    returns the parsed files in load order, the sha256 of every file, and
+    every include pattern(absolute) met."""
+    parsed: List[Tuple[str, Dict]] = list()
+    hashes: Dict[str, str] = dict()
+    patterns: List[str] = list()
+
+    def visit(path: Path):
+        key = str(path)
+        if key in hashes:
+            # included twice, or included by itself
+            return
+        raw = path.read_bytes()
+        hashes[key] = hashlib.sha256(raw).hexdigest()
+        data = tomllib.loads(raw.decode())
+        parsed.append((key, data))
+        includes = data.get('include', [])
+        if isinstance(includes, str):
+            includes = [includes]
+        for pattern in includes:
+            pattern = os.path.join(path.parent, pattern)
+            patterns.append(pattern)
+            matched = _expand_include(pattern)
+            assert matched or glob.has_magic(pattern), f"{key}: included file {pattern} not found!"
+            for p in matched:
+                visit(p)
 
-    switches: Dict = config_data.get('switches', None)
-    assert switches != None, "Invalid config! Please specify your switches under [switches]!"
+    visit(Path(filename).resolve())
+    return parsed, hashes, patterns
 
-    configs: Dict[SwitchVlanConfig] = dict()
-    for sw_name, sw_config in switches.items():
-        cfg = SwitchVlanConfig(**sw_config)
-        configs[sw_name] = cfg
 
+def _sources_unchanged(filename: str, sources: Dict[str, str], patterns: List[str]) -> bool:
+    """same files, same content, as when sources and patterns were recorded"""
+    paths = {str(Path(filename).resolve())}
+    for pattern in patterns:
+        paths.update(map(str, _expand_include(pattern)))
+    if paths != set(sources):
+        return False
+    for path, digest in sources.items():
+        try:
+            raw = Path(path).read_bytes()
+        except OSError:
+            return False
+        if hashlib.sha256(raw).hexdigest() != digest:
+            return False
+    return True
+
+
+_PortKey = Tuple  # (pvid, vlans as a tuple), identifies a resolved port config
+
+
+class _Expander:
+    """resolves port profiles and per-model defaults of switch sections
+
+    every distinct port config is validated once, switches share the result."""
+
+    def __init__(self, profiles: Dict[str, Dict], defaults: Dict[str, Dict]) -> None:
+        self.profiles = profiles
+        self.defaults = defaults
+        self._ports: Dict[_PortKey, _PortVlanConfig] = dict()
+
+    def port_key(self, sw_name: str, pid: PortId, spec) -> _PortKey:
+        """spec is a profile name, or a table with pvid and vlans, or a table
+        with a profile and the keys to override"""
+        where = f"Switch {sw_name} port {pid}"
+        if isinstance(spec, str):
+            spec = {'profile': spec}
+        assert isinstance(spec, dict), f"{where}: should be a profile name or a table, not {spec!r}!"
+        if 'profile' in spec:
+            name = spec['profile']
+            assert isinstance(name, str), f"{where}: profile should be a profile name, not {name!r}!"
+            assert name in self.profiles, f"{where}: profile {name} not found!"
+            assert isinstance(self.profiles[name], dict), f"Profile {name} should be a table!"
+            spec = {**self.profiles[name], **spec}
+        pvid = spec.get('pvid')
+        assert pvid is None or isinstance(pvid, (int, str)), f"{where}: pvid should be a VLAN id, not {pvid!r}!"
+        vlans = spec.get('vlans', [])
+        if not isinstance(vlans, list):
+            # let pydantic complain
+            return pvid, vlans
+        assert all(isinstance(note, str) for note in vlans), \
+            f"{where}: vlans should be a list like ['1U', '100-399T'], not {vlans!r}!"
+        return pvid, tuple(vlans)
+
+    def port(self, key: _PortKey) -> _PortVlanConfig:
+        pvid, vlans = key
+        if not isinstance(vlans, tuple):
+            # not a list in the first place, let pydantic complain
+            return _PortVlanConfig(pvid=pvid, vlans=vlans)
+        port = self._ports.get(key)
+        if port is None:
+            port = self._ports[key] = _PortVlanConfig(pvid=pvid, vlans=list(vlans))
+        return port
+
+    def expand(self, sw_name: str, sw_config: Dict) -> Tuple[Dict, Dict[PortId, _PortKey]]:
+        """the switch section with its model's defaults merged in(switch wins,
+        ports merged one by one), and its ports as keys"""
+        defaults = self.defaults.get(sw_config.get('model'), dict())
+        merged = {**defaults, **sw_config}
+        specs = {PortId(pid): spec for pid, spec in defaults.get('ports', dict()).items()}
+        specs.update({PortId(pid): spec for pid, spec in sw_config.get('ports', dict()).items()})
+        merged.pop('ports', None)
+        return merged, {pid: self.port_key(sw_name, pid, spec) for pid, spec in sorted(specs.items())}
+
+    def validate(self, merged: Dict, ports: Dict[PortId, _PortKey]) -> SwitchVlanConfig:
+        return SwitchVlanConfig(**merged, ports={pid: self.port(key) for pid, key in ports.items()})
+
+
+def override_session_options(cfgs: Dict[str, SwitchVlanConfig], **options):
+    """set session options of every switch, options left None keep their configured value"""
+    options = {k: v for k, v in options.items() if v is not None}
+    if not options:
+        return
+    for cfg in cfgs.values():
+        cfg.http = dataclasses.replace(cfg.http, **options)
+
+
+def load_config(filename: str, cache: ConfigCache|None = None) -> Dict[str, SwitchVlanConfig]:
+    """load switches from filename and the files it includes
+
+    Besides [switches.*], files may define port profiles([profiles.*], used by
+    name in place of a port table) and per-model defaults([defaults.<model>]).
+    With a cache, unchanged inventories and unchanged switches aren't validated again."""
+    entry = cache.load(filename) if cache is not None else None
+    if entry is not None and _sources_unchanged(filename, entry['sources'], entry['patterns']):
+        memo = dict()
+        return {sw_name: _construct_switch(compiled, memo) for sw_name, (_, compiled) in entry['switches'].items()}
+
+    parsed, sources, patterns = _read_inventory(filename)
+    assert any('switches' in data for _, data in parsed), \
+        "Invalid config! Please specify your switches under [switches]!"
+
+    sections: Dict[str, Dict[str, Dict]] = {'switches': dict(), 'profiles': dict(), 'defaults': dict()}
+    for path, data in parsed:
+        for section, target in sections.items():
+            for name, value in data.get(section, dict()).items():
+                assert name not in target, f"{path}: {section}.{name} is already defined!"
+                target[name] = value
+    expander = _Expander(sections['profiles'], sections['defaults'])
+
+    cached: Dict[str, Tuple[str, Tuple]] = entry['switches'] if entry is not None else dict()
+    memo = dict()
+    compiled: Dict[str, Tuple[str, Tuple]] = dict()
+    configs: Dict[str, SwitchVlanConfig] = dict()
+    for sw_name, sw_config in sections['switches'].items():
+        merged, ports = expander.expand(sw_name, sw_config)
+        if cache is None:
+            configs[sw_name] = expander.validate(merged, ports)
+            continue
+        digest = section_hash({**merged, 'ports': ports})
+        if sw_name in cached and cached[sw_name][0] == digest:
+            configs[sw_name] = _construct_switch(cached[sw_name][1], memo)
+            compiled[sw_name] = cached[sw_name]
+        else:
+            configs[sw_name] = cfg = expander.validate(merged, ports)
+            compiled[sw_name] = (digest, _compile_switch(cfg))
+
+    if cache is not None:
+        cache.save(filename, sources, patterns, compiled)
     return configs
@@ -0,0 +1,112 @@
+# -*- encoding: utf-8 -*-
+from typing import Dict, List, Tuple
+
+import pytest
+
+from prosafe.emulator import EMULATOR
+from prosafe.emulator.base import EmulatedSwitch
+from prosafe.switches import SwitchModel
+from prosafe.switches.general import PvidConfig, VlanConfig, VlanPortMembership, VlanState
+from prosafe.switches.membership import MembershipTable
+from prosafe.vlan_config import SwitchVlanConfig
+
+
+PASSWORD = 'password'
+
+
+def _vlan_state(port_count: int, ports: Dict[int, Tuple[int, str]]) -> VlanState:
+    vlans: VlanConfig = {1: {}}
+    pvids: PvidConfig = dict()
+    for pid in range(1, port_count + 1):
+        pvid, notes = ports.get(pid, (1, '1U'))
+        pvids[pid] = pvid
+        for note in notes.split():
+            status = VlanPortMembership.TAGGED if note[-1] == 'T' else VlanPortMembership.UNTAGGED
+            vlans.setdefault(int(note[:-1]), {})[pid] = status
+    for membership in vlans.values():
+        for pid in range(1, port_count + 1):
+            membership.setdefault(pid, VlanPortMembership.IGNORED)
+    return vlans, pvids
+
+
+@pytest.fixture(params=[model.value for model in SwitchModel])
+def model(request) -> SwitchModel:
+    return SwitchModel(request.param)
+
+
+@pytest.fixture
+def vlan_state(model):
+    """a full state of the model in short, ports: pid -> (pvid, '10U 20T ...')
+
+    ports left out are untagged in VLAN 1, which always exists"""
+    return lambda ports: _vlan_state(model.port_count, ports)
+
+
+@pytest.fixture
+def emulator(model):
+    """start an emulator of the model in a state, stopped after the test"""
+    started = []
+
+    def start(state: VlanState|None = None, **kwargs):
+        vlans, pvids = state if state is not None else (None, None)
+        emu = EMULATOR[model.value](PASSWORD, vlans=vlans, pvids=pvids, **kwargs).start()
+        started.append(emu)
+        return emu
+
+    yield start
+    for emu in started:
+        emu.stop()
+
+
+@pytest.fixture
+def connect(model):
+    """a driver for an emulator, not logged in yet"""
+    return lambda emu: model.driver(emu.address, PASSWORD)
+
+
+@pytest.fixture
+def switch_config(model):
+    """the config of an emulated switch, ports as for vlan_state"""
+    def switch_config(emu, ports: Dict[int, Tuple[int, str]]) -> SwitchVlanConfig:
+        return SwitchVlanConfig.model_validate({
+            'address': emu.address, 'password': PASSWORD, 'model': model.value,
+            'ports': {pid: {'pvid': pvid, 'vlans': notes.split()}
+                      for pid, (pvid, notes) in ((pid, ports.get(pid, (1, '1U')))
+                                                 for pid in range(1, model.port_count + 1))},
+        })
+    return switch_config
+
+
+@pytest.fixture
+def state_of(model):
+    """a VlanState, or the state of an emulator, in a form that compares equal when the states are"""
+    def state_of(state: VlanState|EmulatedSwitch):
+        if isinstance(state, EmulatedSwitch):
+            state = state.vlans, state.pvids
+        return MembershipTable.of(state[0], model.port_count), dict(state[1])
+    return state_of
+
+
+def _fail_post(sw, after: int, applied: bool = False) -> List:
+    post = sw._post_batch
+    posts: List = []
+
+    def failing_post(ops):
+        posts.append(ops)
+        if len(posts) == after + 1:
+            if applied:
+                post(ops)
+            raise ConnectionError(f"Injected failure of post {after + 1}")
+        post(ops)
+    sw._post_batch = failing_post
+    return posts
+
+
+@pytest.fixture
+def fail_post():
+    """fail_post(sw, after, applied=False) makes the form post following the
+    first `after` ones fail, once, returns the list of posts tried
+
+    applied: the failing post still reaches the switch, like a connection
+    dropped before the answer came."""
+    return _fail_post
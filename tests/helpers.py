@@ -0,0 +1,8 @@
+# -*- encoding: utf-8 -*-
+"""helpers shared by the tests, fixtures are in conftest.py"""
+from prosafe.switches.membership import PortMasks
+
+
+def masks(member: str, tagged: str = '') -> PortMasks:
+    """ports as digits, e.g. masks('123', '3')"""
+    return PortMasks(sum(1 << int(p) for p in member), sum(1 << int(p) for p in tagged))
@@ -0,0 +1,75 @@
+# -*- encoding: utf-8 -*-
+import time
+
+import pytest
+
+
+def test_apply_reaches_the_target(model, vlan_state, emulator, connect, state_of):
+    old = vlan_state({2: (10, '10U 20T'), 3: (20, '20U'), 4: (1, '1U 20T')})
+    new = vlan_state({1: (1, '1U 10T 30T'), 2: (30, '30U'), 4: (20, '20U 10T')})
+    emu = emulator(old)
+    sw = connect(emu)
+    with sw.logged_in():
+        state = sw.apply_vlan_config(*new)
+        assert state_of(state) == state_of(new)
+        assert state_of(emu) == state_of(new)
+        # nothing left to do
+        emu.reset_stats()
+        sw.apply_vlan_config(*new, current=state)
+        assert not any(method == 'POST' for method, _ in emu.requests)
+
+
+def test_verify_redoes_a_lost_write(model, vlan_state, emulator, connect, state_of):
+    old = vlan_state({2: (1, '1U 10T')})
+    new = vlan_state({2: (10, '1T 10U')})
+    emu = emulator(old)
+    sw = connect(emu)
+    post = sw._post_batch
+    lost = []
+
+    def lossy_post(ops):
+        # the first pvid write is answered, but never takes effect
+        if not lost and any(hasattr(op, 'pid') for op in ops):
+            lost.append(ops)
+            return
+        post(ops)
+    sw._post_batch = lossy_post
+    with sw.logged_in():
+        sw.apply_vlan_config(*new, verify=True)
+    assert lost
+    assert state_of(emu) == state_of(new)
+
+
+@pytest.mark.parametrize('applied', [False, True])
+@pytest.mark.parametrize('after', [0, 2])
+def test_rollback_undoes_the_writes(model, vlan_state, emulator, connect, state_of, fail_post, after, applied):
+    old = vlan_state({2: (10, '10U 20T'), 3: (20, '20U'), 4: (1, '1U 20T')})
+    new = vlan_state({2: (30, '30U 40T'), 3: (40, '40U'), 5: (30, '30U')})
+    emu = emulator(old)
+    sw = connect(emu)
+    fail_post(sw, after, applied)
+    with sw.logged_in():
+        with pytest.raises(ConnectionError, match='Injected'):
+            sw.apply_vlan_config(*new)
+        assert state_of(emu) != state_of(old) or after == 0 and not applied
+        emu.reset_stats()
+        sw.rollback()
+    assert state_of(emu) == state_of(old)
+    # undone post by post, no restore(and no reboot)
+    assert emu.going_down is None and emu.booting_until == 0
+    assert sw.write_log is None
+
+
+def test_restore(model, vlan_state, emulator, connect, state_of):
+    old = vlan_state({2: (10, '10U 20T')})
+    emu = emulator(old, boot_time=1., shutdown_delay=.5)
+    sw = connect(emu)
+    with sw.logged_in():
+        backup = sw.backup()
+        sw.apply_vlan_config(*vlan_state({}))
+        start = time.monotonic()
+        sw.restore(backup)
+        # back once it rebooted(GS108Ev3), or right away(GS116Ev2), not after a timeout
+        assert time.monotonic() - start < 10.
+        assert state_of(sw.fetch_state()) == state_of(old)
+    assert state_of(emu) == state_of(old)
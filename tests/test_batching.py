@@ -0,0 +1,85 @@
+# -*- encoding: utf-8 -*-
+from prosafe.switches.batching import FormLimits, batch_plan, coalesce_plan
+from prosafe.switches.general import VlanPortMembership
+from prosafe.switches.membership import MembershipTable
+from prosafe.switches.planner import AddVlan, DeleteVlan, SetMembership, SetPvid, plan_vlan_changes
+from tests.helpers import masks
+
+
+U, T, I = VlanPortMembership.UNTAGGED, VlanPortMembership.TAGGED, VlanPortMembership.IGNORED
+
+
+def test_membership_writes_merge_when_no_pvid_port_leaves():
+    plan = [
+        SetMembership(10, masks('123'), masks('12')),
+        SetPvid(4, 20, 1),
+        SetMembership(10, masks('13'), masks('123')),
+    ]
+    merged = coalesce_plan(plan, {1: 1, 2: 1, 3: 10, 4: 1}, 4)
+    assert merged == [SetMembership(10, masks('13'), masks('12')), SetPvid(4, 20, 1)]
+
+
+def test_membership_writes_stay_apart_around_a_pvid_change():
+    # port 2 leaves VLAN 10 after its pvid moved away from it
+    plan = [
+        SetMembership(20, masks('12'), masks('1')),
+        SetMembership(10, masks('12'), masks('2')),
+        SetPvid(2, 20, 10),
+        SetMembership(10, masks('1'), masks('12')),
+    ]
+    assert coalesce_plan(plan, {1: 1, 2: 10}, 2) == plan
+
+
+def test_clear_before_delete_is_kept_unless_the_model_deletes_members():
+    plan = [SetMembership(30, masks(''), masks('12')), DeleteVlan(30)]
+    pvids = {1: 1, 2: 1}
+    assert coalesce_plan(plan, pvids, 2) == plan
+    assert coalesce_plan(plan, pvids, 2, deletes_members=True) == [DeleteVlan(30)]
+
+
+def test_batch_plan_packs_by_form_limits():
+    plan = [AddVlan(10), AddVlan(20),
+            SetPvid(1, 10, 1), SetPvid(2, 10, 1), SetPvid(3, 20, 1), SetPvid(1, 20, 10),
+            DeleteVlan(30), DeleteVlan(40)]
+    posts = batch_plan(plan, FormLimits(vlans_added=1, vlans_deleted=None, pvid_values=1))
+    assert posts == [
+        [AddVlan(10)], [AddVlan(20)],
+        # port 1 is set twice, its second write waits for a post of its own
+        [SetPvid(1, 10, 1), SetPvid(2, 10, 1)], [SetPvid(3, 20, 1)], [SetPvid(1, 20, 10)],
+        [DeleteVlan(30), DeleteVlan(40)],
+    ]
+    posts = batch_plan(plan, FormLimits(vlans_added=None, vlans_deleted=1, pvid_values=None))
+    assert len(posts) == 1 + 2 + 2
+
+
+def test_planned_cleanup_saves_posts():
+    # every access port moves back to VLAN 1, their VLANs go away
+    old = MembershipTable.from_config({
+        1: {1: U, 2: I, 3: I, 4: I}, 10: {1: T, 2: U, 3: I, 4: I}, 20: {1: T, 2: I, 3: U, 4: U}})
+    new = MembershipTable.from_config({1: {1: U, 2: U, 3: U, 4: U}})
+    old_pvids = {1: 1, 2: 10, 3: 20, 4: 20}
+    plan = plan_vlan_changes(old, old_pvids, new, {pid: 1 for pid in range(1, 5)}, 4, two_step=True)
+    gs108 = FormLimits(vlans_added=1, vlans_deleted=None, pvid_values=1)
+    posts = batch_plan(coalesce_plan(plan, old_pvids, 4), gs108)
+    # VLAN 1 once, pvids in one post, both VLANs cleared then deleted in one post
+    assert len(plan) == 1 + 3 + 2 + 2
+    assert len(posts) == 1 + 1 + 2 + 1
+
+
+def test_apply_reports_and_saves_posts(model, vlan_state, emulator, connect):
+    old = vlan_state({pid: (10 + pid % 4, f'{10 + pid % 4}U') for pid in range(2, 8)})
+    new = vlan_state({})
+    results = []
+    for batched in (True, False):
+        emu = emulator(old)
+        sw = connect(emu)
+        if not batched:
+            sw._write_batches = lambda plan, pvids=None: [[op] for op in plan]
+        with sw.logged_in():
+            emu.reset_stats()
+            sw.apply_vlan_config(*new)
+            results.append((emu.request_count, sw.write_stats))
+        assert emu.vlans == new[0] and emu.pvids == new[1]
+    (batched_requests, stats), (unbatched_requests, _) = results
+    assert stats.saved > 0
+    assert unbatched_requests - batched_requests == stats.saved
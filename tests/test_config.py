@@ -0,0 +1,44 @@
+# -*- encoding: utf-8 -*-
+import pytest
+
+from prosafe.vlan_config import load_config
+
+
+def _load(tmp_path, ports: str):
+    path = tmp_path / 'config.toml'
+    path.write_text(f'''
+[profiles.access10]
+pvid = 10
+vlans = ['10U']
+
+[switches.sw]
+address = '192.0.2.1'
+password = 'password'
+model = 'gs108ev3'
+
+[switches.sw.ports]
+{ports}
+''')
+    return load_config(str(path))
+
+
+def test_port_profiles(tmp_path):
+    cfg = _load(tmp_path, '''
+1 = {pvid = 1, vlans = ['1U', '10T']}
+2 = 'access10'
+3 = {profile = 'access10', vlans = ['10U', '20T']}
+''')['sw']
+    assert cfg.ports[2].pvid == 10 and cfg.ports[2].vlans.notes() == ['10U']
+    assert cfg.ports[3].pvid == 10 and cfg.ports[3].vlans.notes() == ['10U', '20T']
+
+
+@pytest.mark.parametrize('spec, error', [
+    ('5', 'should be a profile name or a table'),
+    ("{pvid = 1, vlans = ['1U', ['10T']]}", 'vlans should be a list'),
+    ("{pvid = [1], vlans = ['1U']}", 'pvid should be a VLAN id'),
+    ("{profile = ['access10']}", 'profile should be a profile name'),
+    ("'trunk'", 'profile trunk not found'),
+])
+def test_malformed_port_specs(tmp_path, spec, error):
+    with pytest.raises(AssertionError, match=f'Switch sw port 1: {error}'):
+        _load(tmp_path, f'1 = {spec}')
@@ -0,0 +1,84 @@
+# -*- encoding: utf-8 -*-
+import pytest
+
+from prosafe.fleet import SwitchStatus, apply_switch
+from prosafe.journal import ApplyJournal, target_digest
+from prosafe.state_cache import StateCache
+
+
+class _BrokenCache(StateCache):
+    def remember(self, *args):
+        raise TimeoutError("Backup download timed out")
+
+
+def test_cache_failure_keeps_the_apply(model, vlan_state, emulator, switch_config, state_of, tmp_path):
+    ports = {2: (10, '10U 20T'), 3: (20, '20U')}
+    emu = emulator()
+    result = apply_switch('sw', switch_config(emu, ports), False, None, state_cache=_BrokenCache(tmp_path))
+    assert result.status == SwitchStatus.OK
+    assert state_of(emu) == state_of(vlan_state(ports))
+
+
+class _BrokenJournal(ApplyJournal):
+    def finish(self, *args):
+        raise OSError("No space left on device")
+
+
+def test_journal_failure_keeps_the_apply(model, vlan_state, emulator, switch_config, state_of, tmp_path):
+    ports = {2: (10, '10U 20T'), 3: (20, '20U')}
+    emu = emulator()
+    result = apply_switch('sw', switch_config(emu, ports), False, None, journal=_BrokenJournal(tmp_path))
+    assert result.status == SwitchStatus.OK
+    assert state_of(emu) == state_of(vlan_state(ports))
+
+
+def _interrupted_run(sw_cfg, journal, fail_post, after: int = 2):
+    """an apply of sw_cfg that died after some posts, journaled"""
+    sw = sw_cfg.connect()
+    target = target_digest(sw_cfg.get_membership_table(), sw_cfg.get_pvids())
+    sw.journal = journal.recorder(sw.session_key, target)
+    fail_post(sw, after)
+    with sw.logged_in():
+        with pytest.raises(ConnectionError):
+            sw.apply_vlan_config(sw_cfg.get_membership_table(), sw_cfg.get_pvids())
+    return sw.session_key, target
+
+
+def test_resume_finishes_the_apply(model, vlan_state, emulator, switch_config, state_of, fail_post, tmp_path):
+    old_ports = {2: (10, '10U 20T'), 3: (20, '20U'), 4: (1, '1U 20T')}
+    new_ports = {2: (30, '30U 40T'), 3: (40, '40U'), 5: (30, '30U')}
+    emu = emulator(vlan_state(old_ports))
+    sw_cfg = switch_config(emu, new_ports)
+    journal = ApplyJournal(tmp_path)
+    key, target = _interrupted_run(sw_cfg, journal, fail_post)
+    result = apply_switch('sw', sw_cfg, False, None, journal=journal, resume=True)
+    assert result.status == SwitchStatus.OK
+    assert state_of(emu) == state_of(vlan_state(new_ports))
+    assert journal.finished(key, target)
+
+
+def test_failed_resume_without_backup_rolls_back(model, vlan_state, emulator, connect, switch_config, state_of,
+                                                 fail_post, monkeypatch, tmp_path):
+    old_ports = {2: (10, '10U 20T'), 3: (20, '20U'), 4: (1, '1U 20T')}
+    emu = emulator(vlan_state(old_ports))
+    sw_cfg = switch_config(emu, {2: (30, '30U 40T'), 3: (40, '40U'), 5: (30, '30U')})
+    journal = ApplyJournal(tmp_path)
+    key, target = _interrupted_run(sw_cfg, journal, fail_post)
+
+    post = type(connect(emu))._post_batch
+    resumed = []
+
+    def failing_post(self, ops):
+        # the rollback posts go through
+        if self.write_log is not None and not resumed:
+            resumed.append(ops)
+            raise ConnectionError("Injected failure of the resumed apply")
+        post(self, ops)
+    monkeypatch.setattr(type(connect(emu)), '_post_batch', failing_post)
+    result = apply_switch('sw', sw_cfg, False, None, journal=journal, resume=True)
+    assert resumed
+    # back where the interrupted run started, not where it stopped
+    assert result.status == SwitchStatus.ROLLED_BACK
+    assert state_of(emu) == state_of(vlan_state(old_ports))
+    assert emu.going_down is None
+    assert journal.interrupted(key, target) is None
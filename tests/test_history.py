@@ -0,0 +1,76 @@
+# -*- encoding: utf-8 -*-
+import random
+
+import pytest
+
+from prosafe.history import CounterRing, HistoryStore, counter_delta, counter_deltas
+from prosafe.switches.general import PortCounters
+
+
+@pytest.mark.parametrize('bits', [32, 64])
+def test_counter_delta(bits):
+    top = (1 << bits) - 1
+    assert counter_delta(100, 250, bits) == 150
+    # wrapped around
+    assert counter_delta(top - 9, 5, bits) == 15
+    # cleared, or the switch rebooted
+    assert counter_delta(1 << (bits - 1), 7, bits) == 7
+    assert counter_delta(5, 5, bits) == 0
+
+
+@pytest.mark.parametrize('bits', [32, 64])
+def test_counter_deltas_is_pairwise_counter_delta(bits):
+    rnd = random.Random(bits)
+    column = [0]
+    for _ in range(2000):
+        r = rnd.random()
+        if r < .02:
+            column.append(rnd.randrange(100))
+        else:
+            column.append((column[-1] + rnd.randrange(1 << (bits - 4))) % (1 << bits))
+    expected = [counter_delta(a, b, bits) for a, b in zip(column, column[1:])]
+    assert counter_deltas(column, bits) == expected
+    assert counter_deltas([], bits) == counter_deltas([1], bits) == []
+
+
+def test_ring_keeps_the_last_samples(tmp_path):
+    ring = CounterRing(tmp_path / 'sw.ring', port_count=2, capacity=5, counter_bits=32)
+    for i in range(8):
+        assert ring.append(1000. + i, {1: PortCounters(i * 100, i * 10, 0), 2: PortCounters(0, 0, i)})
+    assert not ring.append(1003., {})
+    assert len(ring) == 5
+    assert list(ring.times()) == [1003000, 1004000, 1005000, 1006000, 1007000]
+    assert list(ring.column(1, 0)) == [300, 400, 500, 600, 700]
+    assert list(ring.column(2, 2, start=1005., end=1006.)) == [5, 6]
+    rates = ring.rates(1)
+    assert [(r.time, r.interval, r.rx_bytes, r.tx_bytes) for r in rates] == \
+        [(1000. + i, 1., 100, 10) for i in range(4, 8)]
+    assert rates[0].rx_rate == 100.
+    ring.close()
+
+    # reopened with its own size
+    ring = CounterRing(tmp_path / 'sw.ring', port_count=8, capacity=100)
+    assert (ring.port_count, ring.capacity, ring.counter_bits, len(ring)) == (2, 5, 32, 5)
+    assert ring.last_time() == 1007.
+    ring.close()
+
+
+def test_ring_rates_across_a_wrap(tmp_path):
+    ring = CounterRing(tmp_path / 'sw.ring', port_count=1, capacity=10, counter_bits=32)
+    for t, rx in enumerate([(1 << 32) - 200, (1 << 32) - 100, 50, 150]):
+        ring.append(t, {1: PortCounters(rx, 0, 0)})
+    assert [r.rx_bytes for r in ring.rates(1)] == [100, 150, 100]
+    ring.close()
+
+
+def test_store(tmp_path):
+    store = HistoryStore(tmp_path, capacity=10)
+    assert store.append('a', 2, 1., {1: PortCounters(1, 2, 3)})
+    assert store.append('b', 4, 1., {})
+    assert store.ring('a').port_count == 2
+    with pytest.raises(AssertionError):
+        store.ring('c')
+    store.close()
+    store = HistoryStore(tmp_path, capacity=10)
+    assert list(store.ring('a').column(1, 2)) == [3]
+    store.close()
@@ -0,0 +1,68 @@
+# -*- encoding: utf-8 -*-
+import pytest
+
+from prosafe.journal import ApplyJournal, target_digest
+from prosafe.switches.general import WriteLog
+from prosafe.switches.membership import MembershipTable, PortMasks
+from prosafe.switches.planner import AddVlan, DeleteVlan, SetMembership, SetPvid
+
+
+def _log() -> WriteLog:
+    before = MembershipTable.from_config({1: {1: 1, 2: 1}}), {1: 1, 2: 1}
+    return WriteLog(before, {'two_step': True, 'keep_vids': []},
+                    planned=[AddVlan(10), SetMembership(10, PortMasks(0b110, 0b100), PortMasks()),
+                             SetPvid(1, 10, 1), DeleteVlan(20)],
+                    written=[AddVlan(10)],
+                    in_flight=[SetMembership(10, PortMasks(0b110, 0b100), PortMasks())])
+
+
+def test_interrupted_apply_round_trip(tmp_path):
+    journal = ApplyJournal(tmp_path)
+    log = _log()
+    journal.recorder('sw', 'target')(log)
+    assert journal.interrupted('sw', 'target') == log
+    assert not journal.finished('sw', 'target')
+    # only for the same switch and configuration
+    assert journal.interrupted('sw', 'other') is None
+    assert journal.interrupted('other', 'target') is None
+
+    journal.finish('sw', 'target')
+    assert journal.finished('sw', 'target')
+    assert journal.interrupted('sw', 'target') is None
+    journal.drop('sw')
+    assert not journal.finished('sw', 'target')
+
+
+def test_entries_expire(tmp_path):
+    ApplyJournal(tmp_path).recorder('sw', 'target')(_log())
+    assert ApplyJournal(tmp_path, ttl=-1).interrupted('sw', 'target') is None
+    assert ApplyJournal(tmp_path).interrupted('sw', 'target') is not None
+
+
+@pytest.mark.parametrize('applied', [False, True])
+def test_resume_finishes_an_interrupted_apply(model, vlan_state, emulator, connect, state_of, fail_post,
+                                              tmp_path, applied):
+    old = vlan_state({2: (10, '10U 20T'), 3: (20, '20U'), 4: (1, '1U 20T')})
+    new = vlan_state({2: (30, '30U 40T'), 3: (40, '40U'), 5: (30, '30U')})
+    target = target_digest(MembershipTable.of(new[0], model.port_count), new[1])
+    journal = ApplyJournal(tmp_path)
+    emu = emulator(old)
+
+    sw = connect(emu)
+    sw.journal = journal.recorder(sw.session_key, target)
+    fail_post(sw, 2, applied)
+    with sw.logged_in():
+        with pytest.raises(ConnectionError, match='Injected'):
+            sw.apply_vlan_config(*new)
+
+    # the next run
+    sw = connect(emu)
+    log = journal.interrupted(sw.session_key, target)
+    assert log is not None and len(log.in_flight) > 0
+    sw.journal = journal.recorder(sw.session_key, target)
+    with sw.logged_in():
+        state = sw.resume(log)
+        assert state_of(state) == state_of(emu)
+        state = sw.apply_vlan_config(*new, current=state)
+    assert state_of(state) == state_of(emu) == state_of(new)
+    assert sw.write_log is log
@@ -0,0 +1,62 @@
+# -*- encoding: utf-8 -*-
+import pytest
+
+from prosafe.switches.general import VlanPortMembership
+from prosafe.switches.membership import MembershipTable, PortMasks, all_ports
+
+
+U, T, I = VlanPortMembership.UNTAGGED, VlanPortMembership.TAGGED, VlanPortMembership.IGNORED
+
+
+def test_port_masks_round_trip():
+    config = {1: U, 2: T, 3: I, 4: T}
+    masks = PortMasks.from_dict(config)
+    assert masks == PortMasks(0b10110, 0b10100)
+    assert masks.untagged == 0b00010
+    assert masks.to_dict(4) == config
+    assert masks.to_string(4) == '1232'
+    assert PortMasks.from_string('1232') == masks
+    assert [masks.port(pid) for pid in range(1, 5)] == [U, T, I, T]
+
+
+def test_port_masks_merge_prefers_untagged():
+    a = PortMasks.from_dict({1: U, 2: T, 3: I})
+    b = PortMasks.from_dict({1: T, 2: U, 3: T})
+    assert a.merge(b).to_dict(3) == {1: U, 2: U, 3: T}
+
+
+def test_port_masks_changes():
+    a = PortMasks.from_dict({1: U, 2: T, 3: I})
+    b = PortMasks.from_dict({1: U, 2: U, 3: T})
+    assert a.changed_ports(b) == 0b1100
+    assert a.with_ports(1 << 3, b).to_dict(3) == {1: U, 2: T, 3: T}
+    assert all_ports(3) == 0b1110
+
+
+def test_membership_table_keeps_vids_ordered():
+    table = MembershipTable(4)
+    for vid in (30, 1, 20):
+        table[vid] = PortMasks(0b10)
+    assert list(table) == [1, 20, 30]
+    table[20] = PortMasks(0b110, 0b100)
+    assert table[20] == PortMasks(0b110, 0b100)
+    del table[1]
+    assert list(table) == [20, 30] and 1 not in table
+    assert table.get(1) is None
+    with pytest.raises(KeyError):
+        table[1]
+    assert table.port_vids(1) == [20, 30]
+    assert table.port_vids(2) == [20]
+    assert table.active_ports() == 0b110
+
+
+def test_membership_table_config_round_trip():
+    config = {1: {1: U, 2: U, 3: I}, 10: {1: T, 2: I, 3: U}}
+    table = MembershipTable.from_config(config)
+    assert table.port_count == 3
+    assert table.to_config() == config
+    copy = table.copy()
+    assert copy == table
+    copy[10] = PortMasks()
+    assert copy != table
+    assert MembershipTable.of(table, 3) is table
@@ -0,0 +1,100 @@
+# -*- encoding: utf-8 -*-
+import random
+
+import pytest
+
+from prosafe.switches.membership import MembershipTable, PortMasks
+from prosafe.switches.planner import (AddVlan, DeleteVlan, SetMembership, SetPvid, plan_vlan_changes,
+                                      simulate_plan)
+from tests.helpers import masks
+
+
+def table(port_count: int, vlans: dict) -> MembershipTable:
+    result = MembershipTable(port_count)
+    for vid, m in vlans.items():
+        result[vid] = m
+    return result
+
+
+def test_unchanged_state_needs_nothing():
+    vlans = table(4, {1: masks('1234'), 10: masks('34', '4')})
+    pvids = {1: 1, 2: 1, 3: 10, 4: 1}
+    assert plan_vlan_changes(vlans, pvids, vlans.copy(), dict(pvids), 4) == []
+
+
+def test_one_step_order():
+    old = table(2, {1: masks('12'), 30: masks('2', '2')})
+    new = table(2, {1: masks('1'), 20: masks('2')})
+    plan = plan_vlan_changes(old, {1: 1, 2: 1}, new, {1: 1, 2: 20}, 2)
+    assert plan == [
+        AddVlan(20),
+        SetMembership(1, masks('1'), masks('12')),
+        SetMembership(20, masks('2'), masks('')),
+        SetPvid(2, 20, 1),
+        DeleteVlan(30),
+    ]
+
+
+def test_two_step_keeps_the_pvid_vlan_until_the_pvid_moved():
+    old = table(2, {1: masks('12'), 30: masks('2', '2')})
+    new = table(2, {1: masks('1'), 20: masks('2')})
+    plan = plan_vlan_changes(old, {1: 1, 2: 1}, new, {1: 1, 2: 20}, 2, two_step=True)
+    assert plan == [
+        AddVlan(20),
+        SetMembership(20, masks('2'), masks('')),
+        SetPvid(2, 20, 1),
+        SetMembership(1, masks('1'), masks('12')),
+        SetMembership(30, masks(''), masks('2', '2')),
+        DeleteVlan(30),
+    ]
+    # port 2 is a member of its pvid VLAN after every single operation
+    for i in range(1, len(plan) + 1):
+        vlans, pvids = simulate_plan(old, {1: 1, 2: 1}, plan[:i], 2)
+        assert vlans[pvids[2]].member >> 2 & 1
+
+
+def test_omitted_ports_keep_their_pvid_vlan():
+    old = table(3, {1: masks('12'), 10: masks('3'), 20: masks('3', '3')})
+    # port 3 is IGNORED everywhere in the new config
+    new = table(3, {1: masks('12'), 30: masks('1', '1')})
+    plan = plan_vlan_changes(old, {1: 1, 2: 1, 3: 10}, new, {1: 1, 2: 1}, 3, preserve_omitted_ports=True)
+    assert plan == [AddVlan(30), SetMembership(30, masks('1', '1'), masks('')), DeleteVlan(20)]
+    vlans, pvids = simulate_plan(old, {1: 1, 2: 1, 3: 10}, plan, 3)
+    assert vlans[10] == masks('3') and pvids[3] == 10
+
+    plan = plan_vlan_changes(old, {1: 1, 2: 1, 3: 10}, new, {1: 1, 2: 1}, 3)
+    assert DeleteVlan(10) in plan
+
+
+def test_keep_vids_are_never_deleted():
+    old = table(2, {1: masks('12'), 99: masks('2', '2')})
+    new = table(2, {1: masks('12')})
+    assert plan_vlan_changes(old, {1: 1, 2: 1}, new, {1: 1, 2: 1}, 2, keep_vids=[99]) == []
+    assert plan_vlan_changes(old, {1: 1, 2: 1}, new, {1: 1, 2: 1}, 2) == [DeleteVlan(99)]
+
+
+def _random_state(rnd: random.Random, port_count: int):
+    vlans = table(port_count, {1: PortMasks()})
+    for vid in rnd.sample(range(2, 40), rnd.randrange(6)):
+        vlans[vid] = PortMasks()
+    pvids = dict()
+    for pid in range(1, port_count + 1):
+        bit = 1 << pid
+        pvids[pid] = pvid = rnd.choice(list(vlans))
+        for vid in vlans:
+            m = vlans[vid]
+            if vid == pvid:
+                vlans[vid] = PortMasks(m.member | bit, m.tagged)
+            elif rnd.random() < .3:
+                vlans[vid] = PortMasks(m.member | bit, m.tagged | bit)
+    return vlans, pvids
+
+
+@pytest.mark.parametrize('two_step', [False, True])
+def test_plans_reach_the_target(two_step):
+    rnd = random.Random(1)
+    for _ in range(200):
+        port_count = rnd.randrange(1, 17)
+        old, new = _random_state(rnd, port_count), _random_state(rnd, port_count)
+        plan = plan_vlan_changes(*old, *new, port_count, two_step=two_step)
+        assert simulate_plan(*old, plan, port_count) == new
@@ -0,0 +1,56 @@
+# -*- encoding: utf-8 -*-
+import pydantic
+import pytest
+
+from prosafe.switches.general import VlanPortMembership
+from prosafe.switches.ranges import VlanRanges
+from prosafe.vlan_config import SwitchVlanConfig
+
+
+U, T, I = VlanPortMembership.UNTAGGED, VlanPortMembership.TAGGED, VlanPortMembership.IGNORED
+
+
+def test_adjacent_runs_are_joined():
+    ranges = VlanRanges([(100, 199, T), (1, 1, U), (200, 399, T), (400, 400, I)])
+    assert list(ranges.runs()) == [(1, 1, U), (100, 399, T), (400, 400, I)]
+    assert ranges.notes() == ['1U', '100-399T', '400N']
+    assert len(ranges) == 1 + 300 + 1
+
+
+def test_lookup_like_a_dict():
+    ranges = VlanRanges([(10, 19, T)])
+    assert ranges[10] == ranges[19] == T
+    assert 9 not in ranges and 20 not in ranges
+    assert ranges.get(20, U) == U
+    with pytest.raises(KeyError):
+        ranges[20]
+    assert list(ranges) == list(range(10, 20))
+    assert ranges == {vid: T for vid in range(10, 20)}
+    assert VlanRanges.from_items(dict.fromkeys(range(10, 20), T).items()) == ranges
+
+
+def test_overlapping_runs_are_refused():
+    with pytest.raises(AssertionError):
+        VlanRanges([(1, 10, T), (10, 20, U)])
+
+
+def _port(*notes: str, pvid: int = 1) -> SwitchVlanConfig:
+    return SwitchVlanConfig.model_validate({
+        'address': '192.0.2.1', 'password': 'password', 'model': 'gs108ev3',
+        'ports': {1: {'pvid': pvid, 'vlans': list(notes)}},
+    })
+
+
+def test_config_notes():
+    cfg = _port('1U', '100-399T', '400T')
+    assert cfg.ports[1].vlans.notes() == ['1U', '100-400T']
+    table = cfg.get_membership_table()
+    assert len(table) == 302
+    assert table[250].tagged == 1 << 1
+
+
+@pytest.mark.parametrize('notes', [['1U', '0T'], ['1U', '4095T'], ['1U', '70000U'], ['1U', '5-4095T'],
+                                   ['1U', '20-10T'], ['1U', '5T', '1-9U'], ['1X']])
+def test_config_refuses_bad_notes(notes):
+    with pytest.raises(pydantic.ValidationError):
+        _port(*notes)
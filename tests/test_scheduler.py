@@ -0,0 +1,30 @@
+# -*- encoding: utf-8 -*-
+from prosafe.scheduler import FleetScheduler, TimingHistory, switch_key, vlan_count
+from prosafe.vlan_config import SwitchVlanConfig
+
+
+def _config(address: str, *notes: str) -> SwitchVlanConfig:
+    return SwitchVlanConfig.model_validate({
+        'address': address, 'password': 'password', 'model': 'gs108ev3',
+        'ports': {1: {'pvid': 1, 'vlans': ['1U', *notes]}, 2: {'pvid': 1, 'vlans': ['1U', '100-399T']}},
+    })
+
+
+def test_vlan_count_joins_the_ranges_of_all_ports():
+    assert vlan_count(_config('192.0.2.1')) == 301
+    assert vlan_count(_config('192.0.2.1', '200-499T', '4000T')) == 1 + 400 + 1
+
+
+def test_config_order_without_history():
+    cfgs = {'core': _config('192.0.2.1'), 'edge': _config('192.0.2.2', '2-4094T')}
+    assert FleetScheduler().order(cfgs) == ['core', 'edge']
+
+
+def test_slowest_first(tmp_path):
+    cfgs = {'core': _config('192.0.2.1'), 'edge': _config('192.0.2.2'), 'new': _config('192.0.2.3'),
+            'big': _config('192.0.2.4', '2-99T')}
+    history = TimingHistory(tmp_path / 'timings.json')
+    history.record(switch_key(cfgs['core']), 5.)
+    history.record(switch_key(cfgs['edge']), 20.)
+    # unknown ones first, the most VLANs first among them
+    assert FleetScheduler(history=history).order(cfgs) == ['big', 'new', 'edge', 'core']